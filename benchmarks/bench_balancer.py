@@ -0,0 +1,164 @@
+"""本地负载均衡基准: 直连假上游与经 LoadBalancer 转发的对比
+
+每个连接: 建立连接, 发送请求, 读完回显, 关闭; 统计每秒连接数与单连接耗时的百分位,
+added 为经负载均衡与直连的差值. 另测大块数据单连接吞吐, 对比 splice 与用户态拷贝
+
+python benchmarks/bench_balancer.py --upstreams 4 --connections 5000 --concurrency 16
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+from talkProxy.core import balancer  # noqa: E402
+from talkProxy.tools.common import percentile  # noqa: E402
+
+# 上游与负载均衡各自在独立进程中运行, 避免与客户端线程争用 GIL
+FAKE_UPSTREAMS = """
+import asyncio, sys
+
+async def echo(reader, writer):
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+    writer.close()
+
+async def main(count):
+    servers = [await asyncio.start_server(echo, "127.0.0.1", 0, backlog=1024) for _ in range(count)]
+    print(" ".join(str(s.sockets[0].getsockname()[1]) for s in servers), flush=True)
+    await asyncio.Event().wait()
+
+asyncio.run(main(int(sys.argv[1])))
+"""
+
+BALANCER = """
+import sys, threading
+sys.path.insert(0, sys.argv[1])
+from talkProxy.core.balancer import LoadBalancer
+strategy, use_splice, ports = sys.argv[2], sys.argv[3] == "1", sys.argv[4:]
+lb = LoadBalancer(("127.0.0.1", 0), [(f"u{i}", "127.0.0.1", int(p)) for i, p in enumerate(ports)],
+                  strategy=strategy, use_splice=use_splice)
+lb.start()
+print(lb.address[1], flush=True)
+threading.Event().wait()
+"""
+
+
+def spawn(script: str, *argv: str) -> tuple[subprocess.Popen, list[int]]:
+    """启动子进程并读取其输出的监听端口"""
+    child = subprocess.Popen([sys.executable, "-c", script, *argv], stdout=subprocess.PIPE, text=True)
+    return child, [int(port) for port in child.stdout.readline().split()]
+
+
+def request(address: tuple[str, int], payload: bytes) -> float:
+    start = time.perf_counter()
+    with socket.create_connection(address) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(payload)
+        sock.shutdown(socket.SHUT_WR)
+        while sock.recv(65536):
+            pass
+    return time.perf_counter() - start
+
+
+def run_connections(addresses: list[tuple[str, int]], count: int, concurrency: int, payload: bytes):
+    latencies: list[float] = []
+    lock = threading.Lock()
+    per_thread = count // concurrency
+
+    def worker(index: int) -> None:
+        local = [request(addresses[(index + i) % len(addresses)], payload) for i in range(per_thread)]
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - start), latencies
+
+
+def run_bulk(address: tuple[str, int], size: int) -> float:
+    """单连接上传 size 字节并读回, 返回 MB/s(按单向计)"""
+    chunk = b"\0" * 65536
+    start = time.perf_counter()
+    with socket.create_connection(address) as sock:
+
+        def send() -> None:
+            for _ in range(size // len(chunk)):
+                sock.sendall(chunk)
+            sock.shutdown(socket.SHUT_WR)
+
+        sender = threading.Thread(target=send)
+        sender.start()
+        received = 0
+        while True:
+            data = sock.recv(1024 * 1024)
+            if not data:
+                break
+            received += len(data)
+        sender.join()
+    return received / 1024 / 1024 / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--upstreams", type=int, default=4)
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--payload", type=int, default=512, help="每个连接请求的字节数")
+    parser.add_argument("--bulk", type=int, default=512, help="吞吐测试的数据量(MB), 0 表示跳过")
+    parser.add_argument("--strategy", choices=balancer.STRATEGIES, default="round_robin")
+    args = parser.parse_args()
+
+    child, ports = spawn(FAKE_UPSTREAMS, str(args.upstreams))
+    try:
+        direct = [("127.0.0.1", port) for port in ports]
+        payload = b"x" * args.payload
+        print(
+            f"upstreams={args.upstreams} connections={args.connections} concurrency={args.concurrency} "
+            f"payload={args.payload}B strategy={args.strategy} splice={balancer.SPLICE}"
+        )
+
+        modes = [("direct", None)] + [("splice", True)] * balancer.SPLICE + [("copy", False)]
+        baseline = None
+        for mode, use_splice in modes:
+            lb = None
+            addresses = direct
+            if use_splice is not None:
+                lb, (port,) = spawn(BALANCER, SRC, args.strategy, str(int(use_splice)), *map(str, ports))
+                addresses = [("127.0.0.1", port)]
+            try:
+                rate, latencies = run_connections(addresses, args.connections, args.concurrency, payload)
+                p50, p99 = percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000
+                line = f"{mode:7s} conn/s={rate:,.0f} p50={p50:.3f}ms p99={p99:.3f}ms"
+                if baseline is None:
+                    baseline = (p50, p99)
+                else:
+                    line += f" added_p50={p50 - baseline[0]:+.3f}ms added_p99={p99 - baseline[1]:+.3f}ms"
+                if args.bulk:
+                    line += f" bulk={run_bulk(addresses[0], args.bulk * 1024 * 1024):,.0f}MB/s"
+                print(line)
+            finally:
+                if lb is not None:
+                    lb.kill()
+                    lb.wait()
+    finally:
+        child.kill()
+        child.wait()
+
+
+if __name__ == "__main__":
+    main()
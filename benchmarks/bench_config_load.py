@@ -0,0 +1,77 @@
+"""冷启动配置读取基准: 纯 Python 解析、libyaml 解析与二进制解析缓存
+
+python benchmarks/bench_config_load.py --subscriptions 30 --nodes 1000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from talkProxy.tools import yaml_backend  # noqa: E402
+
+
+def make_subscriptions(subscriptions: int, nodes: int) -> dict:
+    return {
+        "subscription": [
+            {
+                "name": f"sub{i}",
+                "url": f"https://sub{i}.example.com/list",
+                "updateInterval": "3600",
+                "lastUpdate": 1700000000 + i,
+                "files": [
+                    {"name": f"sub{i}-node{j}", "type": "hysteria2", "path": f"/opt/talkProxy/config/{i:04d}{j:06d}.yaml", "key": f"{i:032x}{j:032x}"}
+                    for j in range(nodes)
+                ],
+            }
+            for i in range(subscriptions)
+        ]
+    }
+
+
+def timed(func: callable, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscriptions", type=int, default=30)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "subscription.yaml")
+        with open(path, "w") as f:
+            f.write(yaml_backend.dump(make_subscriptions(args.subscriptions, args.nodes)))
+        size = os.path.getsize(path)
+
+        def pure_python():
+            with open(path, "rb") as f:
+                return yaml.safe_load(f)
+
+        def libyaml():
+            return yaml_backend.load_file(path, use_cache=False)
+
+        def cached():
+            return yaml_backend.load_file(path)
+
+        # 预先生成缓存文件
+        cached()
+        print(f"subscription.yaml: {args.subscriptions} subscriptions x {args.nodes} nodes, {size / 1024**2:.2f} MiB, libyaml={yaml_backend.LIBYAML}")
+        print(f"{'mode':>12} {'time ms':>10}")
+        for mode, func in (("pure-python", pure_python), ("libyaml", libyaml), ("cache", cached)):
+            print(f"{mode:>12} {timed(func, args.repeat) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""配置写入基准: 新增一个 N 节点订阅时的系统调用数与耗时
+
+baseline     原实现: 每次修改覆盖写入并重新读取解析
+atomic       逐次原子写入(临时文件 + fsync + rename), 不重新读取
+transaction  ConfigTransaction 内批量修改, 每个文件只写入一次
+
+系统调用计数来自 /proc/self/io(read/write 次数)与审计钩子(open/rename/remove), fsync 与 sync 合并计数
+
+python benchmarks/bench_config_write.py --nodes 500
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from unittest import mock
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from talkProxy.tools import config  # noqa: E402
+from talkProxy.tools.config import BaseConfig, ConfigTransaction, GlobalConfig, Subscription  # noqa: E402
+from talkProxy.tools.settingReader import SettingReader  # noqa: E402
+
+counter: Counter = Counter()
+
+
+def audit(event: str, args: tuple) -> None:
+    if event in ("open", "os.rename", "os.remove"):
+        counter[event] += 1
+
+
+def proc_io() -> Counter:
+    result = Counter()
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key in ("syscr", "syscw"):
+                    result[key] = int(value)
+    except OSError:
+        pass
+    return result
+
+
+def legacy_save(self: BaseConfig) -> bool:
+    with open(self.file_path, "w") as f:
+        yaml.dump(self.config, f)
+    return self.reload_config()
+
+
+def legacy_hysteria2_init(original: callable) -> callable:
+    def init(self: BaseConfig, file_path: str, **kwargs: dict) -> None:
+        # 原实现在生成节点配置前会先创建并读取空文件
+        BaseConfig.__init__(self, file_path)
+        original(self, file_path, **kwargs)
+
+    return init
+
+
+def proxies(count: int) -> dict:
+    return {"proxies": [{"name": f"node{i}", "type": "hysteria2", "server": f"{i}.example:443", "password": "pw"} for i in range(count)]}
+
+
+def run(mode: str, count: int) -> tuple[float, Counter]:
+    with tempfile.TemporaryDirectory() as tmp, mock.patch.object(config, "config_dir_path", tmp):
+        setting_path = os.path.join(tmp, "config.yaml")
+        with open(setting_path, "w") as f:
+            yaml.dump({"httpPort": 7899, "socksPort": 7900}, f)
+        SettingReader.InitConfig(setting_path)
+        global_config = GlobalConfig.__new__(GlobalConfig)
+        subscription_config = BaseConfig(os.path.join(tmp, "subscription.yaml"))
+        subscription_config.config["subscription"] = []
+        remote = proxies(count)
+        patches = []
+        if mode == "baseline":
+            patches.append(mock.patch.object(BaseConfig, "save_config", legacy_save))
+            patches.append(
+                mock.patch.object(config.Hysteria2Config, "__init__", legacy_hysteria2_init(config.Hysteria2Config.__init__))
+            )
+        fsync = os.fsync
+
+        def counted_fsync(fd: int) -> None:
+            counter["fsync"] += 1
+            fsync(fd)
+
+        sync = getattr(os, "sync", None)
+
+        def counted_sync() -> None:
+            counter["fsync"] += 1
+            sync()
+
+        patches.append(mock.patch.object(os, "fsync", counted_fsync))
+        if sync is not None:
+            patches.append(mock.patch.object(os, "sync", counted_sync))
+        for patch in patches:
+            patch.start()
+        counter.clear()
+        io_before = proc_io()
+        start = time.perf_counter()
+        try:
+            if mode == "transaction":
+                with ConfigTransaction():
+                    subscription: Subscription = global_config.build_subscription("sub", "url", "10", remote)
+                    subscription_config.config["subscription"].append(subscription.to_dict())
+                    subscription_config.save_config()
+            else:
+                subscription = global_config.build_subscription("sub", "url", "10", remote)
+                subscription_config.config["subscription"].append(subscription.to_dict())
+                subscription_config.save_config()
+        finally:
+            elapsed = time.perf_counter() - start
+            io_after = proc_io()
+            for patch in reversed(patches):
+                patch.stop()
+        stats = Counter(counter)
+        stats.update(io_after)
+        stats.subtract(io_before)
+        return elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, nargs="+", default=[100, 500])
+    args = parser.parse_args()
+    sys.addaudithook(audit)
+    print(f"{'nodes':>6} {'mode':>12} {'time s':>8} {'open':>6} {'read':>7} {'write':>7} {'rename':>7} {'fsync':>6}")
+    for count in args.nodes:
+        for mode in ("baseline", "atomic", "transaction"):
+            elapsed, stats = run(mode, count)
+            print(
+                f"{count:>6} {mode:>12} {elapsed:>8.3f} {stats['open']:>6} {stats['syscr']:>7} "
+                f"{stats['syscw']:>7} {stats['os.rename']:>7} {stats['fsync']:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""连接表刷新基准: 合成的 1 万条连接, 每轮有一部分关闭、新建和状态变化
+
+diff     ConnectionTable.apply 只为变化的条目构造对象并产生差异
+rebuild  每轮重新构造整张表(旧做法), 界面需全部重绘
+
+python benchmarks/bench_connections.py --connections 10000 --churn 0.02 --ticks 60
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+from talkProxy.core.connections import Connection, ConnectionTable  # noqa: E402
+from talkProxy.tools.common import percentile  # noqa: E402
+
+STATUSES = ("ESTABLISHED", "FIN_WAIT1", "FIN_WAIT2", "TIME_WAIT", "CLOSE_WAIT")
+
+
+class SyntheticSource:
+    """模拟若干实例的连接, 每次调用按比例关闭旧连接、打开新连接并改变部分状态"""
+
+    def __init__(self, count: int, churn: float, update: float, owners: int, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.churn = churn
+        self.update = update
+        self.owners = [f"node{i}" for i in range(owners)]
+        self.next_port = 10000
+        self.conns = dict(self._new() for _ in range(count))
+
+    def _new(self) -> tuple:
+        self.next_port += 1
+        owner = self.rng.choice(self.owners)
+        key = (owner, "tcp", f"127.0.0.1:{self.next_port % 65536}.{self.next_port // 65536}", f"10.0.{self.rng.randrange(256)}.{self.rng.randrange(256)}:443")
+        return key, (1000 + self.owners.index(owner), "ESTABLISHED")
+
+    def __call__(self) -> dict:
+        keys = list(self.conns)
+        count = int(len(keys) * self.churn)
+        for key in self.rng.sample(keys, count):
+            del self.conns[key]
+        for _ in range(count):
+            key, value = self._new()
+            self.conns[key] = value
+        for key in self.rng.sample(list(self.conns), int(len(self.conns) * self.update)):
+            self.conns[key] = (self.conns[key][0], self.rng.choice(STATUSES))
+        # 与真实来源一样每轮返回新的 dict
+        return dict(self.conns)
+
+
+def run(mode: str, args: argparse.Namespace) -> None:
+    source = SyntheticSource(args.connections, args.churn, args.update, args.owners, args.seed)
+    table = ConnectionTable()
+    table.apply(source())
+    times, changes = [], 0
+    rows: list[Connection] = []
+    for _ in range(args.ticks):
+        snapshot = source()
+        start = time.perf_counter()
+        if mode == "diff":
+            diff = table.apply(snapshot)
+            changes += len(diff.opened) + len(diff.updated) + len(diff.closed)
+        else:
+            now = time.time()
+            rows = [Connection(*key, pid, status, now) for key, (pid, status) in snapshot.items()]
+            changes += len(rows)
+        times.append(time.perf_counter() - start)
+    mean = sum(times) / len(times)
+    print(
+        f"{mode:8s} mean={mean * 1000:.2f}ms p99={percentile(times, 99) * 1000:.2f}ms "
+        f"rows_per_tick={changes / args.ticks:,.0f} cpu_at_1hz={mean:.2%}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--churn", type=float, default=0.02, help="每轮关闭并新建的连接比例")
+    parser.add_argument("--update", type=float, default=0.01, help="每轮状态变化的连接比例")
+    parser.add_argument("--owners", type=int, default=4)
+    parser.add_argument("--ticks", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"connections={args.connections} churn={args.churn} update={args.update} ticks={args.ticks}")
+    for mode in ("diff", "rebuild"):
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""子进程日志读取基准: 多个假 hysteria 进程以固定速率输出日志
+
+shared   所有子进程的管道由一个 selector 线程按块读取(当前实现)
+threads  每个管道一个线程逐行 readline, 写入无界队列(旧实现)
+
+python benchmarks/bench_log_reader.py --children 4 --rate 100000 --seconds 3
+"""
+
+import argparse
+import os
+import queue
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+from talkProxy.core.hysteria2 import Hysteria2  # noqa: E402
+
+# 每 10ms 输出一批, 保持给定的行速率
+FAKE_CHILD = """
+import sys, time
+rate, seconds = int(sys.argv[1]), float(sys.argv[2])
+line = "2024-05-01T12:00:00Z\\tINFO\\tTCP request\\t{\\"addr\\": \\"127.0.0.1:50000\\", \\"reqAddr\\": \\"example.com:443\\"}\\n"
+batch = max(rate // 100, 1)
+start = time.monotonic()
+sent = 0
+out = sys.stdout
+while True:
+    now = time.monotonic() - start
+    if now >= seconds:
+        break
+    due = int(now * rate) - sent
+    if due > 0:
+        n = min(due, batch * 4)
+        out.write(line * n)
+        out.flush()
+        sent += n
+    else:
+        time.sleep(0.005)
+"""
+
+
+def cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_shared(args: argparse.Namespace) -> tuple[int, int, int]:
+    cmd = [sys.executable, "-c", FAKE_CHILD, str(args.rate), str(args.seconds)]
+    children = [Hysteria2(cmd, log_lines=args.buffer) for _ in range(args.children)]
+    for child in children:
+        child.start()
+    time.sleep(args.seconds / 2)
+    reader_threads = sum(thread.name == "pipe-reader" for thread in threading.enumerate())
+    for child in children:
+        child.join()
+        child.stop()
+    total = sum(child.log_stats()["total"] for child in children)
+    dropped = sum(child.log_stats()["dropped"] for child in children)
+    return total, dropped, reader_threads
+
+
+def run_threads(args: argparse.Namespace) -> tuple[int, int, int]:
+    cmd = [sys.executable, "-c", FAKE_CHILD, str(args.rate), str(args.seconds)]
+    log_queue = queue.Queue()
+
+    def read_output(stream) -> None:
+        for line in iter(stream.readline, ""):
+            log_queue.put(line.strip())
+
+    processes, threads = [], []
+    for _ in range(args.children):
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        processes.append(process)
+        for stream in (process.stdout, process.stderr):
+            thread = threading.Thread(target=read_output, args=(stream,), daemon=True)
+            thread.start()
+            threads.append(thread)
+    for process in processes:
+        process.wait()
+    for thread in threads:
+        thread.join()
+    return log_queue.qsize(), 0, len(threads)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--children", type=int, default=4)
+    parser.add_argument("--rate", type=int, default=100000, help="每个子进程每秒输出的行数")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--buffer", type=int, default=10000, help="每个实例的环形缓冲行数")
+    parser.add_argument("--mode", choices=("shared", "threads", "both"), default="both")
+    args = parser.parse_args()
+
+    modes = ("shared", "threads") if args.mode == "both" else (args.mode,)
+    expected = int(args.children * args.rate * args.seconds)
+    print(f"children={args.children} rate={args.rate}/s seconds={args.seconds} expected={expected} lines")
+    for mode in modes:
+        cpu_start, wall_start = cpu_time(), time.perf_counter()
+        total, dropped, threads = (run_shared if mode == "shared" else run_threads)(args)
+        wall, cpu = time.perf_counter() - wall_start, cpu_time() - cpu_start
+        print(
+            f"{mode:8s} lines={total} ({total / wall:,.0f}/s) dropped={dropped} "
+            f"reader_threads={threads} cpu={cpu:.2f}s ({cpu / wall:.0%} of one core)"
+        )
+
+
+if __name__ == "__main__":
+    main()
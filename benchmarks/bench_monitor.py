@@ -0,0 +1,53 @@
+"""监控采样基准: 装满 1 小时(3600 点)的环形缓冲上的追加与窗口查询耗时, 以及一次完整采样的耗时
+
+python benchmarks/bench_monitor.py --capacity 3600 --rounds 2000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+from talkProxy.tools.monitor import MetricsSampler, RingBuffer  # noqa: E402
+
+
+def timed(name: str, rounds: int, func) -> None:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{name:18s}{elapsed * 1e6:10.2f}us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capacity", type=int, default=3600)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    buffer = RingBuffer(args.capacity)
+    # 多绕几圈, 让数据跨越数组末尾
+    total = args.capacity * 3 + args.capacity // 3
+    for second in range(total):
+        buffer.append(second, second * 1000.0)
+    now = total - 1
+    counter = iter(range(total, total + args.rounds * 10))
+
+    print(f"capacity={args.capacity} rounds={args.rounds}")
+    timed("append", args.rounds, lambda: buffer.append(next(counter), 0.0))
+    timed("rate 1h", args.rounds, lambda: buffer.rate(3600, now))
+    timed("rate 1min", args.rounds, lambda: buffer.rate(60, now))
+    timed("window 1h", args.rounds, lambda: buffer.window(3600, now))
+    timed("percentile 1h", args.rounds // 10, lambda: buffer.percentile(99, 3600, now))
+    timed("rates 1h", args.rounds // 10, lambda: buffer.rates(3600, now))
+
+    sampler = MetricsSampler(args.capacity, pids=lambda: {"self": os.getpid()})
+    timed("sample", args.rounds // 10, sampler.sample)
+    print(f"series={len(sampler.names())} memory={len(sampler.names()) * args.capacity * 16 / 1024:.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""规则匹配基准: 随机生成的大规则集上, RuleEngine、内存映射的二进制规则集与逐条匹配的对比
+
+text      从文本解析并构建 RuleEngine 的耗时与新分配的内存
+compiled  二进制规则集已编译时 load_ruleset 的耗时与内存, 以及匹配速度
+
+python benchmarks/bench_rules.py --rules 200000 --queries 200000
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+from talkProxy.rule.compiled import load_ruleset  # noqa: E402
+from talkProxy.rule.engine import Rule, RuleEngine  # noqa: E402
+
+TLDS = ("com", "net", "org", "io", "cn", "jp")
+ACTIONS = ("DIRECT", "PROXY", "REJECT")
+
+
+def random_label(rng: random.Random) -> str:
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(rng.randint(3, 10)))
+
+
+def random_domain(rng: random.Random) -> str:
+    return f"{random_label(rng)}.{rng.choice(TLDS)}"
+
+
+def make_rules(count: int, rng: random.Random) -> tuple[list[Rule], list[str]]:
+    """按常见规则列表的比例生成: 后缀为主, 其次为 CIDR、精确域名与少量关键字"""
+    rules, domains = [], []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.55:
+            domain = random_domain(rng)
+            domains.append(domain)
+            rules.append(Rule("DOMAIN-SUFFIX", domain, rng.choice(ACTIONS)))
+        elif roll < 0.75:
+            domain = f"www.{random_domain(rng)}"
+            domains.append(domain)
+            rules.append(Rule("DOMAIN", domain, rng.choice(ACTIONS)))
+        elif roll < 0.77:
+            rules.append(Rule("DOMAIN-KEYWORD", random_label(rng), rng.choice(ACTIONS)))
+        elif roll < 0.99:
+            network = ipaddress.ip_network((rng.getrandbits(32), rng.randint(12, 24)), strict=False)
+            rules.append(Rule("IP-CIDR", str(network), rng.choice(ACTIONS)))
+        else:
+            network = ipaddress.ip_network((rng.getrandbits(128), rng.randint(24, 64)), strict=False)
+            rules.append(Rule("IP-CIDR6", str(network), rng.choice(ACTIONS)))
+    rules.append(Rule("MATCH", "", "PROXY"))
+    return rules, domains
+
+
+def make_queries(count: int, domains: list[str], rng: random.Random) -> list[tuple[str, int]]:
+    """一半命中规则中的域名(含子域名), 其余为随机域名与 IPv4 地址"""
+    queries = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.5:
+            host = rng.choice(domains)
+            if rng.random() < 0.5:
+                host = f"{random_label(rng)}.{host}"
+        elif roll < 0.75:
+            host = f"cdn.{random_domain(rng)}"
+        else:
+            host = str(ipaddress.IPv4Address(rng.getrandbits(32)))
+        queries.append((host, rng.choice((80, 443, 8080))))
+    return queries
+
+
+def measure(func, memory: bool):
+    """返回 结果, 耗时, 期间新分配且未释放的内存(MB); tracemalloc 会明显拖慢执行, 内存单独再测一次"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    if not memory:
+        return result, elapsed, None
+    del result
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    return result, elapsed, size
+
+
+def run_matches(name: str, matcher, queries: list[tuple[str, int]]) -> None:
+    start = time.perf_counter()
+    for host, port in queries:
+        matcher.match(host, port=port)
+    elapsed = time.perf_counter() - start
+    print(f"{name:9s}{len(queries) / elapsed:,.0f} match/s  {elapsed / len(queries) * 1e6:.2f}us/match")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=200000)
+    parser.add_argument("--linear", type=int, default=20, help="逐条匹配的查询数, 0 表示跳过")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--memory", action="store_true", help="用 tracemalloc 统计加载后占用的内存")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rules, domains = make_rules(args.rules, rng)
+    queries = make_queries(args.queries, domains, rng)
+    print(f"rules={len(rules)} queries={len(queries)}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "rules.txt")
+        with open(source, "w", encoding="utf-8") as f:
+            f.writelines(f"{rule}\n" for rule in rules)
+        del rules[:-1]
+
+        engine, elapsed, size = measure(lambda: RuleEngine.load_file(source), args.memory)
+        print(f"text     load={elapsed:.2f}s" + (f" memory={size:.1f}MB" if args.memory else ""))
+        run_matches("engine", engine, queries)
+
+        target = os.path.join(tmp, "rules.ruleset")
+        _, elapsed, _ = measure(lambda: load_ruleset(source, target).close(), False)
+        print(f"compile  {elapsed:.2f}s size={os.path.getsize(target) / 1024 / 1024:.1f}MB")
+        ruleset, elapsed, size = measure(lambda: load_ruleset(source, target), args.memory)
+        print(f"compiled load={elapsed * 1000:.2f}ms" + (f" memory={size:.3f}MB" if args.memory else ""))
+        run_matches("mmap", ruleset, queries)
+        ruleset.close()
+
+    if args.linear:
+        rules = engine.rules
+        sample = queries[: args.linear]
+        start = time.perf_counter()
+        for host, port in sample:
+            expected = next((rule for rule in rules if rule.matches(host, port=port)), None)
+            assert engine.match(host, port=port) == expected, (host, port)
+        elapsed = time.perf_counter() - start
+        print(f"linear   {len(sample) / elapsed:,.1f} match/s  {elapsed / len(sample) * 1e6:,.0f}us/match")
+
+
+if __name__ == "__main__":
+    main()
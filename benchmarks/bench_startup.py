@@ -0,0 +1,122 @@
+"""启动基准: 从启动解释器到本地代理端口可用的耗时
+
+headless  python -m talkProxy.daemon, 只加载配置与代理核心
+gui       导入 PySide6/界面模块并创建窗口后再启动同一节点(需要安装 PySide6)
+
+使用一个假的 hysteria 程序, 只负责监听节点配置中的 socks 端口
+
+python benchmarks/bench_startup.py --repeat 5
+"""
+
+import argparse
+import os
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+FAKE_HYSTERIA = f"""#!{sys.executable}
+import socket, sys, time, yaml
+with open(sys.argv[sys.argv.index("-c") + 1]) as f:
+    host, port = yaml.safe_load(f)["socks"]["listen"].rsplit(":", 1)
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind((host, int(port)))
+server.listen()
+print("fake hysteria listening", flush=True)
+while True:
+    conn, _ = server.accept()
+    conn.close()
+"""
+
+GUI_SCRIPT = """
+import logging, os, sys
+logging.basicConfig(level=logging.INFO)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from talkProxy.tools.config import init_config
+from PySide6.QtWidgets import QApplication
+from talkProxy.hysteria_ui import Widget
+from talkProxy.daemon import select_node, start_proxy
+config = init_config(sys.argv[1])
+app = QApplication(sys.argv[:1])
+widget = Widget()
+widget.show()
+app.processEvents()
+hysteria, ready = start_proxy(select_node(config), sys.argv[2], 10)
+hysteria.stop()
+sys.exit(0 if ready else 1)
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare(tmp: str) -> str:
+    bin_path = os.path.join(tmp, "hysteria")
+    with open(bin_path, "w") as f:
+        f.write(FAKE_HYSTERIA)
+    os.chmod(bin_path, os.stat(bin_path).st_mode | stat.S_IEXEC)
+    node_path = os.path.join(tmp, "node.yaml")
+    with open(node_path, "w") as f:
+        yaml.dump({"server": "example.com:443", "auth": "pw", "socks": {"listen": f"127.0.0.1:{free_port()}"}}, f)
+    with open(os.path.join(tmp, "config.yaml"), "w") as f:
+        yaml.dump({"httpPort": 7899, "socksPort": 7900, "default": "bench"}, f)
+    with open(os.path.join(tmp, "subscription.yaml"), "w") as f:
+        yaml.dump(
+            {"subscription": [{"name": "bench", "url": "", "updateInterval": "0", "lastUpdate": 0,
+                               "files": [{"name": "node", "type": "hysteria2", "path": node_path}]}]},
+            f,
+        )
+    return bin_path
+
+
+def run(cmd: list[str]) -> float:
+    """计时到子进程输出就绪日志为止, 不包含随后的停止耗时"""
+    env = dict(os.environ, PYTHONPATH=SRC)
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    output = []
+    for line in process.stderr:
+        if "代理已就绪" in line:
+            elapsed = time.perf_counter() - start
+            process.stderr.read()
+            process.wait(timeout=30)
+            return elapsed
+        output.append(line)
+    process.wait(timeout=30)
+    raise RuntimeError("".join(output[-20:]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        bin_path = prepare(tmp)
+        modes = {
+            "headless": [sys.executable, "-m", "talkProxy.daemon", "--config-dir", tmp, "--bin", bin_path, "--check"],
+            "gui": [sys.executable, "-c", GUI_SCRIPT, tmp, bin_path],
+        }
+        print(f"{'mode':>10} {'best s':>8} {'median s':>9}")
+        for mode, cmd in modes.items():
+            if mode == "gui":
+                try:
+                    import PySide6  # noqa: F401
+                except ImportError:
+                    print(f"{mode:>10}  skipped (PySide6 not installed)")
+                    continue
+            times = sorted(run(cmd) for _ in range(args.repeat))
+            print(f"{mode:>10} {times[0]:>8.3f} {times[len(times) // 2]:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
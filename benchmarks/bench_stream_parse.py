@@ -0,0 +1,79 @@
+"""订阅解析基准: 整体 yaml.safe_load 与流式 iter_proxies 的耗时和峰值内存
+
+python benchmarks/bench_stream_parse.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from talkProxy.tools.yaml_stream import ChunkStream, iter_proxies  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+
+
+def make_document(count: int) -> bytes:
+    lines = ["mixed-port: 7890", "proxies:"]
+    for i in range(count):
+        lines.append(f"  - name: node-{i}")
+        lines.append("    type: hysteria2")
+        lines.append(f"    server: node-{i}.example.com")
+        lines.append(f"    port: {10000 + i % 50000}")
+        lines.append(f"    password: {i:032x}")
+        lines.append("    sni: example.com")
+        lines.append("    skip-cert-verify: true")
+    lines.append("rules:")
+    lines.extend(f"  - DOMAIN-SUFFIX,site{i}.com,PROXY" for i in range(count // 10))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def chunks(document: bytes):
+    for i in range(0, len(document), CHUNK_SIZE):
+        yield document[i : i + CHUNK_SIZE]
+
+
+def parse_full(document: bytes) -> int:
+    text = b"".join(chunks(document)).decode()
+    return len(yaml.safe_load(text)["proxies"])
+
+
+def parse_stream(document: bytes) -> int:
+    return sum(1 for _ in iter_proxies(ChunkStream(chunks(document))))
+
+
+def measure(func: callable, document: bytes, memory: bool) -> tuple[int, float, int]:
+    # tracemalloc 会显著拖慢解析, 耗时与峰值内存分两次测量
+    start = time.perf_counter()
+    count = func(document)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if memory:
+        tracemalloc.start()
+        func(document)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--no-memory", action="store_true", help="跳过 tracemalloc 峰值内存测量")
+    args = parser.parse_args()
+    print(f"{'nodes':>8} {'doc MiB':>8} {'mode':>7} {'time s':>8} {'peak MiB':>9}")
+    for size in args.sizes:
+        document = make_document(size)
+        for mode, func in (("full", parse_full), ("stream", parse_stream)):
+            count, elapsed, peak = measure(func, document, not args.no_memory)
+            assert count == size
+            print(f"{size:>8} {len(document) / 1024**2:>8.2f} {mode:>7} {elapsed:>8.2f} {peak / 1024**2:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
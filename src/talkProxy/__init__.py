@@ -1,3 +1,2 @@
 from .core import *
-from .config import *
 from .tools import *
\ No newline at end of file
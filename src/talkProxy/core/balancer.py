@@ -0,0 +1,373 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from talkProxy.core.proxyManager import InstanceState, ProxySupervisor
+from talkProxy.tools.settingReader import SettingReader
+
+RELAY_CHUNK = 64 * 1024
+CONNECT_TIMEOUT = 5.0
+# 上游连接失败后暂停使用的时间(秒)
+UPSTREAM_COOLDOWN = 5.0
+# 单个客户端连接最多尝试的上游数
+CONNECT_ATTEMPTS = 3
+EWMA_ALPHA = 0.3
+STRATEGIES = ("round_robin", "least_conn", "latency")
+# 从 supervisor 同步上游列表的最小间隔(秒)
+SYNC_INTERVAL = 1.0
+# Linux 上用 splice 在内核中转发数据, 不经过用户态缓冲
+SPLICE = hasattr(os, "splice") and hasattr(os, "pipe2")
+
+
+class Upstream:
+    def __init__(self, name: str, host: str, port: int) -> None:
+        self.name = name
+        self.host = host
+        self.port = port
+        self.active = 0
+        self.total = 0
+        self.failures = 0
+        self.down_until = 0.0
+        # 外部设置的节点延迟(如探测或 NodeSelector 的评分), 未设置时使用首个响应字节的时间
+        self.latency: Optional[float] = None
+        self.first_byte: Optional[float] = None
+
+    def available(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def observe(self, elapsed: float) -> None:
+        self.first_byte = elapsed if self.first_byte is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.first_byte
+
+    def weight_latency(self) -> float:
+        latency = self.latency if self.latency is not None else self.first_byte
+        return latency if latency else 0.001
+
+    def __dict__(self) -> dict[str, any]:
+        return {
+            "name": self.name,
+            "address": f"{self.host}:{self.port}",
+            "active": self.active,
+            "total": self.total,
+            "failures": self.failures,
+            "latency": self.latency,
+            "firstByte": self.first_byte,
+        }
+
+    def to_dict(self) -> dict[str, any]:
+        return self.__dict__()
+
+
+async def _wait_fd(loop: asyncio.AbstractEventLoop, sock: socket.socket, write: bool) -> None:
+    future = loop.create_future()
+    fd = sock.fileno()
+    if write:
+        loop.add_writer(fd, future.set_result, None)
+    else:
+        loop.add_reader(fd, future.set_result, None)
+    try:
+        await future
+    finally:
+        if write:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+
+async def relay_splice(src: socket.socket, dst: socket.socket, on_first: Optional[Callable[[], None]] = None) -> int:
+    """经由内核管道在两个 socket 之间转发, 返回转发的字节数; on_first 在转发第一块数据后调用一次"""
+    loop = asyncio.get_running_loop()
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    pipe_r, pipe_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+    total = 0
+    try:
+        while True:
+            try:
+                n = os.splice(src.fileno(), pipe_w, RELAY_CHUNK, flags=flags)
+            except BlockingIOError:
+                await _wait_fd(loop, src, write=False)
+                continue
+            if n == 0:
+                break
+            first = total == 0
+            total += n
+            while n:
+                try:
+                    n -= os.splice(pipe_r, dst.fileno(), n, flags=flags)
+                except BlockingIOError:
+                    await _wait_fd(loop, dst, write=True)
+            if first and on_first is not None:
+                on_first()
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+    _shutdown_write(dst)
+    return total
+
+
+async def relay_copy(src: socket.socket, dst: socket.socket, on_first: Optional[Callable[[], None]] = None) -> int:
+    """复用同一块缓冲区转发, 不支持 splice 的平台使用"""
+    loop = asyncio.get_running_loop()
+    buffer = bytearray(RELAY_CHUNK)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        n = await loop.sock_recv_into(src, buffer)
+        if n == 0:
+            break
+        await loop.sock_sendall(dst, view[:n])
+        if total == 0 and on_first is not None:
+            on_first()
+        total += n
+    _shutdown_write(dst)
+    return total
+
+
+def _shutdown_write(sock: socket.socket) -> None:
+    try:
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+class LoadBalancer:
+    """本地四层负载均衡: 客户端连接原样转发到某个上游 hysteria 实例的 socks 或 http 端口
+
+    不解析代理协议, 因此同一个前端同时适用于 SOCKS5 与 HTTP 代理
+    """
+
+    def __init__(
+        self,
+        listen: tuple[str, int],
+        upstreams: Iterable[tuple[str, str, int]] = (),
+        strategy: str = "round_robin",
+        use_splice: bool = SPLICE,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        cooldown: float = UPSTREAM_COOLDOWN,
+        supervisor: Optional[ProxySupervisor] = None,
+        kind: str = "socks",
+    ) -> None:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"不支持的负载均衡策略:{strategy}")
+        if kind not in ("socks", "http"):
+            raise ValueError(f"不支持的代理类型:{kind}")
+        self.listen = listen
+        self.strategy = strategy
+        self.use_splice = use_splice and SPLICE
+        self.connect_timeout = connect_timeout
+        self.cooldown = cooldown
+        self.supervisor = supervisor
+        self.kind = kind
+        self._synced_at = 0.0
+        self._upstreams: dict[str, Upstream] = {}
+        self._rr = itertools.count()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._accept_task: Optional[asyncio.Task] = None
+        self._connections: set[asyncio.Task] = set()
+        # 正在转发的连接: 序号 -> (客户端地址, 上游), 供连接页面读取
+        self._active: dict[int, tuple[str, Upstream]] = {}
+        self._conn_ids = itertools.count()
+        self.update_upstreams(upstreams)
+
+    @classmethod
+    def from_settings(
+        cls, supervisor: ProxySupervisor, kind: str = "socks", strategy: str = "round_robin", **kwargs: dict
+    ) -> "LoadBalancer":
+        """监听全局配置中的 socksPort/httpPort, 以 supervisor 中运行的实例作为上游"""
+        settings = SettingReader.snapshot()
+        port = settings.socksPort if kind == "socks" else settings.httpPort
+        return cls(("127.0.0.1", port), strategy=strategy, supervisor=supervisor, kind=kind, **kwargs)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """实际监听的地址, 监听端口为 0 时由系统分配"""
+        return self._server.getsockname()[:2] if self._server else self.listen
+
+    def update_upstreams(self, upstreams: Iterable[tuple[str, str, int]]) -> None:
+        """替换上游列表, 同名且地址不变的上游保留统计数据"""
+        new = {}
+        with self._lock:
+            for name, host, port in upstreams:
+                old = self._upstreams.get(name, None)
+                new[name] = old if old is not None and (old.host, old.port) == (host, port) else Upstream(name, host, port)
+            self._upstreams = new
+
+    def sync_supervisor(self) -> None:
+        """以 supervisor 中运行中的实例作为上游"""
+        self._synced_at = time.monotonic()
+        upstreams = []
+        for name, state in self.supervisor.states().items():
+            if state["state"] != InstanceState.RUNNING.value:
+                continue
+            upstreams.append((name, "127.0.0.1", state["socksPort"] if self.kind == "socks" else state["httpPort"]))
+        self.update_upstreams(upstreams)
+
+    def _maybe_sync(self) -> None:
+        if self.supervisor is not None and time.monotonic() - self._synced_at >= SYNC_INTERVAL:
+            self.sync_supervisor()
+
+    def set_latency(self, name: str, latency: Optional[float]) -> None:
+        with self._lock:
+            upstream = self._upstreams.get(name, None)
+            if upstream is not None:
+                upstream.latency = latency
+
+    def upstreams(self) -> list[Upstream]:
+        with self._lock:
+            return list(self._upstreams.values())
+
+    def stats(self) -> list[dict]:
+        return [upstream.to_dict() for upstream in self.upstreams()]
+
+    def connections(self) -> list[tuple[str, str, str]]:
+        """正在转发的连接: (客户端地址, 上游名, 上游地址)"""
+        # dict 拷贝在 C 层完成, 可以在其他线程调用
+        active = self._active.copy()
+        return [(client, upstream.name, f"{upstream.host}:{upstream.port}") for client, upstream in active.values()]
+
+    def pick(self, exclude: Iterable[Upstream] = ()) -> Optional[Upstream]:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [u for u in self._upstreams.values() if u.available(now) and u not in exclude]
+        if not candidates:
+            return None
+        if self.strategy == "least_conn":
+            # 连接数相同时轮询, 避免总是选中第一个
+            offset = next(self._rr)
+            ordered = candidates[offset % len(candidates) :] + candidates[: offset % len(candidates)]
+            return min(ordered, key=lambda u: u.active)
+        if self.strategy == "latency":
+            weights = [1 / u.weight_latency() for u in candidates]
+            return random.choices(candidates, weights)[0]
+        return candidates[next(self._rr) % len(candidates)]
+
+    async def _connect(self, upstream: Upstream) -> socket.socket:
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET6 if ":" in upstream.host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (upstream.host, upstream.port)), self.connect_timeout)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def _handle(self, client: socket.socket, client_addr: str = "") -> None:
+        self._maybe_sync()
+        tried = []
+        upstream_sock = None
+        upstream = None
+        for _ in range(CONNECT_ATTEMPTS):
+            upstream = self.pick(tried)
+            if upstream is None:
+                break
+            tried.append(upstream)
+            try:
+                upstream_sock = await self._connect(upstream)
+                break
+            except (OSError, asyncio.TimeoutError) as e:
+                upstream.failures += 1
+                upstream.down_until = time.monotonic() + self.cooldown
+                logging.warning(f"连接上游{upstream.name}失败:{e}")
+        if upstream_sock is None:
+            logging.error("没有可用的上游, 关闭客户端连接")
+            client.close()
+            return
+
+        upstream.active += 1
+        upstream.total += 1
+        conn_id = next(self._conn_ids)
+        self._active[conn_id] = (client_addr, upstream)
+        sent_at = []
+
+        def request_sent() -> None:
+            sent_at.append(time.perf_counter())
+
+        def response_received() -> None:
+            # 从客户端首个请求发出到上游首个响应的时间
+            if sent_at:
+                upstream.observe(time.perf_counter() - sent_at[0])
+
+        relay = relay_splice if self.use_splice else relay_copy
+        tasks = [
+            asyncio.ensure_future(relay(client, upstream_sock, request_sent)),
+            asyncio.ensure_future(relay(upstream_sock, client, response_received)),
+        ]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            if any(task.exception() for task in done):
+                for task in pending:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            del self._active[conn_id]
+            upstream.active -= 1
+            client.close()
+            upstream_sock.close()
+
+    async def _accept_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            client, addr = await loop.sock_accept(self._server)
+            client.setblocking(False)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            task = asyncio.ensure_future(self._handle(client, f"{addr[0]}:{addr[1]}"))
+            self._connections.add(task)
+            task.add_done_callback(self._connections.discard)
+
+    async def serve(self) -> None:
+        server = socket.create_server(self.listen, backlog=1024, reuse_port=False)
+        server.setblocking(False)
+        self._server = server
+        self._ready.set()
+        try:
+            await self._accept_loop()
+        finally:
+            server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._accept_task = self._loop.create_task(self.serve())
+        try:
+            self._loop.run_until_complete(self._accept_task)
+        except asyncio.CancelledError:
+            pass
+        except OSError as e:
+            logging.error(f"负载均衡监听{self.listen}失败:{e}")
+        finally:
+            self._ready.set()
+            self._loop.close()
+
+    def start(self, timeout: float = 5.0) -> bool:
+        """在后台线程中运行事件循环, 监听成功后返回 True"""
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name="load-balancer", daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout)
+        return self._server is not None
+
+    def stop(self) -> None:
+        if self._loop is not None and self._accept_task is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._accept_task.cancel)
+            except RuntimeError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+        self._server = None
@@ -0,0 +1,222 @@
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+import psutil
+
+from talkProxy.core.balancer import LoadBalancer
+from talkProxy.core.proxyManager import ProxySupervisor
+
+# 连接页面的刷新间隔(秒)
+COLLECT_INTERVAL = 1.0
+
+# (所属实例, 协议, 本地地址, 远端地址)
+ConnectionKey = tuple[str, str, str, str]
+# (pid, 状态), 任一项变化时产生 updated
+ConnectionValue = tuple[int, str]
+Source = Callable[[], dict[ConnectionKey, ConnectionValue]]
+
+
+class Connection(NamedTuple):
+    owner: str
+    kind: str
+    laddr: str
+    raddr: str
+    pid: int
+    status: str
+    # 首次出现的时间(time.time())
+    since: float
+
+    @property
+    def key(self) -> ConnectionKey:
+        return self.owner, self.kind, self.laddr, self.raddr
+
+    def to_dict(self) -> dict[str, Any]:
+        return self._asdict()
+
+
+class ConnectionDiff(NamedTuple):
+    opened: list[Connection]
+    updated: list[Connection]
+    closed: list[ConnectionKey]
+
+    def __bool__(self) -> bool:
+        return bool(self.opened or self.updated or self.closed)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "opened": [conn.to_dict() for conn in self.opened],
+            "updated": [conn.to_dict() for conn in self.updated],
+            "closed": [list(key) for key in self.closed],
+        }
+
+
+def _address(addr: Any) -> str:
+    if not addr:
+        return ""
+    return f"[{addr.ip}]:{addr.port}" if ":" in addr.ip else f"{addr.ip}:{addr.port}"
+
+
+def process_source(pids: Callable[[], dict[str, int]]) -> Source:
+    """用 psutil 读取各实例子进程的 inet 连接, pids 返回 实例名 -> pid"""
+    processes: dict[int, psutil.Process] = {}
+
+    def collect() -> dict[ConnectionKey, ConnectionValue]:
+        result = {}
+        current = pids()
+        for pid in list(processes):
+            if pid not in current.values():
+                del processes[pid]
+        for owner, pid in current.items():
+            process = processes.get(pid, None)
+            try:
+                if process is None:
+                    process = processes[pid] = psutil.Process(pid)
+                conns = process.net_connections(kind="inet")
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                processes.pop(pid, None)
+                continue
+            for conn in conns:
+                kind = "tcp" if conn.type == socket.SOCK_STREAM else "udp"
+                result[(owner, kind, _address(conn.laddr), _address(conn.raddr))] = (pid, conn.status)
+        return result
+
+    return collect
+
+
+def supervisor_source(supervisor: ProxySupervisor) -> Source:
+    return process_source(supervisor.pids)
+
+
+def balancer_source(balancer: LoadBalancer) -> Source:
+    """本地负载均衡自己记录的连接, 归属为所转发到的上游实例"""
+    pid = os.getpid()
+
+    def collect() -> dict[ConnectionKey, ConnectionValue]:
+        return {
+            (name, "tcp", client, upstream): (pid, psutil.CONN_ESTABLISHED)
+            for client, name, upstream in balancer.connections()
+        }
+
+    return collect
+
+
+class ConnectionTable:
+    """保存上一轮的连接表, 每轮只对变化的条目构造对象
+
+    关闭的连接用 dict 视图的集合运算求出; 变化的连接用推导式比较原始元组,
+    比 items() 的集合差少建一次 1 万项的集合
+    """
+
+    def __init__(self) -> None:
+        self._raw: dict[ConnectionKey, ConnectionValue] = {}
+        self._rows: dict[ConnectionKey, Connection] = {}
+
+    def apply(self, snapshot: dict[ConnectionKey, ConnectionValue], now: Optional[float] = None) -> ConnectionDiff:
+        now = time.time() if now is None else now
+        closed = list(self._raw.keys() - snapshot.keys())
+        opened, updated = [], []
+        previous = self._raw.get
+        changed = [(key, value) for key, value in snapshot.items() if previous(key) != value]
+        for key, (pid, status) in changed:
+            old = self._rows.get(key, None)
+            row = Connection(*key, pid, status, old.since if old is not None else now)
+            self._rows[key] = row
+            (opened if old is None else updated).append(row)
+        for key in closed:
+            del self._rows[key]
+        self._raw = snapshot
+        return ConnectionDiff(opened, updated, closed)
+
+    def rows(self) -> list[Connection]:
+        return list(self._rows.values())
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class ConnectionCollector:
+    """定期从各来源收集连接, 只把变化(opened/updated/closed)推送给监听者
+
+    界面先用 snapshot() 取得完整表, 之后只应用差异
+    """
+
+    def __init__(self, sources: list[Source], interval: float = COLLECT_INTERVAL) -> None:
+        self.sources = list(sources)
+        self.interval = interval
+        self.table = ConnectionTable()
+        self._listeners: list[Callable[[ConnectionDiff], None]] = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_listener(self, listener: Callable[[ConnectionDiff], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[ConnectionDiff], None]) -> None:
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def collect(self) -> ConnectionDiff:
+        """收集一轮并返回差异, 有变化时通知监听者"""
+        snapshot: dict[ConnectionKey, ConnectionValue] = {}
+        for source in self.sources:
+            try:
+                snapshot.update(source())
+            except Exception as e:
+                logging.error(f"收集连接失败:{e}")
+        with self._lock:
+            diff = self.table.apply(snapshot)
+            listeners = list(self._listeners)
+        if diff:
+            for listener in listeners:
+                listener(diff)
+        return diff
+
+    def snapshot(self) -> list[Connection]:
+        with self._lock:
+            return self.table.rows()
+
+    def _loop(self) -> None:
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            self.collect()
+            self._stop_event.wait(max(self.interval - (time.monotonic() - start), 0))
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="connection-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+_signal_class = None
+
+
+def qt_signal(collector: ConnectionCollector, parent: Any = None) -> Any:
+    """把差异转换为 Qt 信号, 返回对象的 diff 信号在界面线程中以 ConnectionDiff 触发
+
+    PySide6 只在调用时导入, 无界面模式不依赖 Qt
+    """
+    global _signal_class
+    if _signal_class is None:
+        from PySide6.QtCore import QObject, Signal
+
+        class ConnectionSignal(QObject):
+            diff = Signal(object)
+
+        _signal_class = ConnectionSignal
+    emitter = _signal_class(parent)
+    collector.add_listener(emitter.diff.emit)
+    return emitter
@@ -1,71 +1,137 @@
-import queue
 import subprocess
 import threading
-from typing import IO
+import time
+import weakref
+from typing import Iterator, Optional
 import logging
-from talkProxy.log.Logger import subProcessLogHandler
+from talkProxy.core.log_reader import LOG_BUFFER_LINES, LogBuffer, get_reader
+from talkProxy.core.log_subscription import LogSubscription
+from talkProxy.tools.metrics import Counter, Family, register_collector
+
+# Popen 失败(可执行文件不存在或无权限)时记录的退出码, 与 shell 找不到命令时一致
+SPAWN_FAILED_EXIT_CODE = 127
+
+HYSTERIA_STARTS = Counter("talkproxy_hysteria_starts_total", "启动的 hysteria 子进程数")
+HYSTERIA_EXITS = Counter("talkproxy_hysteria_exits_total", "已退出的 hysteria 子进程数")
+# 运行中的实例, 只在抓取指标时遍历
+_running: "weakref.WeakSet[Hysteria2]" = weakref.WeakSet()
 
 class Hysteria2(threading.Thread):
     _instance = None
     _lock = threading.Lock()
     
-    def __init__(self, cmd:list[str]) -> None:
+    def __init__(self, cmd:list[str], log_lines:int = LOG_BUFFER_LINES) -> None:
         super().__init__()
         self.sub_process = None
-        self.stdout = None
-        self.stderr = None
-        self.stdout_thread = None
-        self.stderr_thread = None
+        self.stdout_closed = None
+        self.stderr_closed = None
         self.cmd = cmd
+        self.log_lines = log_lines
         self.setup_logger()
         self._stop_event = threading.Event()
+        self._process_lock = threading.Lock()
+        self.started_at: Optional[float] = None
+        self.spawn_error: Optional[OSError] = None
         
     def setup_logger(self):
-        self.log_queue = queue.Queue()
-
+        # stdout/stderr 由共享的读取线程写入, 超出容量时丢弃最旧的行
+        self.log_buffer = LogBuffer(self.log_lines)
         
     def run(self):
         self.run_external_program(self.cmd)
         
-    def stop(self):
+    def stop(self, timeout: float = 5.0) -> Optional[int]:
+        """先 SIGTERM, timeout 秒内未退出则 SIGKILL, 返回子进程退出码"""
         self._stop_event.set()
-        if self.sub_process:
-            self.sub_process.terminate()
-            self.sub_process.wait()
-        if self.stdout_thread:
-            self.stdout_thread.join()
-        if self.stderr_thread:
-            self.stderr_thread.join()
-        
+        with self._process_lock:
+            sub_process = self.sub_process
+        if sub_process and sub_process.poll() is None:
+            sub_process.terminate()
+            try:
+                sub_process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logging.warning(f'外部程序{timeout}秒内未退出, 强制结束')
+                sub_process.kill()
+                sub_process.wait()
+        # 子进程退出后管道很快读到 EOF, 这里只是等剩余输出写入缓冲区
+        for closed in (self.stdout_closed, self.stderr_closed):
+            if closed is not None:
+                closed.wait(timeout)
+        return sub_process.returncode if sub_process else None
+
+    def exit_code(self) -> Optional[int]:
+        """子进程退出码, 未启动或仍在运行时为 None; 启动失败时为 SPAWN_FAILED_EXIT_CODE"""
+        with self._process_lock:
+            sub_process = self.sub_process
+            if sub_process is None and self.spawn_error is not None:
+                return SPAWN_FAILED_EXIT_CODE
+        return sub_process.poll() if sub_process else None
 
     def run_external_program(self, cmd:list[str]):
         # 使用subprocess.Popen运行命令,并将stdout和stderr重定向到管道
-        self.sub_process = subprocess.Popen(args = [*cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        # 创建并启动一个线程来读取输出
-        self.stdout_thread = threading.Thread(target=self.read_output, args=(self.sub_process.stdout,))
-        self.stderr_thread = threading.Thread(target=self.read_output, args=(self.sub_process.stderr,))
-        # 启动两个线程
-        self.stdout_thread.start()
-        self.stderr_thread.start()
+        with self._process_lock:
+            # stop() 先于子进程启动时不再启动
+            if self._stop_event.is_set():
+                return
+            try:
+                self.sub_process = subprocess.Popen(args = [*cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as e:
+                self.spawn_error = e
+                logging.error(f'启动外部程序失败:{e}')
+                return
+            self.started_at = time.monotonic()
+            HYSTERIA_STARTS.inc()
+            _running.add(self)
+
+            # 所有子进程的输出由同一个读取线程按块读取
+            reader = get_reader()
+            self.stdout_closed = reader.register(self.sub_process.stdout, self.log_buffer)
+            self.stderr_closed = reader.register(self.sub_process.stderr, self.log_buffer)
         # 等待外部程序完成
         self.sub_process.wait()
+        _running.discard(self)
+        HYSTERIA_EXITS.inc()
         logging.error('外部程序已退出')
 
-    def read_output(self, stream:IO[str]):
-        while not self._stop_event.is_set():
-            output = stream.readline()
-            if output == '':
-                break
-            self.log_queue.put(output.strip())
-                
+    def pid(self) -> Optional[int]:
+        """运行中子进程的 pid, 未启动或已退出时为 None"""
+        with self._process_lock:
+            sub_process = self.sub_process
+        return sub_process.pid if sub_process and sub_process.poll() is None else None
+
+    def uptime(self) -> float:
+        """子进程已运行的秒数, 未启动或已退出时为 0"""
+        if self.started_at is None or self.pid() is None:
+            return 0.0
+        return time.monotonic() - self.started_at
+
     def get_logs(self):
-        """获取日志消息"""
+        """获取日志消息, 每次从缓冲区取出一行"""
         while True:
-            try:
-                yield self.log_queue.get_nowait()
-            except queue.Empty:
+            lines = self.log_buffer.drain(1)
+            if not lines:
                 return
+            yield lines[0]
+
+    def subscribe(self, **kwargs) -> LogSubscription:
+        """订阅之后的日志, 参数见 LogSubscription; 可以有多个互不影响的订阅者"""
+        return LogSubscription(self.log_buffer, **kwargs)
+
+    def log_stats(self) -> dict[str, int]:
+        """缓冲中的行数、累计行数与因缓冲区满而丢弃的行数"""
+        return self.log_buffer.stats()
+
+
+def _collect_metrics() -> Iterator[Family]:
+    samples = []
+    for hysteria in list(_running):
+        pid = hysteria.pid()
+        if pid is not None:
+            samples.append(("", (("pid", str(pid)),), hysteria.uptime()))
+    yield Family("talkproxy_hysteria_uptime_seconds", "gauge", "运行中的 hysteria 子进程已运行的秒数", samples)
+
+
+register_collector(_collect_metrics)
 
 
         
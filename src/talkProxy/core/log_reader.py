@@ -0,0 +1,231 @@
+import collections
+import contextlib
+import errno
+import logging
+import os
+import selectors
+import threading
+from typing import IO, Callable, Optional
+
+from talkProxy.tools.metrics import Counter
+
+# 每个实例最多保留的日志行数, 超出后丢弃最旧的行并计数
+LOG_BUFFER_LINES = 10000
+READ_CHUNK_SIZE = 64 * 1024
+# 没有换行的超长行达到该长度后直接截断成一行, 避免无限累积
+MAX_LINE_BYTES = 64 * 1024
+
+LOG_LINES = Counter("talkproxy_log_lines_total", "从子进程读到的日志行数")
+LOG_DROPPED = Counter("talkproxy_log_dropped_total", "日志缓冲区满时丢弃的行数")
+
+
+class LogBuffer:
+    """单个实例的有界日志环形缓冲区"""
+
+    def __init__(self, maxlen: int = LOG_BUFFER_LINES) -> None:
+        self._lock = threading.Lock()
+        self._lines: collections.deque[str] = collections.deque(maxlen=maxlen)
+        self.maxlen = maxlen
+        self.total = 0
+        self.dropped = 0
+        self._listeners: list[Callable[[list[str]], None]] = []
+
+    def extend(self, lines: list[str]) -> None:
+        if not lines:
+            return
+        with self._lock:
+            overflow = len(self._lines) + len(lines) - self.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self._lines.extend(lines)
+            self.total += len(lines)
+            listeners = list(self._listeners)
+        LOG_LINES.inc(len(lines))
+        if overflow > 0:
+            LOG_DROPPED.inc(overflow)
+        for listener in listeners:
+            listener(lines)
+
+    def drain(self, max_lines: Optional[int] = None) -> list[str]:
+        """取出并清空缓冲区中的行, max_lines 限制单次取出的行数"""
+        with self._lock:
+            if max_lines is None or max_lines >= len(self._lines):
+                lines = list(self._lines)
+                self._lines.clear()
+                return lines
+            return [self._lines.popleft() for _ in range(max_lines)]
+
+    def snapshot(self) -> list[str]:
+        """缓冲区中现有的行, 不取出"""
+        with self._lock:
+            return list(self._lines)
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def add_listener(self, listener: Callable[[list[str]], None], replay: bool = False) -> None:
+        """有新日志写入时以新增的行回调, 回调在读取线程中执行, 不应阻塞
+
+        replay 时先在锁内以缓冲区中现有的行回调一次, 与注册是同一步, 两者之间写入的行不会遗漏或重复
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            if replay and self._lines:
+                listener(list(self._lines))
+
+    def remove_listener(self, listener: Callable[[list[str]], None]) -> None:
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def stats(self) -> dict[str, int]:
+        return {"buffered": len(self._lines), "total": self.total, "dropped": self.dropped}
+
+
+class _Pipe:
+    __slots__ = ("buffer", "closed", "fd", "partial", "stream")
+
+    def __init__(self, stream: IO[bytes], buffer: LogBuffer) -> None:
+        self.stream = stream
+        self.fd = stream.fileno()
+        self.buffer = buffer
+        self.partial = b""
+        self.closed = threading.Event()
+
+    def feed(self, data: bytes) -> None:
+        """按块切分完整的行, 整块解码后写入缓冲区"""
+        data = self.partial + data
+        end = data.rfind(b"\n")
+        if end < 0:
+            if len(data) < MAX_LINE_BYTES:
+                self.partial = data
+                return
+            # 超长行按已读到的内容截断成一行
+            self.partial = b""
+            self.buffer.extend([data.decode("utf-8", "replace").rstrip("\r")])
+            return
+        self.partial = data[end + 1 :]
+        text = data[: end + 1].decode("utf-8", "replace")
+        self.buffer.extend([line.rstrip("\r") for line in text.split("\n")[:-1] if line.strip()])
+
+    def finish(self) -> None:
+        if self.partial.strip():
+            self.buffer.extend([self.partial.decode("utf-8", "replace").rstrip("\r\n")])
+        self.partial = b""
+        with contextlib.suppress(OSError):
+            self.stream.close()
+        self.closed.set()
+
+
+class PipeReader:
+    """在一个线程中通过 selector 读取所有子进程的 stdout/stderr
+
+    Windows 上管道不支持 select, 退化为每个管道一个阻塞读取线程
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pipes: dict[int, _Pipe] = {}
+        self._use_selector = os.name != "nt"
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup_r = self._wakeup_w = -1
+        self._pending: list[_Pipe] = []
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._loop, name="pipe-reader", daemon=True)
+        self._thread.start()
+
+    def _wakeup(self) -> None:
+        with contextlib.suppress(BlockingIOError):
+            os.write(self._wakeup_w, b"\0")
+
+    def register(self, stream: IO[bytes], buffer: LogBuffer) -> threading.Event:
+        """开始读取 stream, 返回读到 EOF 后被设置的事件"""
+        pipe = _Pipe(stream, buffer)
+        if not self._use_selector:
+            threading.Thread(target=self._read_blocking, args=(pipe,), daemon=True).start()
+            return pipe.closed
+        os.set_blocking(pipe.fd, False)
+        with self._lock:
+            self._ensure_thread()
+            self._pending.append(pipe)
+            # 读取线程在锁内关闭唤醒管道, 持锁写入保证管道仍然有效
+            self._wakeup()
+        return pipe.closed
+
+    def _read_blocking(self, pipe: _Pipe) -> None:
+        while True:
+            try:
+                data = os.read(pipe.fd, READ_CHUNK_SIZE)
+            except OSError:
+                data = b""
+            if not data:
+                break
+            pipe.feed(data)
+        pipe.finish()
+
+    def _loop(self) -> None:
+        selector = self._selector
+        while True:
+            for key, _ in selector.select():
+                if key.data is None:
+                    with contextlib.suppress(BlockingIOError):
+                        while os.read(self._wakeup_r, 4096):
+                            pass
+                    continue
+                self._read(key.data)
+            with self._lock:
+                pending, self._pending = self._pending, []
+                for pipe in pending:
+                    self._pipes[pipe.fd] = pipe
+                    selector.register(pipe.fd, selectors.EVENT_READ, pipe)
+                if not self._pipes and not self._pending:
+                    # 没有需要读取的管道时结束线程, 下次注册时重新启动
+                    selector.close()
+                    os.close(self._wakeup_r)
+                    os.close(self._wakeup_w)
+                    self._thread = None
+                    return
+
+    def _read(self, pipe: _Pipe) -> None:
+        # 一次 select 唤醒后尽量读空管道, 减少唤醒次数
+        while True:
+            try:
+                data = os.read(pipe.fd, READ_CHUNK_SIZE)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                logging.debug(f"读取子进程输出失败:{e}")
+                data = b""
+            if not data:
+                with self._lock:
+                    self._selector.unregister(pipe.fd)
+                    self._pipes.pop(pipe.fd, None)
+                pipe.finish()
+                return
+            pipe.feed(data)
+            if len(data) < READ_CHUNK_SIZE:
+                return
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_reader() -> PipeReader:
+    """进程内共享的子进程输出读取器"""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            _reader = PipeReader()
+    return _reader
@@ -0,0 +1,181 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from talkProxy.core.log_reader import LogBuffer
+from talkProxy.tools.metrics import Counter
+
+# 单批最多的行数与第一行到达后最多等待的时间(秒)
+MAX_BATCH = 500
+MAX_LATENCY = 0.05
+# 订阅者来不及消费时最多积压的行数, 超出后丢弃最旧的行并计数
+MAX_PENDING = 10000
+
+SUBSCRIBER_DROPPED = Counter("talkproxy_log_subscriber_dropped_total", "日志订阅者积压过多时丢弃的行数")
+
+
+class LogSubscription:
+    """订阅一个实例的日志, 新日志按批推送给订阅者
+
+    每个订阅者有独立的有界积压队列, 消费慢的订阅者只会丢弃自己的旧日志,
+    不会阻塞读取线程, 也不影响其他订阅者
+    """
+
+    def __init__(
+        self,
+        buffer: LogBuffer,
+        max_batch: int = MAX_BATCH,
+        max_latency: float = MAX_LATENCY,
+        max_pending: int = MAX_PENDING,
+        replay: bool = False,
+    ) -> None:
+        if max_batch <= 0 or max_pending <= 0:
+            raise ValueError("max_batch/max_pending 必须大于 0")
+        self.buffer = buffer
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._pending: collections.deque[str] = collections.deque(maxlen=max_pending)
+        self._cond = threading.Condition()
+        self._first_at = 0.0
+        self._closed = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_event: Optional[asyncio.Event] = None
+        self.delivered = 0
+        self.dropped = 0
+        buffer.add_listener(self._push, replay=replay)
+
+    def _push(self, lines: list[str]) -> None:
+        with self._cond:
+            if self._closed or not lines:
+                return
+            was_empty = not self._pending
+            overflow = len(self._pending) + len(lines) - self._pending.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+                SUBSCRIBER_DROPPED.inc(overflow)
+            self._pending.extend(lines)
+            if was_empty:
+                self._first_at = time.monotonic()
+            # 只在开始攒批和攒满一批时唤醒消费者
+            if not (was_empty or len(self._pending) >= self.max_batch):
+                return
+            self._cond.notify_all()
+            self._wake_async()
+
+    def _wake_async(self) -> None:
+        if self._async_event is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._async_event.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            self._async_event = None
+
+    def _take(self) -> list[str]:
+        count = min(len(self._pending), self.max_batch)
+        batch = [self._pending.popleft() for _ in range(count)]
+        if self._pending:
+            self._first_at = time.monotonic()
+        self.delivered += count
+        return batch
+
+    def _ready(self) -> Optional[float]:
+        """距离可以取出下一批的时间, 没有待取的日志时为 None"""
+        if not self._pending:
+            return None
+        if self._closed or len(self._pending) >= self.max_batch:
+            return 0.0
+        return max(self._first_at + self.max_latency - time.monotonic(), 0.0)
+
+    def get_batch(self, timeout: Optional[float] = None) -> list[str]:
+        """阻塞直到攒满一批或第一行已等待 max_latency, 超时或已关闭时返回空列表"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                delay = self._ready()
+                if delay == 0.0:
+                    return self._take()
+                if self._closed:
+                    return []
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return []
+                    delay = remaining if delay is None else min(delay, remaining)
+                self._cond.wait(delay)
+
+    def __aiter__(self) -> "LogSubscription":
+        return self
+
+    async def __anext__(self) -> list[str]:
+        while True:
+            with self._cond:
+                delay = self._ready()
+                if delay == 0.0:
+                    return self._take()
+                if self._closed:
+                    raise StopAsyncIteration
+                self._loop = asyncio.get_running_loop()
+                self._async_event = asyncio.Event()
+                event = self._async_event
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(event.wait(), delay)
+
+    def on_batch(self, callback: Callable[[list[str]], Any]) -> threading.Thread:
+        """在单独的线程中把每一批日志交给 callback, 订阅关闭后线程结束"""
+
+        def deliver() -> None:
+            while True:
+                batch = self.get_batch()
+                if not batch:
+                    return
+                try:
+                    callback(batch)
+                except Exception as e:
+                    logging.error(f"日志订阅回调出错:{e}")
+
+        thread = threading.Thread(target=deliver, name="log-subscriber", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> dict[str, int]:
+        return {"pending": len(self._pending), "delivered": self.delivered, "dropped": self.dropped}
+
+    def close(self) -> None:
+        self.buffer.remove_listener(self._push)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            self._wake_async()
+
+    def __enter__(self) -> "LogSubscription":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+_signal_class = None
+
+
+def qt_signal(subscription: LogSubscription, parent: Any = None) -> Any:
+    """把订阅转换为 Qt 信号, 返回对象的 batch 信号在界面线程中以 list[str] 触发
+
+    PySide6 只在调用时导入, 无界面模式不依赖 Qt
+    """
+    global _signal_class
+    if _signal_class is None:
+        from PySide6.QtCore import QObject, Signal
+
+        class LogSignal(QObject):
+            batch = Signal(list)
+
+        _signal_class = LogSignal
+    emitter = _signal_class(parent)
+    # 跨线程触发信号时 Qt 自动排队到接收者所在线程
+    subscription.on_batch(emitter.batch.emit)
+    return emitter
@@ -0,0 +1,202 @@
+import logging
+import math
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from talkProxy.tools.config import File
+from talkProxy.tools.probe import LatencyProber, ProbeResult
+
+# EWMA 平滑系数, 越大越看重最近的结果
+EWMA_ALPHA = 0.3
+# 丢包率对评分的放大系数: score = 延迟 * (1 + LOSS_WEIGHT * 丢包率)
+LOSS_WEIGHT = 4.0
+# 全部节点的探测间隔
+CHECK_INTERVAL = 30.0
+# 当前节点单独的探测间隔, 故障切换最长耗时约为 FAIL_CHECK_INTERVAL * FAIL_THRESHOLD
+FAIL_CHECK_INTERVAL = 2.0
+# 连续失败这么多次视为不可用
+FAIL_THRESHOLD = 3
+# 滞回: 新节点评分至少好这么多, 且连续若干次检查都如此, 当前节点也已使用足够久才切换
+SWITCH_MARGIN = 0.3
+SWITCH_AFTER = 3
+MIN_HOLD = 300.0
+
+
+class NodeScore:
+    def __init__(self, node: File) -> None:
+        self.node = node
+        self.latency: Optional[float] = None
+        self.loss = 0.0
+        self.samples = 0
+        self.failures = 0
+        self.last_result: Optional[ProbeResult] = None
+
+    def update(self, result: ProbeResult, alpha: float = EWMA_ALPHA) -> None:
+        self.samples += 1
+        self.last_result = result
+        lost = 0.0 if result.ok else 1.0
+        self.loss = lost if self.samples == 1 else alpha * lost + (1 - alpha) * self.loss
+        if result.ok:
+            self.failures = 0
+            self.latency = result.latency if self.latency is None else alpha * result.latency + (1 - alpha) * self.latency
+        else:
+            self.failures += 1
+
+    @property
+    def score(self) -> float:
+        """越小越好, 从未成功过的节点为无穷大"""
+        if self.latency is None:
+            return math.inf
+        return self.latency * (1 + LOSS_WEIGHT * self.loss)
+
+    def healthy(self, fail_threshold: int = FAIL_THRESHOLD) -> bool:
+        return self.latency is not None and self.failures < fail_threshold
+
+    def __dict__(self) -> dict[str, any]:
+        return {
+            "name": self.node.name,
+            "latency": self.latency,
+            "loss": self.loss,
+            "score": self.score,
+            "failures": self.failures,
+        }
+
+    def to_dict(self) -> dict[str, any]:
+        return self.__dict__()
+
+
+class NodeSelector:
+    """定期探测节点, 按 EWMA 延迟与丢包评分自动启动最优节点, 当前节点失效时切换到次优节点
+
+    start/stop 负责实际启停节点, start 返回 False 时尝试下一个候选节点;
+    is_alive 可选, 用于把代理进程退出也计为一次失败
+    """
+
+    def __init__(
+        self,
+        nodes: Iterable[File],
+        start: Callable[[File], bool],
+        stop: Callable[[File], None],
+        prober: Optional[LatencyProber] = None,
+        is_alive: Optional[Callable[[File], bool]] = None,
+        interval: float = CHECK_INTERVAL,
+        fail_interval: float = FAIL_CHECK_INTERVAL,
+        fail_threshold: int = FAIL_THRESHOLD,
+        switch_margin: float = SWITCH_MARGIN,
+        switch_after: int = SWITCH_AFTER,
+        min_hold: float = MIN_HOLD,
+        alpha: float = EWMA_ALPHA,
+    ) -> None:
+        self.scores = {node.name: NodeScore(node) for node in nodes}
+        self._start = start
+        self._stop = stop
+        self.prober = prober or LatencyProber(ttl=0, error_ttl=0)
+        self.is_alive = is_alive
+        self.interval = interval
+        self.fail_interval = fail_interval
+        self.fail_threshold = fail_threshold
+        self.switch_margin = switch_margin
+        self.switch_after = switch_after
+        self.min_hold = min_hold
+        self.alpha = alpha
+        self.active: Optional[str] = None
+        self.switched_at = 0.0
+        self._better_count = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _candidates(self, exclude: Optional[str] = None) -> list[NodeScore]:
+        healthy = [s for name, s in self.scores.items() if name != exclude and s.healthy(self.fail_threshold)]
+        return sorted(healthy, key=lambda s: s.score)
+
+    def _switch(self, candidates: list[NodeScore]) -> bool:
+        """依次尝试候选节点, 启动成功即返回"""
+        old = self.scores.get(self.active, None) if self.active else None
+        if old is not None:
+            self._stop(old.node)
+            self.active = None
+        for candidate in candidates:
+            if self._start(candidate.node):
+                self.active = candidate.node.name
+                self.switched_at = time.monotonic()
+                self._better_count = 0
+                logging.info(f"切换节点:{old.node.name if old else None} -> {self.active}, 评分:{candidate.score:.4f}")
+                return True
+            logging.error(f"启动节点{candidate.node.name}失败")
+            candidate.failures = self.fail_threshold
+        return False
+
+    def check(self, full: bool = True) -> Optional[str]:
+        """执行一轮健康检查与选择, 返回当前节点名; full 为 False 时只探测当前节点"""
+        with self._lock:
+            active = self.scores.get(self.active, None) if self.active else None
+            if full or active is None:
+                nodes = [s.node for s in self.scores.values()]
+            else:
+                nodes = [active.node]
+        # 探测可能耗时数秒, 不持锁, 期间 states() 和 stop() 不会被阻塞
+        results = self.prober.probe_all(nodes, force=True)
+        with self._lock:
+            for name, result in results.items():
+                score = self.scores.get(name, None)
+                if score is not None:
+                    score.update(result, self.alpha)
+            if self._stop_event.is_set():
+                # 探测期间已调用 stop(), 不再启动节点
+                return self.active
+            active = self.scores.get(self.active, None) if self.active else None
+            if active is not None and self.is_alive is not None and not self.is_alive(active.node):
+                logging.error(f"节点{active.node.name}的代理进程已退出")
+                active.failures = max(active.failures, self.fail_threshold)
+
+            if active is None:
+                self._switch(self._candidates())
+            elif not active.healthy(self.fail_threshold):
+                candidates = self._candidates(exclude=active.node.name)
+                if candidates:
+                    logging.error(f"节点{active.node.name}不可用, 切换到次优节点")
+                    self._switch(candidates)
+            elif full:
+                # 只在全部节点都有新数据时比较, 避免只探测当前节点时累计滞回计数
+                best = self._candidates(exclude=active.node.name)
+                better = bool(best) and best[0].score < active.score * (1 - self.switch_margin)
+                self._better_count = self._better_count + 1 if better else 0
+                held = time.monotonic() - self.switched_at >= self.min_hold
+                if better and held and self._better_count >= self.switch_after:
+                    self._switch(best)
+            return self.active
+
+    def _loop(self) -> None:
+        next_full = 0.0
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            full = now >= next_full or self.active is None
+            if full:
+                next_full = now + self.interval
+            try:
+                self.check(full)
+            except Exception as e:
+                logging.error(f"节点健康检查失败:{e}")
+            self._stop_event.wait(min(self.fail_interval, self.interval))
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="node-selector", daemon=True)
+        self._thread.start()
+
+    def stop(self, stop_active: bool = True) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if stop_active and self.active:
+                self._stop(self.scores[self.active].node)
+                self.active = None
+
+    def states(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: score.to_dict() for name, score in self.scores.items()}
@@ -1,29 +1,361 @@
+import enum
+import logging
+import os
+import socket
 import threading
+import time
+from typing import Iterator, Optional
 
+from talkProxy.core.hysteria2 import SPAWN_FAILED_EXIT_CODE, Hysteria2
+from talkProxy.core.log_subscription import LogSubscription
+from talkProxy.log.store import LogStore
+from talkProxy.tools import yaml_backend
+from talkProxy.tools.common import atomic_write
+from talkProxy.tools.config import File
+from talkProxy.tools.metrics import Family, register_collector
 
-class ProxyManager():
+PORT_RANGE = (20000, 20999)
+# 崩溃重启的退避时间(秒): base * 2^n, 不超过 max
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# 连续运行超过该时间(秒)后清零重启计数
+STABLE_TIME = 30.0
+STOP_TIMEOUT = 5.0
+SUPERVISE_INTERVAL = 0.1
+# 等待本地监听端口就绪时的轮询间隔(秒)
+READY_POLL_INTERVAL = 0.02
+
+
+class InstanceState(enum.Enum):
+    STARTING = "starting"
+    RUNNING = "running"
+    BACKOFF = "backoff"
+    STOPPING = "stopping"
+    STOPPED = "stopped"
+
+
+def wait_ready(hysteria: Hysteria2, address: tuple[str, int], timeout: float) -> bool:
+    """轮询本地监听端口, 可以建立连接即视为代理就绪; 进程退出或启动失败时立即返回 False"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        exit_code = hysteria.exit_code()
+        if exit_code is not None:
+            logging.error(f"hysteria 进程已退出, 返回码:{exit_code}")
+            return False
+        try:
+            with socket.create_connection(address, timeout=READY_POLL_INTERVAL * 5):
+                return True
+        except OSError:
+            time.sleep(READY_POLL_INTERVAL)
+    return False
+
+
+class PortPool:
+    """从端口区间中分配本地监听端口, 跳过已被其他程序占用的端口"""
+
+    def __init__(self, start: int, end: int) -> None:
+        self.start = start
+        self.end = end
+        self._lock = threading.Lock()
+        self._used: set[int] = set()
+
+    @staticmethod
+    def _is_free(port: int) -> bool:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            try:
+                s.bind(("127.0.0.1", port))
+            except OSError:
+                return False
+        return True
+
+    def allocate(self) -> Optional[int]:
+        with self._lock:
+            for port in range(self.start, self.end + 1):
+                if port in self._used or not self._is_free(port):
+                    continue
+                self._used.add(port)
+                return port
+        return None
+
+    def release(self, port: Optional[int]) -> None:
+        with self._lock:
+            self._used.discard(port)
+
+
+class ProxyInstance:
+    def __init__(self, name: str, node: File, http_port: int, socks_port: int, config_path: str) -> None:
+        self.name = name
+        self.node = node
+        self.http_port = http_port
+        self.socks_port = socks_port
+        self.config_path = config_path
+        self.state = InstanceState.STARTING
+        self.hysteria: Optional[Hysteria2] = None
+        self.log_subscription: Optional[LogSubscription] = None
+        self.log_thread: Optional[threading.Thread] = None
+        self.restarts = 0
+        # 当前这一轮连续崩溃的次数, 决定退避时间
+        self.failures = 0
+        self.started_at: Optional[float] = None
+        self.next_start_at: Optional[float] = None
+        self.last_exit_code: Optional[int] = None
+
+    def uptime(self) -> float:
+        if self.state != InstanceState.RUNNING or self.started_at is None:
+            return 0.0
+        return time.monotonic() - self.started_at
+
+    def __dict__(self) -> dict[str, any]:
+        return {
+            "name": self.name,
+            "node": self.node.name,
+            "state": self.state.value,
+            "httpPort": self.http_port,
+            "socksPort": self.socks_port,
+            "restarts": self.restarts,
+            "uptime": self.uptime(),
+            "lastExitCode": self.last_exit_code,
+        }
+
+    def to_dict(self) -> dict[str, any]:
+        return self.__dict__()
+
+    def __repr__(self) -> str:
+        return f"ProxyInstance({self.name}, {self.state.value}, http:{self.http_port}, socks:{self.socks_port})"
+
+
+class ProxySupervisor:
+    """管理多个 hysteria2 子进程: 分配端口、崩溃后指数退避重启、限时停止"""
+
+    def __init__(
+        self,
+        bin_path: str,
+        runtime_dir: str,
+        port_range: tuple[int, int] = PORT_RANGE,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+        stable_time: float = STABLE_TIME,
+        stop_timeout: float = STOP_TIMEOUT,
+        log_store: Optional[LogStore] = None,
+    ) -> None:
+        self.bin_path = bin_path
+        # 指定时各实例的日志解析后按实例名写入
+        self.log_store = log_store
+        self.runtime_dir = runtime_dir
+        self.ports = PortPool(*port_range)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_time = stable_time
+        self.stop_timeout = stop_timeout
+        self._lock = threading.RLock()
+        self._instances: dict[str, ProxyInstance] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 只保存弱引用, supervisor 回收后自动移除
+        register_collector(self.collect_metrics)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._supervise, name="proxy-supervisor", daemon=True)
+        self._thread.start()
+
+    def _write_instance_config(self, instance: ProxyInstance) -> bool:
+        try:
+            node_config = yaml_backend.load_file(instance.node.path, use_cache=False) or {}
+            node_config["http"] = {**(node_config.get("http", None) or {}), "listen": f"127.0.0.1:{instance.http_port}"}
+            node_config["socks"] = {**(node_config.get("socks", None) or {}), "listen": f"127.0.0.1:{instance.socks_port}"}
+            os.makedirs(self.runtime_dir, exist_ok=True)
+            atomic_write(instance.config_path, yaml_backend.dump(node_config), sync_dir=False)
+        except Exception as e:
+            logging.error(f"生成{instance.name}运行配置失败:{e}")
+            return False
+        return True
+
+    def _spawn(self, instance: ProxyInstance) -> None:
+        instance.hysteria = Hysteria2(cmd=[self.bin_path, "-c", instance.config_path])
+        if self.log_store is not None:
+            if instance.log_subscription is not None:
+                instance.log_subscription.close()
+            instance.log_subscription = instance.hysteria.subscribe()
+            instance.log_thread = self.log_store.attach(instance.name, instance.log_subscription)
+        instance.hysteria.start()
+        instance.state = InstanceState.RUNNING
+        instance.started_at = time.monotonic()
+        instance.next_start_at = None
+
+    def start(self, node: File, name: Optional[str] = None) -> Optional[ProxyInstance]:
+        name = name or node.name
+        with self._lock:
+            if name in self._instances:
+                logging.error(f"实例{name}已存在")
+                return None
+            http_port = self.ports.allocate()
+            socks_port = self.ports.allocate()
+            if http_port is None or socks_port is None:
+                logging.error("没有可用的本地端口")
+                self.ports.release(http_port)
+                self.ports.release(socks_port)
+                return None
+            config_path = os.path.join(self.runtime_dir, f"{name}.yaml")
+            instance = ProxyInstance(name, node, http_port, socks_port, config_path)
+            if not self._write_instance_config(instance):
+                self.ports.release(http_port)
+                self.ports.release(socks_port)
+                return None
+            self._instances[name] = instance
+            self._spawn(instance)
+            self._ensure_thread()
+        logging.info(f"实例{name}已启动, http:{http_port}, socks:{socks_port}")
+        return instance
+
+    def stop(self, name: str) -> bool:
+        with self._lock:
+            instance = self._instances.get(name, None)
+            if instance is None:
+                return False
+            instance.state = InstanceState.STOPPING
+        if instance.hysteria is not None:
+            instance.last_exit_code = instance.hysteria.stop(self.stop_timeout)
+        if instance.log_subscription is not None:
+            # 关闭后订阅线程会先交付剩余的日志再退出
+            instance.log_subscription.close()
+            if instance.log_thread is not None:
+                instance.log_thread.join(self.stop_timeout)
+        if self.log_store is not None:
+            self.log_store.flush(name)
+        with self._lock:
+            instance.state = InstanceState.STOPPED
+            self._instances.pop(name, None)
+            self.ports.release(instance.http_port)
+            self.ports.release(instance.socks_port)
+        if os.path.exists(instance.config_path):
+            os.remove(instance.config_path)
+        logging.info(f"实例{name}已停止")
+        return True
+
+    def stop_all(self) -> bool:
+        with self._lock:
+            names = list(self._instances)
+        # 各实例并行停止, 总耗时不超过单个实例的停止超时
+        threads = [threading.Thread(target=self.stop, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(self.stop_timeout)
+        if self.log_store is not None:
+            self.log_store.close()
+        return True
+
+    def get_instance(self, name: str) -> Optional[ProxyInstance]:
+        with self._lock:
+            return self._instances.get(name, None)
+
+    def states(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: instance.to_dict() for name, instance in self._instances.items()}
+
+    def pids(self) -> dict[str, int]:
+        """运行中实例的 实例名 -> 子进程 pid"""
+        with self._lock:
+            instances = list(self._instances.values())
+        pids = {}
+        for instance in instances:
+            pid = instance.hysteria.pid() if instance.hysteria is not None else None
+            if pid is not None:
+                pids[instance.name] = pid
+        return pids
+
+    def collect_metrics(self) -> Iterator[Family]:
+        """各实例的运行状态、运行时间与重启次数"""
+        with self._lock:
+            instances = list(self._instances.values())
+        up, uptime, restarts = [], [], []
+        for instance in instances:
+            labels = (("instance", instance.name),)
+            up.append(("", labels, 1 if instance.state == InstanceState.RUNNING else 0))
+            uptime.append(("", labels, instance.uptime()))
+            restarts.append(("", labels, instance.restarts))
+        yield Family("talkproxy_instance_up", "gauge", "实例是否在运行", up)
+        yield Family("talkproxy_instance_uptime_seconds", "gauge", "实例本次启动后的运行秒数", uptime)
+        yield Family("talkproxy_instance_restarts_total", "counter", "实例崩溃后被重启的次数", restarts)
+
+    def _backoff(self, failures: int) -> float:
+        return min(self.backoff_base * (2 ** max(failures - 1, 0)), self.backoff_max)
+
+    def _check(self, instance: ProxyInstance, now: float) -> None:
+        if instance.state == InstanceState.RUNNING:
+            exit_code = instance.hysteria.exit_code()
+            if exit_code is None and not instance.hysteria.is_alive():
+                # 线程已结束却没有子进程, 同样视为退出
+                exit_code = SPAWN_FAILED_EXIT_CODE
+            if exit_code is None:
+                if instance.failures and now - instance.started_at >= self.stable_time:
+                    instance.failures = 0
+                return
+            instance.last_exit_code = exit_code
+            instance.failures += 1
+            delay = self._backoff(instance.failures)
+            instance.state = InstanceState.BACKOFF
+            instance.next_start_at = now + delay
+            logging.error(f"实例{instance.name}异常退出, 返回码:{exit_code}, {delay:.1f}秒后重启")
+        elif instance.state == InstanceState.BACKOFF and now >= instance.next_start_at:
+            instance.restarts += 1
+            self._spawn(instance)
+
+    def _supervise(self) -> None:
+        while not self._stop_event.wait(SUPERVISE_INTERVAL):
+            now = time.monotonic()
+            with self._lock:
+                for instance in list(self._instances.values()):
+                    self._check(instance, now)
+
+
+class ProxyManager:
     _lock = threading.Lock()
     _instance = None
-    proxy = None
-    
-    
+    supervisor: Optional[ProxySupervisor] = None
+
     def __init__(self) -> None:
         pass
-    
+
     def __new__(cls) -> None:
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super().__new__(cls)
         return cls._instance
-    
+
     @classmethod
-    def Init(cls:'ProxyManager') -> bool:
-        pass
-    
+    def Init(cls: "ProxyManager", bin_path: str, runtime_dir: str, **kwargs: dict) -> bool:
+        with cls._lock:
+            if cls.supervisor is not None:
+                logging.error("ProxyManager 已初始化")
+                return False
+            cls.supervisor = ProxySupervisor(bin_path, runtime_dir, **kwargs)
+        return True
+
     @classmethod
-    def Start(cls:'ProxyManager') -> bool:
-        pass
-    
+    def Start(cls: "ProxyManager", node: File, name: Optional[str] = None) -> Optional[ProxyInstance]:
+        if cls.supervisor is None:
+            logging.error("ProxyManager 未初始化")
+            return None
+        return cls.supervisor.start(node, name)
+
+    @classmethod
+    def Stop(cls: "ProxyManager", name: Optional[str] = None) -> bool:
+        """不指定实例名时停止全部实例"""
+        if cls.supervisor is None:
+            return False
+        if name is None:
+            return cls.supervisor.stop_all()
+        return cls.supervisor.stop(name)
+
     @classmethod
-    def Stop(cls:'ProxyManager') -> bool:
-        pass
\ No newline at end of file
+    def States(cls: "ProxyManager") -> dict[str, dict]:
+        if cls.supervisor is None:
+            return {}
+        return cls.supervisor.states()
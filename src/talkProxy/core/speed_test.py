@@ -0,0 +1,302 @@
+import logging
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+from urllib.parse import urlsplit
+
+from talkProxy.core.hysteria2 import Hysteria2
+from talkProxy.core.proxyManager import ProxySupervisor, wait_ready
+from talkProxy.tools import yaml_backend
+from talkProxy.tools.common import percentile
+from talkProxy.tools.config import File
+
+SPEED_TEST_DURATION = 5.0
+CONNECT_TIMEOUT = 10.0
+READY_TIMEOUT = 10.0
+RECV_SIZE = 64 * 1024
+UPLOAD_CHUNK = b"\0" * (64 * 1024)
+# 抖动取收到数据块间隔的该百分位
+JITTER_PERCENTILE = 95
+MB = 1024 * 1024
+
+
+class SpeedResult:
+    def __init__(self, name: str, proxy: str) -> None:
+        self.name = name
+        self.proxy = proxy
+        # MB/s
+        self.download: Optional[float] = None
+        self.upload: Optional[float] = None
+        # 从发起连接到收到第一个响应体字节的时间(秒)
+        self.ttfb: Optional[float] = None
+        # 下载过程中数据块到达间隔的百分位(秒)
+        self.jitter: Optional[float] = None
+        self.downloaded = 0
+        self.uploaded = 0
+        self.error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.download is not None
+
+    def __dict__(self) -> dict[str, any]:
+        return {
+            "name": self.name,
+            "proxy": self.proxy,
+            "download": self.download,
+            "upload": self.upload,
+            "ttfb": self.ttfb,
+            "jitter": self.jitter,
+            "downloaded": self.downloaded,
+            "uploaded": self.uploaded,
+            "error": self.error,
+        }
+
+    def to_dict(self) -> dict[str, any]:
+        return self.__dict__()
+
+    def __repr__(self) -> str:
+        if self.error:
+            return f"SpeedResult({self.name}, error:{self.error})"
+        return f"SpeedResult({self.name}, down:{self.download}MB/s, up:{self.upload}MB/s, ttfb:{self.ttfb})"
+
+
+def listen_address(node_config: dict, kind: str) -> Optional[tuple[str, int]]:
+    """节点配置中 http 或 socks 的本地监听地址"""
+    listen = (node_config.get(kind) or {}).get("listen")
+    if not listen:
+        return None
+    host, _, port = str(listen).rpartition(":")
+    if not port.isdigit():
+        return None
+    return host or "127.0.0.1", int(port)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("代理提前关闭连接")
+        data += chunk
+    return data
+
+
+def socks5_connect(proxy: tuple[str, int], host: str, port: int, timeout: float) -> socket.socket:
+    """通过 SOCKS5(无认证) 建立到目标的连接"""
+    sock = socket.create_connection(proxy, timeout=timeout)
+    try:
+        sock.sendall(b"\x05\x01\x00")
+        if _recv_exact(sock, 2) != b"\x05\x00":
+            raise ConnectionError("SOCKS5 握手失败")
+        encoded = host.encode("idna")
+        sock.sendall(b"\x05\x01\x00\x03" + bytes([len(encoded)]) + encoded + struct.pack("!H", port))
+        reply = _recv_exact(sock, 4)
+        if reply[1] != 0:
+            raise ConnectionError(f"SOCKS5 连接失败, 错误码:{reply[1]}")
+        atyp = reply[3]
+        if atyp == 1:
+            _recv_exact(sock, 4 + 2)
+        elif atyp == 4:
+            _recv_exact(sock, 16 + 2)
+        else:
+            _recv_exact(sock, _recv_exact(sock, 1)[0] + 2)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _open(url: str, proxy_kind: str, proxy: tuple[str, int], timeout: float) -> tuple[socket.socket, str]:
+    """返回连接与请求行中使用的目标, HTTP 代理使用绝对 URI"""
+    parts = urlsplit(url)
+    if parts.scheme != "http":
+        raise ValueError("测速地址只支持 http")
+    port = parts.port or 80
+    target = parts.path or "/"
+    if parts.query:
+        target += f"?{parts.query}"
+    if proxy_kind == "socks":
+        return socks5_connect(proxy, parts.hostname, port, timeout), target
+    return socket.create_connection(proxy, timeout=timeout), url
+
+
+def _read_headers(sock: socket.socket) -> tuple[int, bytes]:
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            raise ConnectionError("响应头不完整")
+        data += chunk
+    head, _, rest = data.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0]
+    fields = status_line.split(b" ", 2)
+    if len(fields) < 2 or not fields[0].startswith(b"HTTP/") or not fields[1].isdigit():
+        raise ConnectionError(f"响应状态行无效:{status_line[:64]!r}")
+    return int(fields[1]), rest
+
+
+def measure_download(
+    url: str, proxy_kind: str, proxy: tuple[str, int], duration: float, timeout: float = CONNECT_TIMEOUT
+) -> tuple[int, float, float, list[float]]:
+    """下载至多 duration 秒, 返回 字节数, 耗时, 首字节时间, 数据块到达间隔"""
+    start = time.perf_counter()
+    sock, target = _open(url, proxy_kind, proxy, timeout)
+    with sock:
+        host = urlsplit(url).netloc
+        sock.sendall(f"GET {target} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+        status, body = _read_headers(sock)
+        if status != 200:
+            raise ConnectionError(f"下载返回状态码:{status}")
+        first = time.perf_counter()
+        received = len(body)
+        gaps = []
+        last = first
+        deadline = first + duration
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            sock.settimeout(min(timeout, deadline - now))
+            try:
+                chunk = sock.recv(RECV_SIZE)
+            except socket.timeout:
+                break
+            if not chunk:
+                break
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+            received += len(chunk)
+        return received, last - first, first - start, gaps
+
+
+def measure_upload(
+    url: str, proxy_kind: str, proxy: tuple[str, int], duration: float, timeout: float = CONNECT_TIMEOUT
+) -> tuple[int, float]:
+    """以 chunked 方式上传 duration 秒, 收到响应后返回 字节数, 耗时"""
+    sock, target = _open(url, proxy_kind, proxy, timeout)
+    with sock:
+        host = urlsplit(url).netloc
+        sock.sendall(
+            f"POST {target} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\nTransfer-Encoding: chunked\r\n\r\n".encode()
+        )
+        chunk = f"{len(UPLOAD_CHUNK):x}\r\n".encode() + UPLOAD_CHUNK + b"\r\n"
+        sent = 0
+        start = time.perf_counter()
+        deadline = start + duration
+        while time.perf_counter() < deadline:
+            sock.sendall(chunk)
+            sent += len(UPLOAD_CHUNK)
+        sock.sendall(b"0\r\n\r\n")
+        # 服务端读完全部数据后才响应, 计时包含排空缓冲的时间
+        status, _ = _read_headers(sock)
+        elapsed = time.perf_counter() - start
+        if status not in (200, 201, 204):
+            raise ConnectionError(f"上传返回状态码:{status}")
+        return sent, elapsed
+
+
+class SpeedTester:
+    """逐个或有限并发地启动节点, 通过本地 http/socks 端口测速
+
+    parallel 为 1 时直接使用节点配置中的监听端口(即 GlobalConfig 中的 httpPort/socksPort),
+    并发测速时由 ProxySupervisor 为每个节点分配独立端口
+    """
+
+    def __init__(
+        self,
+        bin_path: str,
+        download_url: str,
+        upload_url: Optional[str] = None,
+        proxy: str = "socks",
+        duration: float = SPEED_TEST_DURATION,
+        parallel: int = 1,
+        runtime_dir: Optional[str] = None,
+        ready_timeout: float = READY_TIMEOUT,
+        timeout: float = CONNECT_TIMEOUT,
+        jitter_percentile: float = JITTER_PERCENTILE,
+    ) -> None:
+        if proxy not in ("socks", "http"):
+            raise ValueError(f"不支持的代理类型:{proxy}")
+        if parallel > 1 and runtime_dir is None:
+            raise ValueError("并发测速需要 runtime_dir 存放各实例配置")
+        self.bin_path = bin_path
+        self.download_url = download_url
+        self.upload_url = upload_url
+        self.proxy = proxy
+        self.duration = duration
+        self.parallel = max(parallel, 1)
+        self.ready_timeout = ready_timeout
+        self.timeout = timeout
+        self.jitter_percentile = jitter_percentile
+        self.supervisor = ProxySupervisor(bin_path, runtime_dir) if self.parallel > 1 else None
+
+    def measure(self, name: str, address: tuple[str, int]) -> SpeedResult:
+        """对已经就绪的本地代理测速"""
+        result = SpeedResult(name, self.proxy)
+        try:
+            received, elapsed, ttfb, gaps = measure_download(
+                self.download_url, self.proxy, address, self.duration, self.timeout
+            )
+            result.downloaded = received
+            result.download = round(received / MB / elapsed, 3) if elapsed > 0 else None
+            result.ttfb = ttfb
+            result.jitter = percentile(gaps, self.jitter_percentile)
+            if self.upload_url:
+                sent, elapsed = measure_upload(self.upload_url, self.proxy, address, self.duration, self.timeout)
+                result.uploaded = sent
+                result.upload = round(sent / MB / elapsed, 3) if elapsed > 0 else None
+        except (OSError, ValueError) as e:
+            result.error = str(e) or type(e).__name__
+        return result
+
+    def _start(self, node: File) -> tuple[Optional[Hysteria2], Optional[tuple[str, int]], Optional[str]]:
+        if self.supervisor is not None:
+            instance = self.supervisor.start(node, name=node.name)
+            if instance is None:
+                return None, None, "启动实例失败"
+            port = instance.socks_port if self.proxy == "socks" else instance.http_port
+            return instance.hysteria, ("127.0.0.1", port), None
+        try:
+            address = listen_address(yaml_backend.load_file(node.path, use_cache=False) or {}, self.proxy)
+        except OSError as e:
+            return None, None, str(e)
+        if address is None:
+            return None, None, f"节点配置中没有 {self.proxy} 监听地址"
+        hysteria = Hysteria2(cmd=[self.bin_path, "-c", node.path])
+        hysteria.start()
+        return hysteria, address, None
+
+    def _stop(self, node: File, hysteria: Optional[Hysteria2]) -> None:
+        if self.supervisor is not None:
+            self.supervisor.stop(node.name)
+        elif hysteria is not None:
+            hysteria.stop()
+
+    def test_node(self, node: File) -> SpeedResult:
+        hysteria, address, error = self._start(node)
+        try:
+            if error is None and not wait_ready(hysteria, address, self.ready_timeout):
+                error = "代理未就绪"
+            if error is not None:
+                result = SpeedResult(node.name, self.proxy)
+                result.error = error
+                return result
+            result = self.measure(node.name, address)
+        finally:
+            self._stop(node, hysteria)
+        logging.info(f"测速完成:{result}")
+        return result
+
+    def run(self, nodes: Iterable[File]) -> list[SpeedResult]:
+        """按输入顺序返回结果"""
+        nodes = list(nodes)
+        if self.parallel == 1:
+            return [self.test_node(node) for node in nodes]
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            results = list(executor.map(self.test_node, nodes))
+        self.supervisor.stop_all()
+        return results
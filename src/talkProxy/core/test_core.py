@@ -33,20 +33,688 @@ class Test(unittest.TestCase):
             config_path = proxy.file_path
             cmd = [bin_path, "-c", config_path]
             hysteria = Hysteria(cmd=cmd)
+            subscription = hysteria.subscribe()
+            subscription.on_batch(lambda batch: logging.info(f"Received logs: {batch}"))
             hysteria.start()
             print(id(hysteria))
-            start_time = time.time()
-            while True:
+            time.sleep(10)
+            subscription.close()
+        config1()
+
+
+FAKE_HYSTERIA = '''#!{python}
+import signal
+import sys
+import time
+
+import yaml
+
+with open(sys.argv[sys.argv.index("-c") + 1]) as f:
+    fake = (yaml.safe_load(f) or {{}}).get("fake", None) or {{}}
+if fake.get("ignore_term", False):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+print("fake hysteria started", flush=True)
+deadline = time.monotonic() + fake.get("exit_after", 3600)
+while time.monotonic() < deadline:
+    time.sleep(0.01)
+sys.exit(3)
+'''
+
+
+class TestProxyManager(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        import sys
+        import tempfile
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bin_path = os.path.join(self.tmp_dir.name, 'hysteria')
+        with open(self.bin_path, 'w') as f:
+            f.write(FAKE_HYSTERIA.format(python=sys.executable))
+        os.chmod(self.bin_path, 0o755)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def node(self, name, **fake):
+        import os
+        import yaml
+        from talkProxy.tools.config import File
+        path = os.path.join(self.tmp_dir.name, f'{name}.yaml')
+        with open(path, 'w') as f:
+            yaml.safe_dump({'server': 'example.com:443', 'socks': {'listen': '127.0.0.1:1080'}, 'fake': fake}, f)
+        return File(name, 'hysteria2', path)
+
+    def wait_for(self, predicate, timeout=5.0):
+        import time
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_proxy_supervisor(self):
+        import os
+        import sys
+        import yaml
+        from talkProxy.core.proxyManager import InstanceState, ProxySupervisor
+        from talkProxy.log.store import LogStore
+        if not sys.platform.startswith('linux'):
+            self.skipTest('需要 Linux')
+
+        runtime_dir = os.path.join(self.tmp_dir.name, 'instances')
+        log_store = LogStore(os.path.join(self.tmp_dir.name, 'logs'))
+        supervisor = ProxySupervisor(self.bin_path, runtime_dir, port_range=(21000, 21099),
+                                     backoff_base=0.1, backoff_max=0.4, stop_timeout=0.5, log_store=log_store)
+        try:
+            a = supervisor.start(self.node('a'))
+            b = supervisor.start(self.node('b', exit_after=0.2))
+            self.assertIsNone(supervisor.start(self.node('a')))
+            ports = {a.http_port, a.socks_port, b.http_port, b.socks_port}
+            self.assertEqual(len(ports), 4)
+            with open(a.config_path) as f:
+                config = yaml.safe_load(f)
+            self.assertEqual(config['socks']['listen'], f'127.0.0.1:{a.socks_port}')
+            self.assertEqual(config['http']['listen'], f'127.0.0.1:{a.http_port}')
+
+            # b 反复崩溃, 按退避时间重启
+            self.assertTrue(self.wait_for(lambda: b.restarts >= 2))
+            self.assertEqual(b.last_exit_code, 3)
+            self.assertEqual(supervisor._backoff(10), 0.4)
+            self.assertEqual(supervisor.states()['a']['state'], InstanceState.RUNNING.value)
+            self.assertEqual(a.restarts, 0)
+
+            self.assertTrue(supervisor.stop('b'))
+            self.assertFalse(os.path.exists(b.config_path))
+            self.assertNotIn('b', supervisor.states())
+        finally:
+            supervisor.stop_all()
+        self.assertEqual(supervisor.states(), {})
+        # 每次重启的日志都写入同一个实例名下
+        self.assertTrue(self.wait_for(lambda: len(log_store.search('b', contains='fake hysteria started')) >= 2))
+        self.assertEqual(len(log_store.search('a')), 1)
+
+    def test_proxy_supervisor_kill(self):
+        import os
+        import signal
+        import sys
+        import time
+        from talkProxy.core.proxyManager import ProxySupervisor
+        if not sys.platform.startswith('linux'):
+            self.skipTest('需要 Linux')
+
+        supervisor = ProxySupervisor(self.bin_path, os.path.join(self.tmp_dir.name, 'instances'),
+                                     port_range=(21100, 21199), stop_timeout=0.3)
+        instance = supervisor.start(self.node('stubborn', ignore_term=True))
+        self.assertTrue(self.wait_for(lambda: instance.hysteria.sub_process is not None))
+        # 等子进程装好 SIGTERM 处理
+        self.assertTrue(self.wait_for(lambda: any(True for _ in instance.hysteria.get_logs())))
+        start = time.monotonic()
+        supervisor.stop_all()
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(instance.last_exit_code, -signal.SIGKILL)
+        self.assertEqual(supervisor.ports._used, set())
+
+    def test_proxy_supervisor_missing_binary(self):
+        import os
+        from talkProxy.core.hysteria2 import SPAWN_FAILED_EXIT_CODE
+        from talkProxy.core.proxyManager import InstanceState, ProxySupervisor
+
+        supervisor = ProxySupervisor(os.path.join(self.tmp_dir.name, 'missing'), os.path.join(self.tmp_dir.name, 'instances'),
+                                     port_range=(21200, 21299), backoff_base=0.1, backoff_max=0.2)
+        try:
+            instance = supervisor.start(self.node('missing'))
+            # 启动失败计为退出, 进入退避并重启, 不会一直显示为运行中
+            self.assertTrue(self.wait_for(lambda: instance.restarts >= 1))
+            self.assertEqual(instance.last_exit_code, SPAWN_FAILED_EXIT_CODE)
+            self.assertTrue(self.wait_for(lambda: supervisor.states()['missing']['state'] == InstanceState.BACKOFF.value))
+            self.assertEqual(instance.hysteria.exit_code(), SPAWN_FAILED_EXIT_CODE)
+        finally:
+            supervisor.stop_all()
+
+    def test_pipe_reader(self):
+        import os
+        import sys
+        from talkProxy.core.hysteria2 import Hysteria2
+        from talkProxy.core.log_reader import MAX_LINE_BYTES, LogBuffer, get_reader
+        if not sys.platform.startswith('linux'):
+            self.skipTest('需要 Linux')
+
+        script = ('import sys\n'
+                  'for i in range(5000):\n'
+                  '    print(f"line {i}")\n'
+                  'sys.stdout.flush()\n'
+                  'sys.stdout.buffer.write("partial 中".encode())\n')
+        children = [Hysteria2([sys.executable, '-c', script], log_lines=1000) for _ in range(3)]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join(10)
+            self.assertEqual(child.stop(1), 0)
+            stats = child.log_stats()
+            self.assertEqual(stats['total'], 5001)
+            self.assertEqual(stats['dropped'], 4001)
+            lines = list(child.get_logs())
+            self.assertEqual(len(lines), 1000)
+            # 没有换行结尾的最后一行在 EOF 时写入
+            self.assertEqual(lines[-2:], ['line 4999', 'partial 中'])
+
+        # 没有换行的超长行截断成一行, 不会整块丢失
+        read_fd, write_fd = os.pipe()
+        buffer = LogBuffer()
+        closed = get_reader().register(os.fdopen(read_fd, 'rb'), buffer)
+        os.write(write_fd, b'x' * (MAX_LINE_BYTES + 10))
+        os.close(write_fd)
+        self.assertTrue(closed.wait(5))
+        self.assertEqual(sum(len(line) for line in buffer.snapshot()), MAX_LINE_BYTES + 10)
+        self.assertLessEqual(len(buffer.snapshot()), 2)
+
+    def test_log_subscription(self):
+        import asyncio
+        import time
+        from talkProxy.core.log_reader import LogBuffer
+        from talkProxy.core.log_subscription import LogSubscription
+
+        buffer = LogBuffer(100)
+        buffer.extend(['old'])
+        fast = LogSubscription(buffer, max_batch=10, max_latency=0.05, replay=True)
+        slow = LogSubscription(buffer, max_batch=10, max_pending=20)
+        batches = []
+        fast.on_batch(batches.append)
+
+        buffer.extend([f'line {i}' for i in range(25)])
+        self.assertTrue(self.wait_for(lambda: sum(map(len, batches)) == 26))
+        self.assertTrue(all(len(batch) <= 10 for batch in batches))
+        self.assertEqual(batches[0][0], 'old')
+        # 慢订阅者只保留最新的 20 行
+        self.assertEqual(slow.stats()['dropped'], 5)
+        self.assertEqual(slow.get_batch(0)[0], 'line 5')
+
+        # 不满一批时等待 max_latency 后交付
+        start = time.monotonic()
+        buffer.extend(['tail'])
+        self.assertTrue(self.wait_for(lambda: batches[-1] == ['tail']))
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+        # 写入线程持续写入时 replay 订阅, 回放与之后交付的行首尾相接, 没有遗漏或重复
+        import threading
+        racing = LogBuffer(100000)
+        stop = threading.Event()
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                racing.extend([str(i)])
+                i += 1
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        while len(racing) < 100:
+            time.sleep(0.001)
+        subscription = LogSubscription(racing, max_batch=100000, max_pending=100000, replay=True)
+        time.sleep(0.05)
+        stop.set()
+        thread.join()
+        received = [int(line) for line in subscription.get_batch(0)]
+        subscription.close()
+        self.assertEqual(received, list(range(len(received))))
+        self.assertEqual(len(received), racing.total)
+
+        async def consume():
+            subscription = LogSubscription(buffer, max_batch=3, max_latency=0.01)
+            asyncio.get_running_loop().call_later(0.02, buffer.extend, ['a', 'b', 'c', 'd'])
+            result = []
+            async for batch in subscription:
+                result.append(batch)
+                if sum(map(len, result)) == 4:
+                    subscription.close()
+            return result
+
+        self.assertEqual(asyncio.run(consume()), [['a', 'b', 'c'], ['d']])
+        fast.close()
+        slow.close()
+        # 关闭后仍可取完积压的日志, 之后立即返回空列表
+        while slow.get_batch():
+            pass
+        buffer.extend(['ignored'])
+        self.assertEqual(slow.get_batch(), [])
+
+
+FAKE_PROXY = '''#!{python}
+import socket, sys, threading, yaml
+from urllib.parse import urlsplit
+
+with open(sys.argv[sys.argv.index("-c") + 1]) as f:
+    config = yaml.safe_load(f)
+
+def relay(src, dst):
+    try:
+        while True:
+            data = src.recv(65536)
+            if not data:
+                break
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for s in (src, dst):
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def pipe(client, upstream, head=b""):
+    if head:
+        upstream.sendall(head)
+    threading.Thread(target=relay, args=(upstream, client), daemon=True).start()
+    relay(client, upstream)
+
+def socks(client):
+    client.recv(3)
+    client.sendall(b"\\x05\\x00")
+    head = client.recv(5)
+    host = client.recv(head[4]).decode()
+    port = int.from_bytes(client.recv(2), "big")
+    upstream = socket.create_connection((host, port))
+    client.sendall(b"\\x05\\x00\\x00\\x01" + bytes(6))
+    pipe(client, upstream)
+
+def http(client):
+    data = b""
+    while b"\\r\\n" not in data:
+        data += client.recv(65536)
+    line, _, rest = data.partition(b"\\r\\n")
+    method, url, version = line.decode().split(" ")
+    parts = urlsplit(url)
+    upstream = socket.create_connection((parts.hostname, parts.port or 80))
+    pipe(client, upstream, f"{{method}} {{parts.path or '/'}} {{version}}\\r\\n".encode() + rest)
+
+def serve(kind, handler):
+    host, port = config[kind]["listen"].rsplit(":", 1)
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, int(port)))
+    server.listen()
+    while True:
+        client, _ = server.accept()
+        threading.Thread(target=handler, args=(client,), daemon=True).start()
+
+threading.Thread(target=serve, args=("http", http), daemon=True).start()
+serve("socks", socks)
+'''
+
+
+class TestSpeedTest(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        import sys
+        import tempfile
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bin_path = os.path.join(self.tmp_dir.name, 'hysteria')
+        with open(self.bin_path, 'w') as f:
+            f.write(FAKE_PROXY.format(python=sys.executable))
+        os.chmod(self.bin_path, 0o755)
+
+        class Bulk(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', str(1 << 34))
+                self.end_headers()
+                block = b'\0' * 65536
                 try:
-                    log_message = next(hysteria.get_logs())
-                    logging.info(f"Received log: {log_message}")
-                except StopIteration:
+                    while True:
+                        self.wfile.write(block)
+                except OSError:
                     pass
 
-                # 检查是否需要停止
-                if (time.time() - start_time > 10):
-                    # hysteria.stop()
+            def do_POST(self):
+                # 读完 chunked 请求体
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    self.rfile.read(size + 2)
+                    if size == 0:
+                        break
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Bulk)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/bulk'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.tmp_dir.cleanup()
+
+    def node(self, name):
+        import os
+        import socket
+        import yaml
+        from talkProxy.tools.config import File
+        ports = []
+        for _ in range(2):
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                ports.append(s.getsockname()[1])
+        path = os.path.join(self.tmp_dir.name, f'{name}.yaml')
+        with open(path, 'w') as f:
+            yaml.safe_dump({'server': 'example.com:443', 'http': {'listen': f'127.0.0.1:{ports[0]}'},
+                            'socks': {'listen': f'127.0.0.1:{ports[1]}'}}, f)
+        return File(name, 'hysteria2', path)
+
+    def test_speed_test(self):
+        import os
+        import socket
+        import sys
+        import threading
+        import time
+        from talkProxy.core.speed_test import SpeedTester
+        if not sys.platform.startswith('linux'):
+            self.skipTest('需要 Linux')
+
+        nodes = [self.node(f'n{i}') for i in range(3)]
+        for proxy in ('socks', 'http'):
+            tester = SpeedTester(self.bin_path, self.url, upload_url=self.url, proxy=proxy, duration=0.3)
+            result = tester.test_node(nodes[0])
+            self.assertTrue(result.ok, result.error)
+            self.assertGreater(result.download, 1)
+            self.assertGreater(result.upload, 1)
+            self.assertLess(result.ttfb, 1)
+            self.assertIsNotNone(result.jitter)
+        # 节点配置不写入解析缓存
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, '.cache')))
+
+        tester = SpeedTester(self.bin_path, self.url, duration=0.3, parallel=2,
+                             runtime_dir=os.path.join(self.tmp_dir.name, 'instances'))
+        results = tester.run(nodes)
+        self.assertEqual([result.name for result in results], ['n0', 'n1', 'n2'])
+        self.assertTrue(all(result.ok for result in results))
+        self.assertIsNone(results[0].upload)
+
+        broken = SpeedTester(self.bin_path, 'http://127.0.0.1:1/', duration=0.3, timeout=1).test_node(nodes[1])
+        self.assertFalse(broken.ok)
+
+        # 状态行无效时记录为测速错误
+        garbage = socket.create_server(('127.0.0.1', 0))
+        threading.Thread(target=lambda: garbage.accept()[0].sendall(b'garbage\r\n\r\n'), daemon=True).start()
+        with garbage:
+            result = SpeedTester(self.bin_path, f'http://127.0.0.1:{garbage.getsockname()[1]}/', duration=0.3,
+                                 timeout=1).test_node(nodes[1])
+        self.assertIn('响应状态行无效', result.error)
+
+        # 程序不存在时不必等到 ready_timeout
+        start = time.monotonic()
+        missing = SpeedTester(os.path.join(self.tmp_dir.name, 'missing'), self.url, duration=0.3,
+                              ready_timeout=10).test_node(nodes[2])
+        self.assertEqual(missing.error, '代理未就绪')
+        self.assertLess(time.monotonic() - start, 2)
+
+
+class TestNodeSelector(unittest.TestCase):
+
+    def test_node_selector(self):
+        import os
+        import tempfile
+        import threading
+        import yaml
+        from talkProxy.core.node_selector import NodeSelector
+        from talkProxy.tools.config import File
+        from talkProxy.tools.probe import LatencyProber
+
+        # 端口号对应节点, 延迟为 None 表示探测失败
+        latencies = {}
+
+        async def probe(host, port, timeout):
+            if latencies[port] is None:
+                raise OSError('unreachable')
+            return latencies[port]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            nodes = []
+            for i, port in enumerate((1001, 1002, 1003)):
+                path = os.path.join(tmp, f'n{i}.yaml')
+                with open(path, 'w') as f:
+                    yaml.safe_dump({'server': f'127.0.0.1:{port}'}, f)
+                nodes.append(File(f'n{i}', 'hysteria2', path))
+            latencies.update({1001: 0.10, 1002: 0.05, 1003: 0.20})
+
+            events = []
+            selector = NodeSelector(
+                nodes,
+                start=lambda node: events.append(('start', node.name)) or node.name != 'n2',
+                stop=lambda node: events.append(('stop', node.name)),
+                prober=LatencyProber(probe=probe, ttl=0, error_ttl=0),
+                fail_threshold=2, switch_margin=0.3, switch_after=2, min_hold=0, alpha=1,
+            )
+            self.assertEqual(selector.check(), 'n1')
+
+            # 略好一点不切换
+            latencies[1001] = 0.045
+            for _ in range(5):
+                self.assertEqual(selector.check(), 'n1')
+
+            # 明显更好, 需要连续 switch_after 次才切换
+            latencies[1001] = 0.01
+            self.assertEqual(selector.check(), 'n1')
+            self.assertEqual(selector.check(), 'n0')
+            self.assertEqual(events[-2:], [('stop', 'n1'), ('start', 'n0')])
+
+            # 当前节点连续失败 fail_threshold 次后切换到次优节点, 只探测当前节点也能发现
+            latencies[1001] = None
+            self.assertEqual(selector.check(full=False), 'n0')
+            self.assertEqual(selector.check(full=False), 'n1')
+
+            # 候选节点启动失败时继续尝试下一个
+            latencies[1002] = None
+            latencies[1003] = 0.001
+            selector.check()
+            self.assertEqual(selector.check(), None)
+            self.assertIn(('start', 'n2'), events)
+            latencies[1001] = 0.02
+            self.assertEqual(selector.check(), 'n0')
+            selector.stop()
+            self.assertEqual(events[-1], ('stop', 'n0'))
+            self.assertIsNone(selector.active)
+
+            # 探测时不持锁: 探测中可以读取状态, 探测期间 stop() 后不再启动节点
+            probing, release = threading.Event(), threading.Event()
+
+            async def slow_probe(host, port, timeout):
+                probing.set()
+                release.wait(5)
+                return 0.01
+
+            selector = NodeSelector(nodes, start=lambda node: events.append(('start', node.name)) or True,
+                                    stop=lambda node: None, prober=LatencyProber(probe=slow_probe, ttl=0, error_ttl=0))
+            checker = threading.Thread(target=selector.check)
+            checker.start()
+            self.assertTrue(probing.wait(5))
+            self.assertEqual(len(selector.states()), 3)
+            selector.stop()
+            count = len(events)
+            release.set()
+            checker.join(5)
+            self.assertIsNone(selector.active)
+            self.assertEqual(len(events), count)
+
+
+class TestLoadBalancer(unittest.TestCase):
+
+    def _upstream(self, tag):
+        """假上游: 先回复自身标记, 再原样回显, 客户端半关闭后关闭连接"""
+        import socket
+        import threading
+
+        server = socket.create_server(('127.0.0.1', 0))
+
+        def handle(conn):
+            with conn:
+                conn.sendall(tag)
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    conn.sendall(data)
+
+        def serve():
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except OSError:
+                    return
+                threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+        threading.Thread(target=serve, daemon=True).start()
+        self.addCleanup(server.close)
+        return server.getsockname()[1]
+
+    def _request(self, address, payload=b'ping'):
+        import socket
+
+        with socket.create_connection(address, timeout=5) as sock:
+            sock.sendall(payload)
+            sock.shutdown(socket.SHUT_WR)
+            data = b''
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
                     break
+                data += chunk
+        return data[:1], data[1:]
 
-                time.sleep(1)
-        config1()
+    def test_load_balancer(self):
+        import os
+        import socket
+        from talkProxy.core import balancer
+        from talkProxy.core.balancer import LoadBalancer
+
+        ports = [self._upstream(tag) for tag in (b'a', b'b', b'c')]
+        # 已关闭的端口, 连接会被拒绝
+        dead = socket.create_server(('127.0.0.1', 0))
+        dead_port = dead.getsockname()[1]
+        dead.close()
+
+        for use_splice in sorted({False, balancer.SPLICE}):
+            lb = LoadBalancer(
+                ('127.0.0.1', 0),
+                [('a', '127.0.0.1', ports[0]), ('b', '127.0.0.1', ports[1]), ('c', '127.0.0.1', ports[2])],
+                use_splice=use_splice,
+            )
+            self.assertTrue(lb.start())
+            try:
+                tags = [self._request(lb.address)[0] for _ in range(6)]
+                self.assertEqual(sorted(tags), [b'a', b'a', b'b', b'b', b'c', b'c'])
+
+                # 大块数据完整转发
+                payload = os.urandom(3 * 1024 * 1024 + 7)
+                self.assertEqual(self._request(lb.address, payload)[1], payload)
+
+                # 不可用的上游进入冷却, 连接自动改走其他上游
+                lb.update_upstreams([('dead', '127.0.0.1', dead_port), ('a', '127.0.0.1', ports[0])])
+                for _ in range(3):
+                    self.assertEqual(self._request(lb.address)[0], b'a')
+                stats = {s['name']: s for s in lb.stats()}
+                self.assertEqual(stats['dead']['failures'], 1)
+                self.assertIsNotNone(stats['a']['firstByte'])
+            finally:
+                lb.stop()
+
+    def test_load_balancer_strategy(self):
+        from talkProxy.core.balancer import LoadBalancer
+
+        with self.assertRaises(ValueError):
+            LoadBalancer(('127.0.0.1', 0), strategy='random')
+        upstreams = [('a', '127.0.0.1', 1), ('b', '127.0.0.1', 2)]
+
+        lb = LoadBalancer(('127.0.0.1', 0), upstreams, strategy='least_conn')
+        a, b = lb.upstreams()
+        a.active = 3
+        self.assertIs(lb.pick(), b)
+        b.active = 5
+        self.assertIs(lb.pick(), a)
+
+        lb = LoadBalancer(('127.0.0.1', 0), upstreams, strategy='latency')
+        lb.set_latency('a', 0.001)
+        lb.set_latency('b', 1.0)
+        picks = [lb.pick().name for _ in range(1000)]
+        self.assertGreater(picks.count('a'), 900)
+        # 更新列表时保留同名上游的统计
+        lb.update_upstreams(upstreams + [('c', '127.0.0.1', 3)])
+        self.assertEqual(lb.upstreams()[0].latency, 0.001)
+
+
+class TestConnections(unittest.TestCase):
+
+    def test_connection_table(self):
+        from talkProxy.core.connections import ConnectionTable
+
+        table = ConnectionTable()
+        a = ('n0', 'tcp', '127.0.0.1:1000', '1.1.1.1:443')
+        b = ('n0', 'tcp', '127.0.0.1:1001', '1.1.1.1:443')
+        c = ('n1', 'udp', '127.0.0.1:1002', '')
+        diff = table.apply({a: (1, 'ESTABLISHED'), b: (1, 'SYN_SENT')}, now=1.0)
+        self.assertEqual(sorted(conn.key for conn in diff.opened), [a, b])
+        self.assertEqual((diff.updated, diff.closed), ([], []))
+
+        diff = table.apply({a: (1, 'ESTABLISHED'), b: (1, 'ESTABLISHED'), c: (2, 'NONE')}, now=2.0)
+        self.assertEqual([conn.key for conn in diff.opened], [c])
+        self.assertEqual([(conn.key, conn.status, conn.since) for conn in diff.updated], [(b, 'ESTABLISHED', 1.0)])
+
+        diff = table.apply({a: (1, 'ESTABLISHED'), b: (1, 'ESTABLISHED'), c: (2, 'NONE')}, now=3.0)
+        self.assertFalse(diff)
+        diff = table.apply({c: (2, 'NONE')}, now=4.0)
+        self.assertEqual(sorted(diff.closed), [a, b])
+        self.assertEqual([conn.key for conn in table.rows()], [c])
+
+    def test_connection_collector(self):
+        import os
+        import socket
+        import time
+        from talkProxy.core.balancer import LoadBalancer
+        from talkProxy.core.connections import ConnectionCollector, balancer_source, process_source
+
+        server = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(server.close)
+        port = server.getsockname()[1]
+        lb = LoadBalancer(('127.0.0.1', 0), [('up', '127.0.0.1', port)])
+        self.assertTrue(lb.start())
+        self.addCleanup(lb.stop)
+
+        diffs = []
+        collector = ConnectionCollector([process_source(lambda: {'self': os.getpid()}), balancer_source(lb)])
+        collector.add_listener(diffs.append)
+        collector.collect()
+        self.assertTrue(any(conn.laddr == f'127.0.0.1:{port}' and conn.status == 'LISTEN' for conn in collector.snapshot()))
+
+        client = socket.create_connection(lb.address)
+        accepted, _ = server.accept()
+        client_addr = '%s:%d' % client.getsockname()
+        for _ in range(50):
+            diff = collector.collect()
+            if any(conn.owner == 'up' for conn in diff.opened):
+                break
+            time.sleep(0.02)
+        opened = {(conn.owner, conn.laddr) for diff in diffs for conn in diff.opened}
+        self.assertIn(('up', client_addr), opened)
+        self.assertIn(('self', client_addr), opened)
+
+        client.close()
+        accepted.close()
+        for _ in range(50):
+            diff = collector.collect()
+            if ('up', 'tcp', client_addr, f'127.0.0.1:{port}') in diff.closed:
+                break
+            time.sleep(0.02)
+        else:
+            self.fail('连接关闭后没有产生 closed')
+        self.assertFalse(any(conn.owner == 'up' for conn in collector.snapshot()))
@@ -0,0 +1,163 @@
+"""无界面入口, 只加载配置与代理核心, 不依赖 PySide6
+
+talkProxy --config-dir /etc/talkProxy --subscription hood --node Hongkong-100M
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+from typing import Optional
+
+from talkProxy.core.hysteria2 import Hysteria2
+from talkProxy.core.node_selector import NodeSelector
+from talkProxy.core.proxyManager import wait_ready
+from talkProxy.tools import yaml_backend
+from talkProxy.tools.config import File, GlobalConfig, init_config
+from talkProxy.tools.metrics import DEFAULT_HOST, start_exporter
+from talkProxy.tools.monitor import get_metrics_service
+from talkProxy.tools.settingReader import SettingReader
+
+
+def default_bin_path() -> str:
+    bin_name = "hysteria-windows-amd64-avx.exe" if os.name == "nt" else "hysteria"
+    return SettingReader.getStr("hysteriaBin") or os.path.join(os.path.dirname(__file__), "core", bin_name)
+
+
+def subscription_nodes(globalConfig: GlobalConfig, subscription_name: Optional[str] = None) -> list[File]:
+    if subscription_name:
+        subscription = globalConfig.subscriptionConfig.get_subscription(subscription_name)
+    else:
+        subscription = globalConfig.get_default_subscription()
+    return list(subscription.files) if subscription else []
+
+
+def select_node(
+    globalConfig: GlobalConfig, subscription_name: Optional[str] = None, node_name: Optional[str] = None
+) -> Optional[File]:
+    """未指定节点时使用指定订阅(默认为默认订阅)中的第一个节点"""
+    if node_name:
+        node = globalConfig.subscriptionConfig.get_node(node_name, subscription_name)
+        return node[1] if node else None
+    nodes = subscription_nodes(globalConfig, subscription_name)
+    return nodes[0] if nodes else None
+
+
+def proxy_listen(node: File) -> Optional[tuple[str, int]]:
+    """节点配置中本地 socks/http 监听地址"""
+    try:
+        node_config = yaml_backend.load_file(node.path, use_cache=False) or {}
+    except OSError as e:
+        logging.error(f"读取节点配置失败:{e}")
+        return None
+    for key in ("socks", "http"):
+        listen = (node_config.get(key, None) or {}).get("listen", None)
+        if not listen:
+            continue
+        host, _, port = str(listen).rpartition(":")
+        if port.isdigit():
+            return host or "127.0.0.1", int(port)
+    return None
+
+
+def start_proxy(node: File, bin_path: str, timeout: float) -> tuple[Hysteria2, bool]:
+    hysteria = Hysteria2(cmd=[bin_path, "-c", node.path])
+    hysteria.start()
+    address = proxy_listen(node)
+    if address is None:
+        logging.error(f"{node.name}节点配置中没有本地监听地址")
+        return hysteria, False
+    ready = wait_ready(hysteria, address, timeout)
+    if ready:
+        logging.info(f"代理已就绪, 节点:{node.name}, 监听:{address[0]}:{address[1]}")
+    return hysteria, ready
+
+
+def auto_selector(nodes: list[File], bin_path: str, timeout: float) -> NodeSelector:
+    """按延迟自动启动最优节点, 故障时切换, 同一时间只运行一个 hysteria 进程"""
+    running: dict[str, Hysteria2] = {}
+
+    def start(node: File) -> bool:
+        hysteria, ready = start_proxy(node, bin_path, timeout)
+        if not ready:
+            hysteria.stop()
+            return False
+        running[node.name] = hysteria
+        return True
+
+    def stop(node: File) -> None:
+        hysteria = running.pop(node.name, None)
+        if hysteria is not None:
+            hysteria.stop()
+
+    def is_alive(node: File) -> bool:
+        hysteria = running.get(node.name, None)
+        return hysteria is not None and hysteria.exit_code() is None
+
+    return NodeSelector(nodes, start, stop, is_alive=is_alive)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="talkProxy", description="talkProxy 无界面模式")
+    parser.add_argument("--config-dir", help="配置目录, 默认为安装目录下的 config")
+    parser.add_argument("--subscription", help="订阅名, 默认使用默认订阅")
+    parser.add_argument("--node", help="节点名, 默认使用订阅中的第一个节点")
+    parser.add_argument("--bin", help="hysteria 可执行文件路径")
+    parser.add_argument("--refresh", action="store_true", help="启动前刷新全部订阅")
+    parser.add_argument("--auto", action="store_true", help="按延迟自动选择节点, 当前节点不可用时自动切换")
+    parser.add_argument("--check", action="store_true", help="代理就绪后立即退出, 用于健康检查")
+    parser.add_argument("--ready-timeout", type=float, default=10.0)
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--metrics-port", type=int, help="在该端口提供 /metrics, 默认读取配置中的 metricsPort, 为 0 时不启用")
+    parser.add_argument("--metrics-host", help="/metrics 监听地址, 默认只监听本机")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s - %(levelname)s - %(message)s - %(filename)s:%(lineno)d - %(funcName)s",
+        datefmt="%H:%M:%S",
+    )
+    globalConfig = init_config(args.config_dir)
+    if not globalConfig:
+        return 1
+    metrics_port = args.metrics_port if args.metrics_port is not None else SettingReader.getInt("metricsPort")
+    if metrics_port:
+        host = args.metrics_host or SettingReader.getStr("metricsHost") or DEFAULT_HOST
+        if start_exporter(metrics_port, host) is None:
+            return 1
+        get_metrics_service()
+    if args.refresh:
+        globalConfig.refresh_all()
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+    if args.auto:
+        nodes = subscription_nodes(globalConfig, args.subscription)
+        if not nodes:
+            logging.error("未找到可用节点")
+            return 1
+        selector = auto_selector(nodes, args.bin or default_bin_path(), args.ready_timeout)
+        selector.start()
+        while not stop_event.wait(1):
+            pass
+        selector.stop()
+        return 0
+
+    node = select_node(globalConfig, args.subscription, args.node)
+    if node is None:
+        logging.error("未找到可用节点")
+        return 1
+    hysteria, ready = start_proxy(node, args.bin or default_bin_path(), args.ready_timeout)
+    if args.check or not ready:
+        hysteria.stop()
+        return 0 if ready else 1
+
+    while not stop_event.is_set() and hysteria.is_alive():
+        stop_event.wait(1)
+    hysteria.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
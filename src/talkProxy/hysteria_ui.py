@@ -47,9 +47,9 @@ class Widget(QWidget):
             return False
         for index, proxy in enumerate(self.subscription.files):
             button = QPushButton(self.ui.proxyPage)
-            button.setObjectName(proxy['name'])
+            button.setObjectName(proxy.name)
             size = self.ui.stackedWidget.geometry()
-            button.setText(QCoreApplication.translate("Widget", proxy['name'], None))
+            button.setText(QCoreApplication.translate("Widget", proxy.name, None))
             button.setGeometry(QRect(10, 10+index*85, int(size.width()/3), 100))
         return True
         
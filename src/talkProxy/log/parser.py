@@ -0,0 +1,111 @@
+import datetime
+import json
+import time
+from typing import Any, Iterable, NamedTuple, Optional
+
+# 日志级别按位存放, 索引中以掩码记录一个块内出现过的级别
+LEVELS = {"DEBUG": 1, "INFO": 2, "WARN": 4, "ERROR": 8, "FATAL": 16}
+LEVEL_ALIASES = {"WARNING": "WARN", "DPANIC": "FATAL", "PANIC": "FATAL"}
+ALL_LEVELS = sum(LEVELS.values())
+
+
+class LogEvent(NamedTuple):
+    """一条解析后的 hysteria2 日志
+
+    fields 为日志附带的结构化字段, 如 addr/reqAddr/id/error
+    """
+
+    ts: float
+    level: str
+    msg: str
+    fields: dict[str, Any]
+
+    @property
+    def error(self) -> Optional[str]:
+        return self.fields.get("error", None)
+
+    @property
+    def addr(self) -> Optional[str]:
+        return self.fields.get("addr", None)
+
+    @property
+    def req_addr(self) -> Optional[str]:
+        return self.fields.get("reqAddr", None)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"ts": self.ts, "level": self.level, "msg": self.msg, "fields": self.fields}
+
+
+def normalize_level(level: str) -> str:
+    level = level.upper()
+    level = LEVEL_ALIASES.get(level, level)
+    return level if level in LEVELS else "INFO"
+
+
+def level_mask(levels: Optional[Iterable[str]]) -> int:
+    if levels is None:
+        return ALL_LEVELS
+    mask = 0
+    for level in levels:
+        mask |= LEVELS[normalize_level(level)]
+    return mask
+
+
+def parse_time(value: Any, default: float) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str) or not value:
+        return default
+    # Python 3.10 的 fromisoformat 不支持 Z 结尾
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return default
+
+
+def _parse_json(line: str, now: float) -> Optional[LogEvent]:
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    ts = parse_time(data.pop("ts", None) or data.pop("time", None), now)
+    level = normalize_level(str(data.pop("level", "INFO")))
+    msg = str(data.pop("msg", ""))
+    return LogEvent(ts, level, msg, data)
+
+
+def _parse_console(line: str, now: float) -> Optional[LogEvent]:
+    # zap console 格式: 时间\t级别\t消息\t{json 字段}
+    parts = line.split("\t", 3)
+    if len(parts) < 3 or (parts[1].upper() not in LEVELS and parts[1].upper() not in LEVEL_ALIASES):
+        return None
+    fields = {}
+    if len(parts) == 4:
+        try:
+            fields = json.loads(parts[3])
+        except ValueError:
+            fields = {"extra": parts[3]}
+        if not isinstance(fields, dict):
+            fields = {"extra": parts[3]}
+    return LogEvent(parse_time(parts[0], now), normalize_level(parts[1]), parts[2], fields)
+
+
+def parse_line(line: str, now: Optional[float] = None) -> LogEvent:
+    """解析一行 hysteria2 输出, 支持 console 与 json 两种日志格式, 无法识别时作为 INFO 消息保留"""
+    now = time.time() if now is None else now
+    line = line.strip()
+    event = None
+    if line.startswith("{"):
+        event = _parse_json(line, now)
+    elif "\t" in line:
+        event = _parse_console(line, now)
+    return event or LogEvent(now, "INFO", line, {})
+
+
+def parse_lines(lines: Iterable[str]) -> list[LogEvent]:
+    now = time.time()
+    return [parse_line(line, now) for line in lines]
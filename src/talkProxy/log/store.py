@@ -0,0 +1,311 @@
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from talkProxy.core.log_subscription import LogSubscription
+from talkProxy.log.parser import LEVELS, LogEvent, level_mask, parse_lines
+
+# 单个分段文件的大小上限, 超出后新建分段
+MAX_SEGMENT_BYTES = 8 * 1024 * 1024
+# 每个节点最多保留的分段数, 超出后删除最旧的分段
+MAX_SEGMENTS = 16
+# 内存中攒够这么多事件或字节后压缩为一个块写入磁盘
+BLOCK_EVENTS = 1024
+BLOCK_BYTES = 64 * 1024
+# 未攒满的块最多在内存中停留的时间(秒), 由后台线程每 1/4 间隔检查一次
+FLUSH_INTERVAL = 5.0
+
+# 块索引记录: 块在分段中的偏移, 压缩后长度, 最早/最晚时间, 事件数, 级别掩码
+_INDEX_RECORD = struct.Struct("<QIddII")
+_SEGMENT_NAME = re.compile(r"^(\d{8})\.log\.z$")
+
+
+class BlockIndex(tuple):
+    __slots__ = ()
+
+    offset = property(lambda self: self[0])
+    length = property(lambda self: self[1])
+    min_ts = property(lambda self: self[2])
+    max_ts = property(lambda self: self[3])
+    count = property(lambda self: self[4])
+    mask = property(lambda self: self[5])
+
+    def matches(self, since: Optional[float], until: Optional[float], mask: int) -> bool:
+        if since is not None and self.max_ts < since:
+            return False
+        if until is not None and self.min_ts > until:
+            return False
+        return bool(self.mask & mask)
+
+
+def _encode(event: LogEvent) -> bytes:
+    return json.dumps([event.ts, event.level, event.msg, event.fields], ensure_ascii=False).encode() + b"\n"
+
+
+def _decode(block: bytes) -> Iterator[LogEvent]:
+    for line in block.splitlines():
+        ts, level, msg, fields = json.loads(line)
+        yield LogEvent(ts, level, msg, fields)
+
+
+def _mmap_file(path: str) -> Optional[mmap.mmap]:
+    """只读映射文件, 空文件或无法映射时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+class Segment:
+    """一个分段: 数据文件由独立压缩的块组成, 另有定长记录的块索引文件"""
+
+    def __init__(self, dir_path: str, seq: int) -> None:
+        self.seq = seq
+        self.path = os.path.join(dir_path, f"{seq:08d}.log.z")
+        self.index_path = os.path.join(dir_path, f"{seq:08d}.idx")
+        self.blocks: list[BlockIndex] = []
+        self.size = 0
+        self._load_index()
+
+    def _load_index(self) -> None:
+        index = _mmap_file(self.index_path)
+        data_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if index is not None:
+            with index:
+                usable = len(index) - len(index) % _INDEX_RECORD.size
+                for record in _INDEX_RECORD.iter_unpack(index[:usable]):
+                    block = BlockIndex(record)
+                    # 写入中断时数据可能不完整, 丢弃越界的索引
+                    if block.offset + block.length > data_size:
+                        break
+                    self.blocks.append(block)
+        self.size = self.blocks[-1].offset + self.blocks[-1].length if self.blocks else 0
+        # 截掉没有索引的残余数据和残缺的索引记录
+        if data_size > self.size:
+            with open(self.path, "r+b") as f:
+                f.truncate(self.size)
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) != len(self.blocks) * _INDEX_RECORD.size:
+            with open(self.index_path, "r+b") as f:
+                f.truncate(len(self.blocks) * _INDEX_RECORD.size)
+
+    def append_block(self, events: list[LogEvent], raw: bytes) -> None:
+        data = zlib.compress(raw, 6)
+        mask = 0
+        for event in events:
+            mask |= LEVELS.get(event.level, 0)
+        block = BlockIndex((self.size, len(data), min(e.ts for e in events), max(e.ts for e in events), len(events), mask))
+        # 先写数据再写索引, 中断时最多丢失最后一个块
+        with open(self.path, "ab") as f:
+            f.write(data)
+        with open(self.index_path, "ab") as f:
+            f.write(_INDEX_RECORD.pack(*block))
+        self.blocks.append(block)
+        self.size += len(data)
+
+    def read(self, since: Optional[float], until: Optional[float], mask: int) -> Iterator[LogEvent]:
+        blocks = [block for block in self.blocks if block.matches(since, until, mask)]
+        if not blocks:
+            return
+        data = _mmap_file(self.path)
+        if data is None:
+            return
+        with data:
+            for block in blocks:
+                raw = zlib.decompress(data[block.offset : block.offset + block.length])
+                yield from _decode(raw)
+
+    def remove(self) -> None:
+        for path in (self.path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class NodeLog:
+    """单个节点的日志: 若干分段加上内存中尚未写入的块"""
+
+    def __init__(self, dir_path: str, max_segment_bytes: int, max_segments: int) -> None:
+        self.dir_path = dir_path
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        os.makedirs(dir_path, exist_ok=True)
+        seqs = sorted(int(m.group(1)) for m in map(_SEGMENT_NAME.match, os.listdir(dir_path)) if m)
+        self.segments = [Segment(dir_path, seq) for seq in seqs]
+        if not self.segments:
+            self.segments.append(Segment(dir_path, 1))
+        self._trim()
+        self.pending: list[LogEvent] = []
+        self.pending_raw: list[bytes] = []
+        self.pending_bytes = 0
+        self.pending_since = 0.0
+
+    def append(self, events: Iterable[LogEvent], block_events: int, block_bytes: int) -> None:
+        for event in events:
+            raw = _encode(event)
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending.append(event)
+            self.pending_raw.append(raw)
+            self.pending_bytes += len(raw)
+            if len(self.pending) >= block_events or self.pending_bytes >= block_bytes:
+                self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        segment = self.segments[-1]
+        if segment.size >= self.max_segment_bytes:
+            segment = Segment(self.dir_path, segment.seq + 1)
+            self.segments.append(segment)
+            self._trim()
+        segment.append_block(self.pending, b"".join(self.pending_raw))
+        self.pending, self.pending_raw, self.pending_bytes = [], [], 0
+
+    def _trim(self) -> None:
+        while len(self.segments) > self.max_segments:
+            self.segments.pop(0).remove()
+
+    def search(self, since: Optional[float], until: Optional[float], mask: int) -> Iterator[LogEvent]:
+        for segment in list(self.segments):
+            yield from segment.read(since, until, mask)
+        yield from list(self.pending)
+
+
+class LogStore:
+    """按节点保存结构化日志, 分段按大小轮转, 每个块独立压缩并记录时间范围与级别索引
+
+    查询时先用索引跳过不相关的块, 只解压可能命中的块
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        max_segment_bytes: int = MAX_SEGMENT_BYTES,
+        max_segments: int = MAX_SEGMENTS,
+        block_events: int = BLOCK_EVENTS,
+        block_bytes: int = BLOCK_BYTES,
+        flush_interval: float = FLUSH_INTERVAL,
+    ) -> None:
+        self.root_dir = root_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        self.block_events = block_events
+        self.block_bytes = block_bytes
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._nodes: dict[str, NodeLog] = {}
+        # 定期写入安静节点的未满块, 首次写入时启动, close() 时停止
+        self._flusher: Optional[tuple[threading.Thread, threading.Event]] = None
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _node(self, node: str) -> NodeLog:
+        node_log = self._nodes.get(node, None)
+        if node_log is None:
+            if not node or os.sep in node or node in (".", ".."):
+                raise ValueError(f"节点名不合法:{node}")
+            node_log = NodeLog(os.path.join(self.root_dir, node), self.max_segment_bytes, self.max_segments)
+            self._nodes[node] = node_log
+        return node_log
+
+    def nodes(self) -> list[str]:
+        with self._lock:
+            names = set(self._nodes)
+        names.update(name for name in os.listdir(self.root_dir) if os.path.isdir(os.path.join(self.root_dir, name)))
+        return sorted(names)
+
+    def extend(self, node: str, events: Iterable[LogEvent]) -> None:
+        with self._lock:
+            node_log = self._node(node)
+            node_log.append(events, self.block_events, self.block_bytes)
+            if node_log.pending and time.monotonic() - node_log.pending_since >= self.flush_interval:
+                node_log.flush()
+            if node_log.pending and self._flusher is None:
+                stop_event = threading.Event()
+                thread = threading.Thread(target=self._flush_loop, args=(stop_event,), name="log-store-flush", daemon=True)
+                self._flusher = (thread, stop_event)
+                thread.start()
+
+    def _flush_loop(self, stop_event: threading.Event) -> None:
+        while not stop_event.wait(self.flush_interval / 4):
+            try:
+                self.flush_expired()
+            except Exception as e:
+                logging.error(f"写入日志块失败:{e}")
+
+    def flush_expired(self) -> None:
+        """写入在内存中停留超过 flush_interval 的未满块"""
+        now = time.monotonic()
+        with self._lock:
+            for node_log in self._nodes.values():
+                if node_log.pending and now - node_log.pending_since >= self.flush_interval:
+                    node_log.flush()
+
+    def append_lines(self, node: str, lines: Iterable[str]) -> None:
+        self.extend(node, parse_lines(lines))
+
+    def flush(self, node: Optional[str] = None) -> None:
+        with self._lock:
+            for name, node_log in self._nodes.items():
+                if node is None or name == node:
+                    node_log.flush()
+
+    def search(
+        self,
+        node: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        levels: Optional[Iterable[str]] = None,
+        contains: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> list[LogEvent]:
+        """按节点、时间范围、级别与关键字查询, 结果按分段顺序(即写入顺序)返回"""
+        mask = level_mask(levels)
+        names = [node] if node is not None else self.nodes()
+        with self._lock:
+            node_logs = [self._node(name) for name in names]
+        result = []
+        for node_log in node_logs:
+            for event in node_log.search(since, until, mask):
+                if (since is not None and event.ts < since) or (until is not None and event.ts > until):
+                    continue
+                if not LEVELS.get(event.level, 0) & mask:
+                    continue
+                if contains and contains not in event.msg and contains not in json.dumps(event.fields, ensure_ascii=False):
+                    continue
+                result.append(event)
+                if limit is not None and len(result) >= limit:
+                    return result
+        return result
+
+    def close(self) -> None:
+        """停止后台写入线程并写入全部未满的块; 之后仍可继续写入"""
+        with self._lock:
+            flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            flusher[1].set()
+            flusher[0].join()
+        self.flush()
+
+    def attach(self, node: str, subscription: LogSubscription) -> threading.Thread:
+        """把一个日志订阅接入存储, 每批日志解析后写入"""
+        return subscription.on_batch(lambda lines: self.append_lines(node, lines))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LogStore(tmp)
+        store.append_lines("demo", ["2024-05-01T12:00:00Z\tERROR\tTCP error\t{\"error\": \"timeout\"}"])
+        store.flush()
+        logging.info(store.search("demo", levels=["ERROR"]))
@@ -0,0 +1,88 @@
+import unittest
+
+
+class Test(unittest.TestCase):
+
+    def test_parse_line(self):
+        from talkProxy.log.parser import parse_line
+
+        event = parse_line('2024-05-01T12:00:00Z\tERROR\tTCP error\t{"addr": "127.0.0.1:50000", "reqAddr": "example.com:443", "error": "timeout"}')
+        self.assertEqual(event.level, 'ERROR')
+        self.assertEqual(event.msg, 'TCP error')
+        self.assertEqual(event.ts, 1714564800.0)
+        self.assertEqual((event.addr, event.req_addr, event.error), ('127.0.0.1:50000', 'example.com:443', 'timeout'))
+
+        event = parse_line('{"level": "warn", "ts": 1714564800.5, "msg": "udp request", "id": 3}')
+        self.assertEqual((event.level, event.ts, event.msg, event.fields), ('WARN', 1714564800.5, 'udp request', {'id': 3}))
+
+        event = parse_line('plain text output', now=1.0)
+        self.assertEqual((event.level, event.ts, event.msg), ('INFO', 1.0, 'plain text output'))
+
+    def test_log_store(self):
+        import os
+        import tempfile
+        import zlib
+        from unittest import mock
+        from talkProxy.log.parser import LogEvent
+        from talkProxy.log.store import LogStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LogStore(tmp, max_segment_bytes=2048, max_segments=100, block_events=100)
+            day = 1714521600.0
+            for hour in range(24):
+                events = [LogEvent(day + hour * 3600 + i, 'INFO', 'TCP request', {'addr': f'127.0.0.1:{i}'}) for i in range(300)]
+                if hour == 13:
+                    events.append(LogEvent(day + hour * 3600 + 500, 'ERROR', 'TCP error', {'error': 'connection refused'}))
+                store.extend('hk', events)
+            store.extend('jp', [LogEvent(day, 'ERROR', 'other node', {})])
+            store.flush()
+
+            segments = [name for name in os.listdir(os.path.join(tmp, 'hk')) if name.endswith('.log.z')]
+            self.assertGreater(len(segments), 1)
+
+            # 只解压索引中包含 ERROR 的块
+            with mock.patch('talkProxy.log.store.zlib.decompress', wraps=zlib.decompress) as decompress:
+                errors = store.search('hk', levels=['ERROR'])
+            self.assertEqual([event.error for event in errors], ['connection refused'])
+            self.assertEqual(decompress.call_count, 1)
+
+            hour = store.search('hk', since=day + 3 * 3600, until=day + 3 * 3600 + 99)
+            self.assertEqual(len(hour), 100)
+            self.assertEqual(len(store.search(levels=['ERROR'])), 2)
+            self.assertEqual(len(store.search('hk', contains='127.0.0.1:299')), 24)
+
+            # 未写入的事件也能查到, 重新打开后索引与数据一致
+            store.extend('hk', [LogEvent(day + 90000, 'WARN', 'pending', {})])
+            self.assertEqual(store.search('hk', levels=['WARN'])[0].msg, 'pending')
+            store.close()
+            reopened = LogStore(tmp, max_segments=100)
+            self.assertEqual(len(reopened.search('hk')), 24 * 300 + 2)
+
+            # 丢弃最旧的分段
+            small = LogStore(tmp, max_segment_bytes=2048, max_segments=2, block_events=100)
+            small.extend('hk', [LogEvent(day + 100000 + i, 'INFO', 'new', {}) for i in range(300)])
+            small.flush()
+            self.assertEqual(len([name for name in os.listdir(os.path.join(tmp, 'hk')) if name.endswith('.log.z')]), 2)
+
+    def test_log_store_flush_interval(self):
+        import os
+        import tempfile
+        import time
+        from talkProxy.log.parser import LogEvent
+        from talkProxy.log.store import LogStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LogStore(tmp, flush_interval=0.2)
+            store.extend('quiet', [LogEvent(1000.0, 'INFO', 'last words', {})])
+            # 之后不再有新日志, 未满的块也会由后台线程写入磁盘
+            # 等待写入完成后再打开新的 LogStore, 打开时的崩溃恢复会截掉正在写入的块
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and store._nodes['quiet'].pending:
+                time.sleep(0.05)
+            self.assertEqual([event.msg for event in LogStore(tmp).search('quiet')], ['last words'])
+
+            store.extend('quiet', [LogEvent(1001.0, 'INFO', 'on close', {})])
+            store.close()
+            self.assertIsNone(store._flusher)
+            self.assertEqual(len(LogStore(tmp).search('quiet')), 2)
+            self.assertTrue(os.path.isdir(os.path.join(tmp, 'quiet')))
@@ -0,0 +1,379 @@
+import heapq
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Optional
+
+from talkProxy.rule.engine import (
+    ACTIONS,
+    NO_MATCH,
+    RULE_TYPES,
+    KeywordMatcher,
+    Rule,
+    _pack_ip,
+    normalize_host,
+    parse_port_range,
+    parse_rules,
+)
+from talkProxy.tools import config
+from talkProxy.tools.common import atomic_write
+
+MAGIC = b"TPRS"
+FORMAT_VERSION = 1
+COMPILED_SUFFIX = ".ruleset"
+# 文件中表示未命中的规则序号
+NONE = 0xFFFFFFFF
+
+# 各段依次存放, 头部记录每段的偏移与长度
+SECTIONS = (
+    "pool",  # 规则值字符串池
+    "rules",  # 每条规则: 类型, 动作, 值在字符串池中的偏移与长度
+    # DOMAIN: 按 crc32 排序的哈希数组, 对应的 (偏移, 长度, 规则序号), 以及按哈希高位分桶的起始位置表
+    "exact_hash", "exact_entries", "exact_buckets",
+    "suffix_hash", "suffix_entries", "suffix_buckets",  # DOMAIN-SUFFIX, 结构同上
+    "kw_codes", "kw_table", "kw_out",  # DOMAIN-KEYWORD 的确定自动机
+    "v4_starts", "v4_values",  # IPv4 不相交区间的起点与规则序号
+    "v6_starts", "v6_values",  # IPv6 区间起点为 16 字节大端序
+    "port_starts", "port_values",
+)
+# magic, 格式版本, 规则数, MATCH 规则序号, 源文件大小, 源文件 mtime_ns, 关键字字母表宽度
+_HEADER = struct.Struct("<4sIIIQQI4x")
+_SECTION = struct.Struct("<QQ")
+_RULE = struct.Struct("<BBxxII")
+_ALIGN = 8
+
+
+def _align(size: int) -> int:
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _u32(values: Iterable[int]) -> bytes:
+    """各数组按本机字节序存放, 加载时直接 cast 为 memoryview"""
+    return array("I", values).tobytes()
+
+
+def _intervals(ranges: list[tuple[int, int, int]], lowest: int) -> tuple[list[int], list[int]]:
+    """把可能重叠的 [start, end] 区间展平为不相交区间, 每段取覆盖它的最小规则序号, 未覆盖的段为 NONE"""
+    points = sorted({start for start, _, _ in ranges} | {end + 1 for _, end, _ in ranges} | {lowest})
+    ranges = sorted(ranges)
+    active: list[tuple[int, int]] = []
+    starts, values = [], []
+    i = 0
+    for point in points:
+        while i < len(ranges) and ranges[i][0] <= point:
+            heapq.heappush(active, (ranges[i][2], ranges[i][1]))
+            i += 1
+        while active and active[0][1] < point:
+            heapq.heappop(active)
+        value = active[0][0] if active else NONE
+        if values and values[-1] == value:
+            continue
+        starts.append(point)
+        values.append(value)
+    return starts, values
+
+
+# 分桶表最多 2^MAX_BUCKET_BITS 个桶
+MAX_BUCKET_BITS = 20
+
+
+def _bucket_bits(count: int) -> int:
+    """桶数取不超过条目数的 2 的幂, 平均每桶 1~2 条"""
+    return min(max(count.bit_length() - 1, 0), MAX_BUCKET_BITS)
+
+
+class _HashTable:
+    """字符串 -> 最小规则序号, 按 (crc32, 字符串) 排序存放
+
+    查询时用哈希高位在分桶表中找到范围, 范围内比较哈希与原文, 不需要二分
+    """
+
+    @staticmethod
+    def build(items: dict[str, int], pool: bytearray) -> tuple[bytes, bytes, bytes]:
+        entries = []
+        for key, index in items.items():
+            encoded = key.encode()
+            entries.append((zlib.crc32(encoded), encoded, index))
+        entries.sort()
+        shift = 32 - _bucket_bits(len(entries))
+        hashes, table = [], []
+        buckets = [0] * ((1 << (32 - shift)) + 1)
+        for crc, encoded, index in entries:
+            hashes.append(crc)
+            table.extend((len(pool), len(encoded), index))
+            pool.extend(encoded)
+            buckets[(crc >> shift) + 1] += 1
+        for i in range(1, len(buckets)):
+            buckets[i] += buckets[i - 1]
+        return _u32(hashes), _u32(table), _u32(buckets)
+
+
+class CompiledRuleSet:
+    """内存映射的二进制规则集, 查询直接读取映射的数组, 只在命中时构造对应的 Rule
+
+    匹配结果与 RuleEngine 相同
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.path = file_path
+        with open(file_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except (ValueError, struct.error, TypeError):
+            self.close()
+            raise ValueError(f"规则集文件已损坏:{file_path}")
+
+    def _parse(self) -> None:
+        magic, version, count, final, source_size, source_mtime, width = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("格式不匹配")
+        self.count = count
+        self.final = final
+        self.source_stat = (source_size, source_mtime)
+        self._kw_width = width
+        self._views: list[memoryview] = []
+        whole = memoryview(self._mmap)
+        self._views.append(whole)
+        offset = _HEADER.size
+        sections = {}
+        for name in SECTIONS:
+            start, length = _SECTION.unpack_from(self._mmap, offset)
+            offset += _SECTION.size
+            if start + length > len(self._mmap):
+                raise ValueError("段越界")
+            sections[name] = whole[start : start + length]
+            self._views.append(sections[name])
+            if name == "pool":
+                # 比较字符串时直接切 mmap 得到 bytes, 比切 memoryview 快
+                self._pool_offset = start
+
+        def u32(name: str) -> memoryview:
+            view = sections[name].cast("I")
+            self._views.append(view)
+            return view
+
+        self._pool = sections["pool"]
+        self._rules = sections["rules"]
+        self._exact = self._hash_table(u32("exact_hash"), u32("exact_entries"), u32("exact_buckets"))
+        self._suffix = self._hash_table(u32("suffix_hash"), u32("suffix_entries"), u32("suffix_buckets"))
+        self._kw_codes = sections["kw_codes"].tobytes()
+        self._kw_table = u32("kw_table")
+        self._kw_out = u32("kw_out")
+        self._v4 = (u32("v4_starts"), u32("v4_values"))
+        self._v6_starts = sections["v6_starts"]
+        self._v6_values = u32("v6_values")
+        self._ports = (u32("port_starts"), u32("port_values"))
+
+    @staticmethod
+    def _hash_table(hashes: memoryview, entries: memoryview, buckets: memoryview) -> tuple:
+        bits = _bucket_bits(len(hashes))
+        if len(buckets) != (1 << bits) + 1 or len(entries) != len(hashes) * 3:
+            raise ValueError("哈希表长度不匹配")
+        return hashes, entries, buckets, 32 - bits
+
+    def close(self) -> None:
+        for view in reversed(getattr(self, "_views", [])):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self) -> "CompiledRuleSet":
+        return self
+
+    def __exit__(self, *args: any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def rule(self, index: int) -> Rule:
+        rule_type, action, offset, length = _RULE.unpack_from(self._rules, index * _RULE.size)
+        value = self._pool[offset : offset + length].tobytes().decode()
+        return Rule(RULE_TYPES[rule_type], value, ACTIONS[action])
+
+    def _lookup(self, table: tuple, key: bytes) -> int:
+        hashes, entries, buckets, shift = table
+        crc = zlib.crc32(key)
+        bucket = crc >> shift
+        i, end = buckets[bucket], buckets[bucket + 1]
+        while i < end:
+            if hashes[i] == crc:
+                offset = self._pool_offset + entries[i * 3]
+                if entries[i * 3 + 1] == len(key) and self._mmap[offset : offset + len(key)] == key:
+                    return entries[i * 3 + 2]
+            i += 1
+        return NONE
+
+    def _suffix_match(self, host: bytes) -> int:
+        """依次查询 www.google.com, google.com, com"""
+        best = NONE
+        start = 0
+        while True:
+            index = self._lookup(self._suffix, host[start:])
+            if index < best:
+                best = index
+            start = host.find(b".", start) + 1
+            if start == 0:
+                return best
+
+    def _keyword_match(self, host: bytes) -> int:
+        table, width, out = self._kw_table, self._kw_width, self._kw_out
+        best = NONE
+        state = 0
+        for code in host.translate(self._kw_codes):
+            state = table[state * width + code]
+            if out[state] < best:
+                best = out[state]
+        return best
+
+    def _range_match(self, starts, values, key) -> int:
+        i = bisect_right(starts, key) - 1
+        return values[i] if i >= 0 else NONE
+
+    def _v6_match(self, packed: bytes) -> int:
+        starts = self._v6_starts
+        low, high = 0, len(starts) // 16
+        while low < high:
+            mid = (low + high) // 2
+            if bytes(starts[mid * 16 : mid * 16 + 16]) <= packed:
+                low = mid + 1
+            else:
+                high = mid
+        return self._v6_values[low - 1] if low else NONE
+
+    def match_index(self, host: Optional[str], ip: Optional[str] = None, port: Optional[int] = None) -> int:
+        best = self.final
+        if host:
+            host = normalize_host(host)
+            packed = _pack_ip(host) if ip is None else None
+            if packed is not None:
+                ip, host = host, None
+        if host:
+            encoded = host.encode()
+            if len(self._exact[0]):
+                best = min(best, self._lookup(self._exact, encoded))
+            if len(self._suffix[0]):
+                best = min(best, self._suffix_match(encoded))
+            if len(self._kw_out) > 1:
+                best = min(best, self._keyword_match(encoded))
+        if ip is not None:
+            packed = _pack_ip(ip)
+            if packed is not None and len(packed) == 4 and len(self._v4[0]):
+                best = min(best, self._range_match(*self._v4, int.from_bytes(packed, "big")))
+            elif packed is not None and len(packed) == 16 and len(self._v6_values):
+                best = min(best, self._v6_match(packed))
+        if port is not None and len(self._ports[0]):
+            best = min(best, self._range_match(*self._ports, port))
+        return NO_MATCH if best == NONE else best
+
+    def match(self, host: Optional[str], ip: Optional[str] = None, port: Optional[int] = None) -> Optional[Rule]:
+        index = self.match_index(host, ip, port)
+        return self.rule(index) if index != NO_MATCH else None
+
+    def route(
+        self, host: Optional[str], ip: Optional[str] = None, port: Optional[int] = None, default: str = "DIRECT"
+    ) -> str:
+        rule = self.match(host, ip, port)
+        return rule.action if rule is not None else default
+
+
+def compile_rules(rules: list[Rule], out_path: str, source_stat: tuple[int, int] = (0, 0)) -> None:
+    """写入二进制规则集, 先写临时文件再替换, 正在使用旧文件的映射不受影响"""
+    pool = bytearray()
+    records = []
+    exact: dict[str, int] = {}
+    suffix: dict[str, int] = {}
+    keywords = KeywordMatcher()
+    v4, v6, ports = [], [], []
+    final = NONE
+    for index, rule in enumerate(rules):
+        value = rule.value.encode()
+        records.append(_RULE.pack(RULE_TYPES.index(rule.type), ACTIONS.index(rule.action), len(pool), len(value)))
+        pool.extend(value)
+        if rule.type == "DOMAIN":
+            exact.setdefault(rule.value, index)
+        elif rule.type == "DOMAIN-SUFFIX":
+            suffix.setdefault(rule.value, index)
+        elif rule.type == "DOMAIN-KEYWORD":
+            keywords.insert(rule.value, index)
+        elif rule.type in ("IP-CIDR", "IP-CIDR6"):
+            net = ipaddress.ip_network(rule.value, strict=False)
+            (v6 if net.version == 6 else v4).append((int(net.network_address), int(net.broadcast_address), index))
+        elif rule.type == "DST-PORT":
+            ports.append((*parse_port_range(rule.value), index))
+        elif rule.type == "MATCH":
+            final = min(final, index)
+    keywords.build()
+
+    sections = {"rules": b"".join(records)}
+    sections["exact_hash"], sections["exact_entries"], sections["exact_buckets"] = _HashTable.build(exact, pool)
+    sections["suffix_hash"], sections["suffix_entries"], sections["suffix_buckets"] = _HashTable.build(suffix, pool)
+    sections["pool"] = bytes(pool)
+    sections["kw_codes"] = keywords._codes
+    sections["kw_table"] = _u32(keywords._table)
+    sections["kw_out"] = _u32([NONE if index == NO_MATCH else index for index in keywords.out])
+    starts, values = _intervals(v4, 0) if v4 else ([], [])
+    sections["v4_starts"], sections["v4_values"] = _u32(starts), _u32(values)
+    starts, values = _intervals(v6, 0) if v6 else ([], [])
+    sections["v6_starts"] = b"".join(start.to_bytes(16, "big") for start in starts)
+    sections["v6_values"] = _u32(values)
+    starts, values = _intervals(ports, 0) if ports else ([], [])
+    sections["port_starts"], sections["port_values"] = _u32(starts), _u32(values)
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(rules), final, *source_stat, keywords._width)
+    offset = _align(len(header) + _SECTION.size * len(SECTIONS))
+    table, body = [], []
+    for name in SECTIONS:
+        data = sections[name]
+        table.append(_SECTION.pack(offset, len(data)))
+        body.append(data + b"\0" * (_align(len(data)) - len(data)))
+        offset += _align(len(data))
+    head = header + b"".join(table)
+    head += b"\0" * (_align(len(head)) - len(head))
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    atomic_write(out_path, [head, *body], suffix=COMPILED_SUFFIX)
+
+
+def compiled_path(source_path: str) -> str:
+    """编译结果放在配置目录中, 与 subscription.yaml 同级"""
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(config.config_dir_path, name + COMPILED_SUFFIX)
+
+
+def _source_stat(source_path: str) -> tuple[int, int]:
+    stat = os.stat(source_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_ruleset(source_path: str, out_path: Optional[str] = None) -> Optional[CompiledRuleSet]:
+    """加载规则文件的编译结果, 源文件的大小或修改时间变化时才重新编译"""
+    out_path = out_path or compiled_path(source_path)
+    try:
+        stat = _source_stat(source_path)
+    except OSError as e:
+        logging.error(f"读取规则文件失败:{e}")
+        return None
+    if os.path.exists(out_path):
+        try:
+            ruleset = CompiledRuleSet(out_path)
+            if ruleset.source_stat == stat:
+                return ruleset
+            ruleset.close()
+        except (OSError, ValueError) as e:
+            logging.warning(f"规则集需要重新编译:{e}")
+    try:
+        with open(source_path, "r", encoding="utf-8") as f:
+            rules = parse_rules(f)
+        compile_rules(rules, out_path, stat)
+        logging.info(f"规则已编译:{source_path} -> {out_path}, 共{len(rules)}条")
+        return CompiledRuleSet(out_path)
+    except (OSError, ValueError) as e:
+        logging.error(f"编译规则失败:{e}")
+        return None
@@ -0,0 +1,384 @@
+import ipaddress
+import logging
+import socket
+import sys
+from array import array
+from collections import deque
+from typing import Iterable, NamedTuple, Optional
+
+ACTIONS = ("DIRECT", "PROXY", "REJECT")
+RULE_TYPES = ("DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD", "IP-CIDR", "IP-CIDR6", "DST-PORT", "MATCH")
+# 兼容 clash 规则写法
+RULE_ALIASES = {"FINAL": "MATCH", "PORT": "DST-PORT"}
+# 各匹配结构返回命中规则的最小序号, 未命中时为该值
+NO_MATCH = sys.maxsize
+
+
+class Rule(NamedTuple):
+    """一条路由规则, 如 DOMAIN-SUFFIX,google.com,PROXY; 多条规则命中时序号最小的生效"""
+
+    type: str
+    value: str
+    action: str
+
+    def matches(self, host: Optional[str], ip: Optional[str] = None, port: Optional[int] = None) -> bool:
+        """逐条判断的参考实现, RuleEngine 的编译结果应与之一致"""
+        host = normalize_host(host) if host else None
+        if host is not None and ip is None and is_ip(host):
+            ip, host = host, None
+        if self.type == "MATCH":
+            return True
+        if self.type == "DST-PORT":
+            if port is None:
+                return False
+            low, high = parse_port_range(self.value)
+            return low <= port <= high
+        if self.type in ("IP-CIDR", "IP-CIDR6"):
+            return ip is not None and ipaddress.ip_address(ip) in ipaddress.ip_network(self.value, strict=False)
+        if host is None:
+            return False
+        if self.type == "DOMAIN":
+            return host == self.value
+        if self.type == "DOMAIN-SUFFIX":
+            return host == self.value or host.endswith("." + self.value)
+        return self.value in host
+
+    def __str__(self) -> str:
+        if self.type == "MATCH":
+            return f"MATCH,{self.action}"
+        return f"{self.type},{self.value},{self.action}"
+
+
+def normalize_host(host: str) -> str:
+    return host.lower().rstrip(".")
+
+
+def is_ip(host: str) -> bool:
+    return _pack_ip(host) is not None
+
+
+def _pack_ip(value: str) -> Optional[bytes]:
+    # 域名的顶级域不会是纯数字, 先排除以避免异常开销
+    if not value or not (value[-1].isdigit() or ":" in value):
+        return None
+    try:
+        return socket.inet_pton(socket.AF_INET, value)
+    except OSError:
+        pass
+    if ":" not in value:
+        return None
+    try:
+        return socket.inet_pton(socket.AF_INET6, value.strip("[]"))
+    except OSError:
+        return None
+
+
+def parse_port_range(value: str) -> tuple[int, int]:
+    low, _, high = value.partition("-")
+    low, high = int(low), int(high or low)
+    if not 0 <= low <= high <= 65535:
+        raise ValueError(f"端口范围不合法:{value}")
+    return low, high
+
+
+def parse_rule(line: str) -> Optional[Rule]:
+    """解析一行规则, 空行与 # 注释返回 None, 格式错误抛出 ValueError"""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    parts = [part.strip() for part in line.split(",")]
+    rule_type = parts[0].upper()
+    rule_type = RULE_ALIASES.get(rule_type, rule_type)
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"不支持的规则类型:{parts[0]}")
+    if rule_type == "MATCH":
+        if len(parts) < 2:
+            raise ValueError(f"规则缺少动作:{line}")
+        value, action = "", parts[1]
+    else:
+        # 多余的字段(如 no-resolve)忽略
+        if len(parts) < 3 or not parts[1]:
+            raise ValueError(f"规则格式错误:{line}")
+        value, action = parts[1], parts[2]
+    action = action.upper()
+    if action not in ACTIONS:
+        raise ValueError(f"不支持的规则动作:{action}")
+    if rule_type in ("DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD"):
+        value = normalize_host(value).lstrip(".")
+    elif rule_type in ("IP-CIDR", "IP-CIDR6"):
+        value = str(ipaddress.ip_network(value, strict=False))
+    elif rule_type == "DST-PORT":
+        parse_port_range(value)
+    return Rule(rule_type, value, action)
+
+
+def parse_rules(lines: Iterable[str]) -> list[Rule]:
+    """格式错误的行记录日志后跳过"""
+    rules = []
+    for number, line in enumerate(lines, 1):
+        try:
+            rule = parse_rule(line)
+        except ValueError as e:
+            logging.error(f"第{number}行规则无效:{e}")
+            continue
+        if rule is not None:
+            rules.append(rule)
+    return rules
+
+
+class DomainTrie:
+    """按标签倒序(com -> google -> www)存放的后缀树, 节点为 标签 -> [规则序号, 子节点]"""
+
+    def __init__(self) -> None:
+        self.root: dict[str, list] = {}
+
+    def insert(self, suffix: str, index: int) -> None:
+        node = self.root
+        labels = suffix.split(".")
+        for i, label in enumerate(reversed(labels)):
+            entry = node.get(label, None)
+            if entry is None:
+                entry = node[label] = [NO_MATCH, None]
+            if i == len(labels) - 1:
+                entry[0] = min(entry[0], index)
+            else:
+                if entry[1] is None:
+                    entry[1] = {}
+                node = entry[1]
+
+    def match(self, host: str) -> int:
+        best = NO_MATCH
+        node = self.root
+        for label in reversed(host.split(".")):
+            entry = node.get(label, None)
+            if entry is None:
+                break
+            if entry[0] < best:
+                best = entry[0]
+            node = entry[1]
+            if node is None:
+                break
+        return best
+
+
+class KeywordMatcher:
+    """Aho-Corasick 自动机, 一次扫描找出域名中包含的全部关键字, 返回其中最小的规则序号
+
+    构建后展开为确定自动机: 转移表按 状态 * 字母表大小 + 字符编号 存放, 匹配时不必沿失败指针回退;
+    字母表只包含关键字中出现过的字节, 其余字节统一编号为 0
+    """
+
+    def __init__(self) -> None:
+        self.goto: list[dict[int, int]] = [{}]
+        self.out: list[int] = [NO_MATCH]
+        self._codes = bytes(256)
+        self._width = 1
+        self._table = array("i", [0])
+        self._built = True
+
+    def insert(self, keyword: str, index: int) -> None:
+        state = 0
+        for byte in keyword.encode():
+            next_state = self.goto[state].get(byte, None)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.out.append(NO_MATCH)
+                self.goto[state][byte] = next_state
+            state = next_state
+        self.out[state] = min(self.out[state], index)
+        self._built = False
+
+    def build(self) -> None:
+        """按层计算失败指针, 把失败链上的输出合并到当前状态, 并填充转移表"""
+        alphabet = sorted({byte for edges in self.goto for byte in edges})
+        codes = bytearray(256)
+        for code, byte in enumerate(alphabet, 1):
+            codes[byte] = code
+        width = len(alphabet) + 1
+        table = array("i", [0]) * (len(self.goto) * width)
+        fail = [0] * len(self.goto)
+        queue = deque([0])
+        while queue:
+            state = queue.popleft()
+            row = state * width
+            fail_row = fail[state] * width
+            for code, byte in enumerate(alphabet, 1):
+                child = self.goto[state].get(byte, None)
+                if child is None:
+                    # 根节点上没有的边回到根, 其余沿用失败状态的转移
+                    table[row + code] = table[fail_row + code] if state else 0
+                    continue
+                table[row + code] = child
+                fail[child] = table[fail_row + code] if state else 0
+                self.out[child] = min(self.out[child], self.out[fail[child]])
+                queue.append(child)
+        self._codes, self._width, self._table = bytes(codes), width, table
+        self._built = True
+
+    def match(self, text: str) -> int:
+        if not self._built:
+            self.build()
+        table, width, out = self._table, self._width, self.out
+        best = NO_MATCH
+        state = 0
+        for code in text.encode().translate(self._codes):
+            state = table[state * width + code]
+            if out[state] < best:
+                best = out[state]
+        return best
+
+
+class CidrTree:
+    """步长为 8 位的多路基数树, 前缀按字节展开, IPv4 最多查 4 层, IPv6 最多 16 层
+
+    每个节点为 (字节 -> 规则序号, 字节 -> 子节点)
+    """
+
+    def __init__(self) -> None:
+        self.root: tuple[dict[int, int], dict[int, tuple]] = ({}, {})
+        # /0 前缀
+        self.default = NO_MATCH
+
+    def insert(self, network: str, index: int) -> None:
+        net = ipaddress.ip_network(network, strict=False)
+        packed = net.network_address.packed
+        prefix = net.prefixlen
+        if prefix == 0:
+            self.default = min(self.default, index)
+            return
+        depth = (prefix - 1) // 8
+        node = self.root
+        for i in range(depth):
+            child = node[1].get(packed[i], None)
+            if child is None:
+                child = node[1][packed[i]] = ({}, {})
+            node = child
+        span = 1 << (8 - (prefix - depth * 8))
+        values = node[0]
+        for byte in range(packed[depth], packed[depth] + span):
+            if values.get(byte, NO_MATCH) > index:
+                values[byte] = index
+
+    def match(self, packed: bytes) -> int:
+        best = self.default
+        node = self.root
+        for byte in packed:
+            value = node[0].get(byte, None)
+            if value is not None and value < best:
+                best = value
+            node = node[1].get(byte, None)
+            if node is None:
+                break
+        return best
+
+
+class RuleEngine:
+    """把规则编译为 精确域名字典、域名后缀树、关键字自动机、CIDR 基数树 与 端口表,
+
+    单次匹配的耗时与规则条数基本无关; 结果与按顺序逐条匹配(第一条命中的生效)相同
+    """
+
+    def __init__(self, rules: Iterable[Rule]) -> None:
+        self.rules = list(rules)
+        self.domains: dict[str, int] = {}
+        self.suffixes = DomainTrie()
+        self.keywords = KeywordMatcher()
+        self.cidr4 = CidrTree()
+        self.cidr6 = CidrTree()
+        self.ports: Optional[array] = None
+        self.final = NO_MATCH
+        self._has_suffix = self._has_keyword = self._has_ip = False
+        for index, rule in enumerate(self.rules):
+            self._add(rule, index)
+        self.keywords.build()
+
+    def _add(self, rule: Rule, index: int) -> None:
+        if rule.type == "DOMAIN":
+            self.domains.setdefault(rule.value, index)
+        elif rule.type == "DOMAIN-SUFFIX":
+            self.suffixes.insert(rule.value, index)
+            self._has_suffix = True
+        elif rule.type == "DOMAIN-KEYWORD":
+            self.keywords.insert(rule.value, index)
+            self._has_keyword = True
+        elif rule.type in ("IP-CIDR", "IP-CIDR6"):
+            tree = self.cidr6 if ":" in rule.value else self.cidr4
+            tree.insert(rule.value, index)
+            self._has_ip = True
+        elif rule.type == "DST-PORT":
+            if self.ports is None:
+                self.ports = array("q", [NO_MATCH]) * 65536
+            low, high = parse_port_range(rule.value)
+            for port in range(low, high + 1):
+                if self.ports[port] > index:
+                    self.ports[port] = index
+        elif rule.type == "MATCH":
+            self.final = min(self.final, index)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]) -> "RuleEngine":
+        return cls(parse_rules(lines))
+
+    @classmethod
+    def load_file(cls, file_path: str) -> Optional["RuleEngine"]:
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                return cls.from_lines(f)
+        except OSError as e:
+            logging.error(f"读取规则文件失败:{e}")
+            return None
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def match_index(self, host: Optional[str], ip: Optional[str] = None, port: Optional[int] = None) -> int:
+        best = self.final
+        if host:
+            host = normalize_host(host)
+            packed = _pack_ip(host) if ip is None else None
+            if packed is not None:
+                ip, host = host, None
+        if host:
+            index = self.domains.get(host, NO_MATCH)
+            if index < best:
+                best = index
+            if self._has_suffix:
+                index = self.suffixes.match(host)
+                if index < best:
+                    best = index
+            if self._has_keyword:
+                index = self.keywords.match(host)
+                if index < best:
+                    best = index
+        if ip is not None and self._has_ip:
+            packed = _pack_ip(ip)
+            if packed is not None:
+                index = (self.cidr4 if len(packed) == 4 else self.cidr6).match(packed)
+                if index < best:
+                    best = index
+        if port is not None and self.ports is not None and 0 <= port <= 65535:
+            index = self.ports[port]
+            if index < best:
+                best = index
+        return best
+
+    def match(self, host: Optional[str], ip: Optional[str] = None, port: Optional[int] = None) -> Optional[Rule]:
+        """返回生效的规则, host 可以是域名或 IP; 没有规则命中时返回 None"""
+        index = self.match_index(host, ip, port)
+        return self.rules[index] if index != NO_MATCH else None
+
+    def route(
+        self, host: Optional[str], ip: Optional[str] = None, port: Optional[int] = None, default: str = "DIRECT"
+    ) -> str:
+        rule = self.match(host, ip, port)
+        return rule.action if rule is not None else default
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    engine = RuleEngine.from_lines(
+        ["DOMAIN-SUFFIX,google.com,PROXY", "DOMAIN-KEYWORD,ads,REJECT", "IP-CIDR,192.168.0.0/16,DIRECT", "MATCH,PROXY"]
+    )
+    logging.info(engine.match("www.google.com"))
+    logging.info(engine.route("192.168.1.1"))
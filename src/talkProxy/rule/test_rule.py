@@ -0,0 +1,139 @@
+import unittest
+
+
+class Test(unittest.TestCase):
+
+    def test_rule_engine(self):
+        from talkProxy.rule.engine import RuleEngine, parse_rule
+
+        engine = RuleEngine.from_lines([
+            '# 注释',
+            'DOMAIN,login.example.com,DIRECT',
+            'DOMAIN-SUFFIX,example.com,PROXY',
+            'DOMAIN-KEYWORD,ads,REJECT',
+            'DOMAIN-SUFFIX,.ads.net,DIRECT',
+            'IP-CIDR,10.0.0.0/8,DIRECT,no-resolve',
+            'IP-CIDR,10.1.0.0/20,REJECT',
+            'IP-CIDR6,2001:db8::/33,PROXY',
+            'DST-PORT,6881-6889,REJECT',
+            'UNKNOWN,foo,PROXY',
+            'DOMAIN,bad-action.com,DROP',
+        ])
+        self.assertEqual(len(engine), 8)
+        self.assertEqual(engine.match('LOGIN.example.com.').action, 'DIRECT')
+        self.assertEqual(engine.route('www.example.com'), 'PROXY')
+        self.assertEqual(engine.route('example.com'), 'PROXY')
+        self.assertEqual(engine.route('badexample.com'), 'DIRECT')
+        # 关键字规则排在后缀规则之前, 先写的生效
+        self.assertEqual(engine.route('x.ads.net'), 'REJECT')
+        self.assertEqual(engine.route('myads.example.com'), 'PROXY')
+        self.assertEqual(engine.route('10.1.15.1'), 'DIRECT')
+        self.assertEqual(engine.route('8.8.8.8', default='PROXY'), 'PROXY')
+        self.assertEqual(engine.route('some.host', ip='10.2.3.4', default='PROXY'), 'DIRECT')
+        self.assertEqual(engine.route('2001:db8:7fff::1'), 'PROXY')
+        self.assertEqual(engine.route('[2001:db8:8000::1]'), 'DIRECT')
+        self.assertEqual(engine.route('peer.host', port=6885), 'REJECT')
+        self.assertIsNone(engine.match('peer.host', port=6890))
+
+        engine = RuleEngine.from_lines(['IP-CIDR,10.1.0.0/20,REJECT', 'IP-CIDR,10.0.0.0/8,DIRECT', 'MATCH,PROXY'])
+        self.assertEqual(engine.route('10.1.15.1'), 'REJECT')
+        self.assertEqual(engine.route('10.1.16.1'), 'DIRECT')
+        self.assertEqual(engine.route('example.org'), 'PROXY')
+
+        with self.assertRaises(ValueError):
+            parse_rule('DST-PORT,70000,DIRECT')
+
+    def test_rule_engine_random(self):
+        """与逐条匹配的参考实现比较"""
+        import ipaddress
+        import random
+        from talkProxy.rule.engine import RuleEngine, Rule
+
+        rng = random.Random(1)
+        labels = ['a', 'b', 'ab', 'ba', 'abc', 'com', 'net']
+        rules = []
+        for _ in range(300):
+            kind = rng.choice(['DOMAIN', 'DOMAIN-SUFFIX', 'DOMAIN-KEYWORD', 'IP-CIDR', 'DST-PORT'])
+            if kind == 'IP-CIDR':
+                value = f'10.{rng.randrange(4)}.{rng.randrange(256)}.0/{rng.randrange(8, 33)}'
+                value = str(ipaddress.ip_network(value, strict=False))
+            elif kind == 'DST-PORT':
+                low = rng.randrange(1000)
+                value = f'{low}-{low + rng.randrange(50)}'
+            elif kind == 'DOMAIN-KEYWORD':
+                value = ''.join(rng.choice('abc.') for _ in range(rng.randrange(1, 4))).strip('.') or 'a'
+            else:
+                value = '.'.join(rng.choice(labels) for _ in range(rng.randrange(1, 4)))
+            rules.append(Rule(kind, value, rng.choice(['DIRECT', 'PROXY', 'REJECT'])))
+        engine = RuleEngine(rules)
+
+        for _ in range(2000):
+            if rng.random() < 0.5:
+                host = '.'.join(rng.choice(labels) for _ in range(rng.randrange(1, 5)))
+            else:
+                host = f'10.{rng.randrange(4)}.{rng.randrange(256)}.{rng.randrange(256)}'
+            port = rng.randrange(1100)
+            expected = next((rule for rule in rules if rule.matches(host, port=port)), None)
+            self.assertEqual(engine.match(host, port=port), expected, (host, port))
+
+
+    def test_compiled_ruleset(self):
+        import os
+        import tempfile
+        from unittest import mock
+        from talkProxy.rule.compiled import CompiledRuleSet, compile_rules, compiled_path, load_ruleset
+        from talkProxy.rule.engine import RuleEngine, parse_rules
+        from talkProxy.tools import config
+
+        lines = [
+            'DOMAIN,login.example.com,DIRECT',
+            'DOMAIN-SUFFIX,example.com,PROXY',
+            'DOMAIN-KEYWORD,ads,REJECT',
+            'DOMAIN-SUFFIX,ads.net,DIRECT',
+            'IP-CIDR,10.1.0.0/20,REJECT',
+            'IP-CIDR,10.0.0.0/8,DIRECT',
+            'IP-CIDR6,2001:db8::/33,PROXY',
+            'DST-PORT,6881-6889,REJECT',
+            'MATCH,PROXY',
+        ]
+        queries = [
+            ('login.example.com', None), ('www.example.com', 443), ('badexample.com', 80), ('x.ads.net', None),
+            ('10.1.15.1', None), ('10.1.16.1', None), ('11.0.0.1', None), ('2001:db8:7fff::1', None),
+            ('2001:db8:8000::1', None), ('peer.host', 6885), ('peer.host', 6890),
+        ]
+        engine = RuleEngine(parse_rules(lines))
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(config, 'config_dir_path', tmp):
+            source = os.path.join(tmp, 'rules.txt')
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines))
+            self.assertEqual(compiled_path(source), os.path.join(tmp, 'rules.ruleset'))
+
+            with load_ruleset(source) as ruleset:
+                self.assertEqual(len(ruleset), len(engine))
+                for host, port in queries:
+                    self.assertEqual(ruleset.match(host, port=port), engine.match(host, port=port), host)
+            mtime = os.stat(compiled_path(source)).st_mtime_ns
+
+            # 源文件未变化时直接使用编译结果
+            load_ruleset(source).close()
+            self.assertEqual(os.stat(compiled_path(source)).st_mtime_ns, mtime)
+
+            # 源文件变化后重新编译
+            with open(source, 'a', encoding='utf-8') as f:
+                f.write('\nDOMAIN,new.org,REJECT')
+            os.utime(source, ns=(mtime + 10**9, mtime + 10**9))
+            with load_ruleset(source) as ruleset:
+                self.assertEqual(ruleset.route('new.org'), 'PROXY')
+                self.assertEqual(len(ruleset), len(lines) + 1)
+
+            # 损坏的编译结果会被重新生成
+            with open(compiled_path(source), 'r+b') as f:
+                f.write(b'XXXX')
+            with load_ruleset(source) as ruleset:
+                self.assertEqual(ruleset.route('www.example.com'), 'PROXY')
+
+            # 空规则集
+            empty = os.path.join(tmp, 'empty.ruleset')
+            compile_rules([], empty)
+            with CompiledRuleSet(empty) as ruleset:
+                self.assertIsNone(ruleset.match('example.com', port=80))
@@ -1,8 +1,15 @@
 import logging
+import os
 import secrets
 import string
+import sys
+import tempfile
 import time
 
+# Linux 上 sync() 等待全部数据落盘后才返回, 批量写入时可以用一次 sync 代替逐个 fsync
+BATCH_SYNC = sys.platform.startswith("linux")
+
+
 def randomStr(length:int=8):
     characters = string.ascii_letters + string.digits
     return ''.join(secrets.choice(characters) for _ in range(length))
@@ -16,7 +23,65 @@ def passtimes(time1: int, time2: int) -> int:
     except Exception as e:
         logging.error(f"时间戳计算失败:{e}")
         return None
-    
+
+
+def fsync_dir(dir_path: str) -> None:
+    """同步目录项, 保证 rename 落盘; Windows 不支持打开目录, 直接跳过"""
+    if os.name != "posix":
+        return
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_temp(file_path: str, data: str | bytes | list[bytes], sync: bool = True, suffix: str = ".yaml") -> str:
+    """在目标文件所在目录写入临时文件并返回其路径, sync 为 False 时由调用者负责落盘
+
+    data 为 str 时按 UTF-8 文本写入; 为 bytes 或 bytes 列表时按二进制写入, 列表逐块写入不必先拼接
+    """
+    dir_path = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=".tmp-", suffix=suffix)
+    text = isinstance(data, str)
+    chunks = [data] if text or isinstance(data, bytes) else data
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") if text else os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def atomic_write(file_path: str, data: str | bytes | list[bytes], sync_dir: bool = True, suffix: str = ".yaml") -> None:
+    """写入临时文件并 fsync 后 rename 覆盖目标文件, 读者只会看到完整的旧文件或新文件"""
+    tmp_path = write_temp(file_path, data, suffix=suffix)
+    try:
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if sync_dir:
+        fsync_dir(os.path.dirname(os.path.abspath(file_path)))
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    """线性插值的百分位数, p 取 0-100, 没有数据时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
 
 if __name__ == "__main__":
-    print(randomStr())
\ No newline at end of file
+    print(randomStr())
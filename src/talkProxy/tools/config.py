@@ -1,12 +1,16 @@
 import logging
 import os
 import threading
-import yaml
+import time
 
-from .remote_config import get_remote_config
-from .common import randomStr, timestamp
+from .remote_config import MAX_SUBSCRIPTION_SIZE, FetchResult, ProxyStream, fetch_all, fetch_remote_config
+from .common import BATCH_SYNC, atomic_write, fsync_dir, randomStr, timestamp, write_temp
+from . import yaml_backend
+from .metrics import Counter
+from .file_watch import get_watcher
 from .settingReader import SettingReader
-from typing import Any, Optional
+from .subscription_diff import SubscriptionDiff, diff_proxies, proxy_key
+from typing import Any, Iterable, Iterator, Optional
 
 config_dir_name = "config"
 config_dir_path = os.path.join(
@@ -16,19 +20,38 @@ config_file_name = "config.yaml"
 config_file_path = os.path.join(config_dir_path, config_file_name)
 subscription_file_name = "subscription.yaml"
 subscription_file_path = os.path.join(config_dir_path, subscription_file_name)
+subscription_cache_file_name = "subscription_cache.yaml"
+subscription_cache_file_path = os.path.join(config_dir_path, subscription_cache_file_name)
+
+CONFIG_WRITES = Counter("talkproxy_config_writes_total", "配置文件写入次数, result 为 ok/error", ["result"])
+
+
+def set_config_dir(dir_path: str) -> None:
+    """切换配置目录, 需在创建 GlobalConfig 之前调用"""
+    global config_dir_path, config_file_path, subscription_file_path, subscription_cache_file_path
+    os.makedirs(dir_path, exist_ok=True)
+    config_dir_path = os.path.abspath(dir_path)
+    config_file_path = os.path.join(config_dir_path, config_file_name)
+    subscription_file_path = os.path.join(config_dir_path, subscription_file_name)
+    subscription_cache_file_path = os.path.join(config_dir_path, subscription_cache_file_name)
 
 
 ProxyType: list[str] = ["hysteria2"]
 
 
 class File:
-    def __init__(self, name: str, type: str, path: str) -> None:  # noqa: A002
+    def __init__(self, name: str, type: str, path: str, key: Optional[str] = None) -> None:  # noqa: A002
         self.name = name
         self.type = type
         self.path = path
+        # 生成该文件的节点内容键, 用于增量同步
+        self.key = key
 
     def __dict__(self) -> dict[str, str]:
-        return {"name": self.name, "type": self.type, "path": self.path}
+        file_dict = {"name": self.name, "type": self.type, "path": self.path}
+        if self.key is not None:
+            file_dict["key"] = self.key
+        return file_dict
 
     def to_dict(self) -> dict[str, str]:
         return self.__dict__()
@@ -47,7 +70,7 @@ class Subscription:
         self.url = url
         self.updateInterval = updateInterval
         self.lastUpdate = lastUpdate
-        self.files = files
+        self.files = [File(**file) if isinstance(file, dict) else file for file in files]
 
     def __dict__(self) -> dict[str, Any]:
         return {
@@ -71,22 +94,138 @@ def checkParam(kwDict: dict, key: str, param_type: type, default: Optional[any]
     return kwDict[key]
 
 
+class ConfigCommitError(OSError):
+    """配置事务提交时有文件未能写入或删除, 内存中这些配置已从磁盘恢复"""
+
+
+class ConfigTransaction:
+    """批量写入配置: 事务内的 save_config 只标记脏数据, 退出时每个文件只原子写入一次
+
+    with ConfigTransaction():
+        subscriptionConfig.add_subscription(...)
+        subscriptionConfig.update_subscription(...)
+
+    嵌套时并入最外层事务; 发生异常时丢弃未写入的修改并从磁盘恢复内存中的配置;
+    提交失败时最外层事务退出抛出 ConfigCommitError
+    """
+
+    _local = threading.local()
+
+    def __init__(self) -> None:
+        self.configs: dict[str, BaseConfig] = {}
+        self.removed_files: list[str] = []
+        self._outer: Optional[ConfigTransaction] = None
+
+    @classmethod
+    def current(cls: "ConfigTransaction") -> Optional["ConfigTransaction"]:
+        return getattr(cls._local, "transaction", None)
+
+    def __enter__(self) -> "ConfigTransaction":
+        self._outer = ConfigTransaction.current()
+        if self._outer is None:
+            ConfigTransaction._local.transaction = self
+        return self._outer or self
+
+    def __exit__(self, exc_type: Optional[type], exc: Optional[BaseException], tb: Any) -> None:
+        if self._outer is not None:
+            return
+        ConfigTransaction._local.transaction = None
+        if exc_type is not None:
+            self.rollback()
+            return
+        if not self.commit():
+            logging.error("配置事务提交失败")
+            raise ConfigCommitError("配置事务提交失败")
+
+    def add(self, config: "BaseConfig") -> None:
+        self.configs[os.path.abspath(config.file_path)] = config
+
+    def remove_file(self, file_path: str) -> None:
+        self.removed_files.append(file_path)
+
+    def commit(self) -> bool:
+        """先写入全部临时文件并统一落盘, 再依次 rename, 每个目录只 fsync 一次"""
+        failed: list[BaseConfig] = []
+        dirs = set()
+        # 多个文件时用一次 sync 代替逐个 fsync
+        batch = BATCH_SYNC and len(self.configs) > 1
+        staged: list[tuple[str, str, BaseConfig]] = []
+        for file_path, config in self.configs.items():
+            try:
+                staged.append((file_path, write_temp(file_path, yaml_backend.dump(config.config), sync=not batch), config))
+            except Exception as e:
+                logging.error(f"保存配置文件失败:{e}")
+                CONFIG_WRITES.labels("error").inc()
+                failed.append(config)
+        if batch and staged:
+            os.sync()
+        for file_path, tmp_path, config in staged:
+            try:
+                os.replace(tmp_path, file_path)
+            except OSError as e:
+                logging.error(f"保存配置文件失败:{e}")
+                CONFIG_WRITES.labels("error").inc()
+                os.remove(tmp_path)
+                failed.append(config)
+                continue
+            config._written()
+            dirs.add(os.path.dirname(file_path))
+        success = not failed
+        for file_path in self.removed_files:
+            if os.path.abspath(file_path) in self.configs:
+                continue
+            try:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    dirs.add(os.path.dirname(os.path.abspath(file_path)))
+            except OSError as e:
+                logging.error(f"删除配置文件失败:{e}")
+                success = False
+        for dir_path in dirs:
+            fsync_dir(dir_path)
+        # 未写入的配置从磁盘恢复, 内存与磁盘保持一致
+        for config in failed:
+            if os.path.exists(config.file_path):
+                config.reload_config()
+        self.configs.clear()
+        self.removed_files.clear()
+        return success
+
+    def rollback(self) -> None:
+        for config in self.configs.values():
+            if os.path.exists(config.file_path):
+                config.reload_config()
+        self.configs.clear()
+        self.removed_files.clear()
+
+
 class BaseConfig:
-    def __init__(self, file_path: str) -> None:
+    # 是否使用二进制解析缓存, 只写不读的配置不需要
+    cache_parsed = True
+    # 是否监听文件变化, 只写不读的配置不需要, 否则监听器中会一直留着已删除的文件
+    watch_changes = True
+
+    def __init__(self, file_path: str, load: bool = True) -> None:
         self.config: dict = None
         self.file_path: str = file_path
-        self.load_config()
+        # 读取或写入时文件的变化代数, 见 file_watch
+        self._generation: Optional[int] = None
+        if load:
+            self.load_config()
 
     def load_config(self) -> bool:
         try:
             if not os.path.exists(self.file_path):
                 with open(self.file_path, "w+") as f:
                     f.write("")
-            with open(self.file_path, "r+") as f:
-                self.config = yaml.safe_load(f)
-                if self.config is None:
-                    self.config = {}
-                logging.debug(self.config)
+            watcher = get_watcher()
+            watcher.watch(self.file_path)
+            # 读取前记录代数, 读取过程中发生的修改会在下次检查时被发现
+            self._generation = watcher.generation(self.file_path)
+            self.config = yaml_backend.load_file(self.file_path, use_cache=self.cache_parsed)
+            if self.config is None:
+                self.config = {}
+            logging.debug(self.config)
             return True
         except Exception as e:
             logging.error(f"读取配置文件失败:{e}")
@@ -95,78 +234,200 @@ class BaseConfig:
     def reload_config(self) -> bool:
         return self.load_config()
 
+    def refresh_config(self) -> bool:
+        """文件被外部修改过时才重新读取, 否则直接使用内存中的配置"""
+        if self.config is not None and get_watcher().generation(self.file_path) == self._generation:
+            return True
+        return self.load_config()
+
     def save_config(self) -> bool:
+        transaction = ConfigTransaction.current()
+        if transaction is not None:
+            transaction.add(self)
+            return True
+        return self.write_config()
+
+    def write_config(self, sync_dir: bool = True) -> bool:
+        # 内存中的配置即为写入内容, 无需写入后重新读取
         try:
-            with open(self.file_path, "w") as f:
-                yaml.dump(self.config, f)
+            atomic_write(self.file_path, yaml_backend.dump(self.config), sync_dir=sync_dir)
         except Exception as e:
             logging.error(f"保存配置文件失败:{e}")
+            CONFIG_WRITES.labels("error").inc()
             return False
-        return self.reload_config()
+        self._written()
+        return True
+
+    def _written(self) -> None:
+        """文件已写入磁盘后更新计数与变化代数"""
+        CONFIG_WRITES.labels("ok").inc()
+        if self.watch_changes:
+            watcher = get_watcher()
+            watcher.watch(self.file_path)
+            self._generation = watcher.generation(self.file_path)
+        # config.yaml 同时是 SettingReader 的配置文件, 写入后立即替换其快照
+        SettingReader.refresh(self.file_path)
 
 
 class SubscriptionConfig(BaseConfig):
-    def __init__(self) -> None:
-        super().__init__(subscription_file_path)
+    """订阅配置, 内存中维护 订阅名->订阅 与 节点名->(订阅, 节点文件) 两个索引
+
+    索引是订阅数据的唯一来源, config["subscription"] 只在写入文件时由索引重新生成
+    """
+
+    def __init__(self, file_path: Optional[str] = None) -> None:
+        file_path = file_path or subscription_file_path
+        self._subscriptions: dict[str, Subscription] = {}
+        # 不同订阅中可能存在同名节点, 按订阅名区分
+        self._nodes: dict[str, dict[str, File]] = {}
+        super().__init__(file_path)
         if "subscription" not in self.config:
             self.config["subscription"] = []
             if not self.save_config():
                 logging.error("初始化配置文件失败")
 
+    def load_config(self) -> bool:
+        if not super().load_config():
+            return False
+        self._subscriptions = {}
+        self._nodes = {}
+        for sub in self.config.get("subscription", None) or []:
+            self._index(Subscription(**sub))
+        return True
+
+    def write_config(self, sync_dir: bool = True) -> bool:
+        self.config["subscription"] = [sub.to_dict() for sub in self._subscriptions.values()]
+        return super().write_config(sync_dir)
+
+    def _index(self, subscription: Subscription) -> None:
+        self._subscriptions[subscription.name] = subscription
+        for file in subscription.files:
+            self._nodes.setdefault(file.name, {})[subscription.name] = file
+
+    def _unindex(self, subscription: Subscription) -> None:
+        for file in subscription.files:
+            nodes = self._nodes.get(file.name, None)
+            if nodes is None:
+                continue
+            nodes.pop(subscription.name, None)
+            if not nodes:
+                del self._nodes[file.name]
+
     def add_subscription(self, subscription: Subscription) -> bool:
-        for sub in self.config["subscription"]:
-            if sub["name"] == subscription.name:
-                logging.error(f"已存在{subscription.name}订阅")
-                self.update_subscription(name=subscription.name, subscription=subscription)
-                return True
-        self.config["subscription"].append(subscription.to_dict())
+        if subscription.name in self._subscriptions:
+            logging.error(f"已存在{subscription.name}订阅")
+            self.update_subscription(name=subscription.name, subscription=subscription)
+            return True
+        self._index(subscription)
         if not self.save_config():
             logging.error("初始化配置文件失败")
             return False
         return True
 
     def get_subscription(self, name: str) -> Subscription | None:
-        for sub in self.config["subscription"]:
-            if sub["name"] == name:
-                return Subscription(**sub)
-        return None
+        """返回索引中的订阅对象, 修改后需调用 update_subscription 保存"""
+        return self._subscriptions.get(name, None)
+
+    def get_node(self, name: str, subscription_name: Optional[str] = None) -> Optional[tuple[Subscription, File]]:
+        """按节点名查找节点, 未指定订阅时返回最先加入的同名节点"""
+        nodes = self._nodes.get(name, None)
+        if not nodes:
+            return None
+        if subscription_name is None:
+            subscription_name = next(iter(nodes))
+        file = nodes.get(subscription_name, None)
+        if file is None:
+            return None
+        return self._subscriptions[subscription_name], file
 
     def remove_subscription(self, name: str) -> bool:
-        for sub in self.config["subscription"]:
-            if sub["name"] == name:
-                self.config["subscription"].remove(sub)
-                if not self.save_config():
-                    logging.error("初始化配置文件失败")
-                    return False
+        subscription = self._subscriptions.pop(name, None)
+        if subscription is None:
+            return True
+        self._unindex(subscription)
+        if not self.save_config():
+            logging.error("初始化配置文件失败")
+            return False
         return True
 
     def update_subscription(self, name: str, subscription: Subscription) -> bool:
-        for i, sub in enumerate(self.config["subscription"]):
-            if sub["name"] == name:
-                self.config["subscription"][i] = subscription.to_dict()
-                if not self.save_config():
-                    logging.error("初始化配置文件失败")
-                    return False
+        old_subscription = self._subscriptions.get(name, None)
+        if old_subscription is None:
+            return True
+        if subscription.name != name and subscription.name in self._subscriptions:
+            logging.error(f"已存在{subscription.name}订阅, 无法将{name}改名")
+            return False
+        self._unindex(old_subscription)
+        if subscription.name == name:
+            self._index(subscription)
+        else:
+            # 订阅改名时保持原有顺序
+            subscriptions = self._subscriptions
+            self._subscriptions = {}
+            for sub_name, sub in subscriptions.items():
+                if sub_name == name:
+                    sub = subscription
+                self._subscriptions[sub.name] = sub
+            self._index(subscription)
+        if not self.save_config():
+            logging.error("初始化配置文件失败")
+            return False
         return True
-    
+
     def is_subscription_exist(self, name: str) -> bool:
-        return any(sub["name"] == name for sub in self.config["subscription"])
+        return name in self._subscriptions
+
+    def get_subscription_list(self) -> list[Subscription]:
+        """不重新读取文件, 直接返回内存中的订阅列表"""
+        return list(self._subscriptions.values())
 
     def get_subscription_all(self) -> list[Subscription]:
-        if not self.reload_config():
-            logging.error("get_subscription_all reload_config 失败")
+        if not self.refresh_config():
+            logging.error("get_subscription_all refresh_config 失败")
+            return None
+        return list(self._subscriptions.values())
+
+
+class SubscriptionCacheConfig(BaseConfig):
+    """保存每个订阅上次获取时的 ETag/Last-Modified/内容哈希, 用于条件请求"""
+
+    def __init__(self, file_path: Optional[str] = None) -> None:
+        super().__init__(file_path or subscription_cache_file_path)
+
+    def get_validators(self, name: str, url: str) -> Optional[dict]:
+        validators = self.config.get(name, None)
+        if not validators or validators.get("url") != url:
             return None
-        subscription_list = []
-        for subscription_str in self.config["subscription"]:
-            subscription = Subscription(**subscription_str)
-            subscription_list.append(subscription)
-        return subscription_list
-            
+        return validators
+
+    def set_validators(self, name: str, url: str, result: FetchResult) -> bool:
+        validators = {"url": url, **result.validators()}
+        if self.config.get(name, None) == validators:
+            return True
+        self.config[name] = validators
+        return self.save_config()
+
+    def remove_validators(self, name: str) -> bool:
+        if self.config.pop(name, None) is None:
+            return True
+        return self.save_config()
 
 
 class Hysteria2Config(BaseConfig):
+    cache_parsed = False
+    watch_changes = False
+
     def __init__(self, file_path: str, **kwargs: dict[str, Any]) -> None:
-        super().__init__(file_path)
+        # 节点配置整体由订阅内容生成, 不需要读取旧文件
+        super().__init__(file_path, load=False)
+        self.config = self.generate(**kwargs)
+        if not self.save_config():
+            logging.error("初始化配置文件失败")
+            raise ValueError("Hysteria2Config.__init__() save_config失败")
+
+    @staticmethod
+    def generate(**kwargs: dict[str, Any]) -> dict:
+        """由订阅中的节点信息和当前设置生成写入文件的配置, 不写入文件"""
         server = checkParam(kwargs, "server", str, None)
         if server is None:
             logging.error("缺少server字段")
@@ -177,17 +438,18 @@ class Hysteria2Config(BaseConfig):
             logging.error("缺少auth字段")
             raise ValueError("Hysteria2Config.__init__()缺少auth(password)字段")
         auth = auth or password
+        settings = SettingReader.snapshot()
         http = checkParam(
             kwargs,
             "http",
             dict,
-            {"listen": f'127.0.0.1:{SettingReader.getInt("httpPort")}'},
+            {"listen": f'127.0.0.1:{settings.httpPort}'},
         )
         socks = checkParam(
             kwargs,
             "socks",
             dict,
-            {"listen": f'127.0.0.1:{SettingReader.getInt("socksPort")}'},
+            {"listen": f'127.0.0.1:{settings.socksPort}'},
         )
         tls = checkParam(kwargs, "tls", dict, {"insecure": True})
         params = {
@@ -204,10 +466,17 @@ class Hysteria2Config(BaseConfig):
             params["bandwidth"] = bandwidth
         new_params = kwargs
         new_params.update(params)
-        self.config = new_params
-        if not self.save_config():
-            logging.error("初始化配置文件失败")
-            raise ValueError("Hysteria2Config.__init__() save_config失败")
+        return new_params
+
+
+def node_key(proxy: dict) -> str:
+    """节点内容键, 由最终写入文件的配置计算, 订阅内容或生成配置用到的设置(如监听端口)变化都会改变该值"""
+    if proxy.get("type") == "hysteria2":
+        try:
+            return proxy_key(Hysteria2Config.generate(**proxy))
+        except ValueError:
+            pass
+    return proxy_key(proxy)
 
 
 class GlobalConfig(BaseConfig):
@@ -217,6 +486,7 @@ class GlobalConfig(BaseConfig):
     def __init__(self) -> None:
         super().__init__(config_file_path)
         self.subscriptionConfig = SubscriptionConfig()
+        self.subscriptionCacheConfig = SubscriptionCacheConfig()
         if self.config == {}:
             self.config = {"httpPort": 7899, "socksPort": 7900, "default": None}
             if not self.save_config():
@@ -245,20 +515,80 @@ class GlobalConfig(BaseConfig):
     def get_subscription_config(self) -> "SubscriptionConfig":
         return self.subscriptionConfig
 
+    def remove_subscription(self, name: str) -> bool:
+        """删除订阅及其条件请求的校验信息, 之后同名订阅会重新完整获取"""
+        try:
+            with ConfigTransaction():
+                if not self.subscriptionConfig.remove_subscription(name):
+                    return False
+                return self.subscriptionCacheConfig.remove_validators(name)
+        except ConfigCommitError:
+            return False
+
     def new_subscription(
-        self, name: str, url: str, updateInterval: str
+        self,
+        name: str,
+        url: str,
+        updateInterval: str,
+        stream: bool = False,
+        max_bytes: int = MAX_SUBSCRIPTION_SIZE,
     ) -> Optional[Subscription]:
+        """stream 为 True 时边下载边解析, 节点到达即写入配置文件, 适用于超大订阅"""
         res = self.subscriptionConfig.is_subscription_exist(name)
         if res:
             logging.error(f"已存在{name}订阅")
             return None
-        remote_dict = get_remote_config(url)
+        if stream:
+            return self._new_subscription_stream(name, url, updateInterval, max_bytes)
+        result = fetch_remote_config(name, url)
+        try:
+            with ConfigTransaction():
+                subscription = self.build_subscription(name, url, updateInterval, result.config)
+                if subscription is not None:
+                    self.subscriptionCacheConfig.set_validators(name, url, result)
+        except ConfigCommitError:
+            return None
+        return subscription
+
+    def build_subscription(
+        self, name: str, url: str, updateInterval: str, remote_dict: Optional[dict]
+    ) -> Optional[Subscription]:
+        if not isinstance(remote_dict, dict):
+            logging.error(f"获取{name}:{url}订阅失败")
+            return None
         remote_proxies: list[dict] = remote_dict.get("proxies", None)
         if remote_proxies is None:
             logging.error(f"获取{name}:{url}订阅失败")
             return None
         lastUpdate = timestamp()
-        new_config_file_list: list[File] = []
+        new_config_file_list = list(self._new_proxy_configs(name, url, remote_proxies))
+        return Subscription(name, url, updateInterval, lastUpdate, new_config_file_list)
+
+    def _new_subscription_stream(
+        self, name: str, url: str, updateInterval: str, max_bytes: int
+    ) -> Optional[Subscription]:
+        # 不放入事务: 事务会把所有节点配置留在内存中直到提交, 失去流式解析的意义
+        proxy_stream = ProxyStream(name, url, max_bytes=max_bytes)
+        lastUpdate = timestamp()
+        new_config_file_list = list(self._new_proxy_configs(name, url, proxy_stream))
+        if proxy_stream.result.error is not None:
+            logging.error(f"获取{name}:{url}订阅失败:{proxy_stream.result.error}")
+            for file in new_config_file_list:
+                if os.path.exists(file.path):
+                    os.remove(file.path)
+            return None
+        self.subscriptionCacheConfig.set_validators(name, url, proxy_stream.result)
+        return Subscription(name, url, updateInterval, lastUpdate, new_config_file_list)
+
+    def _new_proxy_configs(self, name: str, url: str, remote_proxies: Iterable[dict]) -> Iterator[File]:
+        for proxy in self._valid_proxies(name, url, remote_proxies):
+            new_config_file: File = self.new_proxy_config(**proxy)
+            if not new_config_file:
+                logging.error(f"创建{name}:{url}订阅中的{proxy['name']}配置文件失败")
+                continue
+            yield new_config_file
+
+    def _valid_proxies(self, name: str, url: str, remote_proxies: Iterable[dict]) -> Iterator[dict]:
         for proxy in remote_proxies:
             proxy_name = proxy.get("name", None)
             proxy_type = proxy.get("type", None)
@@ -268,12 +598,7 @@ class GlobalConfig(BaseConfig):
             if proxy_type not in ProxyType:
                 logging.error(f"{name}:{url}中包含, 不支持的代理类型:{proxy_type}")
                 continue
-            new_config_file: File = self.new_proxy_config(**proxy)
-            if not new_config_file:
-                logging.error(f"创建{name}:{url}订阅中的{proxy_name}配置文件失败")
-                continue
-            new_config_file_list.append(new_config_file)
-        return Subscription(name, url, updateInterval, lastUpdate, new_config_file_list)
+            yield proxy
 
     def new_proxy_config(self, **kwargs: dict) -> File | None:
         proxy_type = checkParam(kwargs, "type", str, None)
@@ -285,6 +610,15 @@ class GlobalConfig(BaseConfig):
             logging.error("缺少name字段")
             return None
         file_path = os.path.join(config_dir_path, f"{randomStr()}.yaml")
+        return self.write_proxy_config(file_path, **kwargs)
+
+    def write_proxy_config(self, file_path: str, **kwargs: dict) -> File | None:
+        proxy_type = checkParam(kwargs, "type", str, None)
+        name = checkParam(kwargs, "name", str, None)
+        if proxy_type is None or name is None:
+            logging.error("缺少type或name字段")
+            return None
+        key = node_key(kwargs)
         config = None
         match proxy_type:
             case "hysteria2":
@@ -304,6 +638,7 @@ class GlobalConfig(BaseConfig):
             name=name,
             type=proxy_type,
             path=os.path.abspath(file_path),
+            key=key,
         )
         return new_proxy_file
 
@@ -317,29 +652,103 @@ class GlobalConfig(BaseConfig):
             return None
 
     def sync_proxy_config(self, name: str, url: str, updateInterval: int) -> bool:
-        subscriptionConfig = self.subscriptionConfig.config["subscription"]
-        index: list = [
-            i
-            for i, sub in enumerate(subscriptionConfig, start=0)
-            if sub["name"] == name
-        ]
-        if not index:
-            logging.error(f"未找到{name}订阅")
-            return False
-        index = index[-1]
-        subscription: list = [sub for sub in subscriptionConfig if sub["name"] == name]
+        subscription = self.subscriptionConfig.get_subscription(name)
         if not subscription:
             logging.error(f"未找到{name}订阅")
             return False
-        subscription: dict = subscription[-1]
-        subscription: Subscription = Subscription(**subscription)
-        old_file_list: list[str] = [file['path'] for file in subscription.files]
-        old_file_list = [f for f in old_file_list if os.path.exists(f)]
-        new_subscription = self.new_subscription(subscription.name, url, updateInterval)
-        self.subscriptionConfig.update_subscription(name, new_subscription)
-        [os.remove(file) for file in old_file_list]
+        validators = self.subscriptionCacheConfig.get_validators(name, url)
+        result = fetch_remote_config(name, url, validators=validators)
+        return self._apply_fetch_result(subscription, url, updateInterval, result)
+
+    def _apply_fetch_result(
+        self, subscription: Subscription, url: str, updateInterval: str, result: FetchResult
+    ) -> bool:
+        if result.not_modified:
+            # 订阅内容未变化, 不重新生成节点配置; 服务端可能换了 ETag/Last-Modified, 仍需保存
+            logging.info(f"{subscription.name}订阅未变化, 跳过更新")
+            return self.subscriptionCacheConfig.set_validators(subscription.name, url, result)
+        try:
+            with ConfigTransaction():
+                new_subscription = self.merge_subscription(subscription, url, updateInterval, result.config)
+                if new_subscription is None:
+                    return False
+                self.subscriptionConfig.update_subscription(subscription.name, new_subscription)
+                self.subscriptionCacheConfig.set_validators(subscription.name, url, result)
+        except ConfigCommitError:
+            return False
         return True
 
+    def merge_subscription(
+        self, subscription: Subscription, url: str, updateInterval: str, remote_dict: Optional[dict]
+    ) -> Optional[Subscription]:
+        """增量同步: 只写入新增和变化的节点, 删除已移除的节点, 未变化的节点沿用原配置文件"""
+        name = subscription.name
+        if not isinstance(remote_dict, dict) or remote_dict.get("proxies", None) is None:
+            logging.error(f"获取{name}:{url}订阅失败")
+            return None
+        proxies = self._valid_proxies(name, url, remote_dict["proxies"])
+        diff: SubscriptionDiff = diff_proxies(subscription.files, proxies, exists=os.path.exists, key=node_key)
+        logging.info(f"{name}订阅同步: {diff}")
+        try:
+            with ConfigTransaction() as transaction:
+                new_file_list = self._apply_diff(name, url, diff, transaction)
+        except ConfigCommitError:
+            return None
+        return Subscription(name, url, updateInterval, timestamp(), new_file_list)
+
+    def _apply_diff(self, name: str, url: str, diff: SubscriptionDiff, transaction: ConfigTransaction) -> list[File]:
+        changed_files: list[Optional[File]] = []
+        for old_file, proxy, _ in diff.changed:
+            # 沿用旧路径, 正在运行的节点配置路径不会失效
+            new_file = self.write_proxy_config(old_file.path, **proxy)
+            if not new_file:
+                logging.error(f"更新{name}:{url}订阅中的{proxy['name']}配置文件失败")
+            changed_files.append(new_file)
+        added_files: list[Optional[File]] = []
+        for proxy, _ in diff.added:
+            new_file = self.new_proxy_config(**proxy)
+            if not new_file:
+                logging.error(f"创建{name}:{url}订阅中的{proxy['name']}配置文件失败")
+            added_files.append(new_file)
+        files = {"added": added_files, "changed": changed_files, "unchanged": diff.unchanged}
+        for file in diff.removed:
+            transaction.remove_file(file.path)
+        return [files[kind][i] for kind, i in diff.order if files[kind][i] is not None]
+
+    def refresh_all(self) -> dict[str, FetchResult]:
+        """并发拉取全部订阅后依次更新本地配置, 返回每个订阅的获取结果"""
+        subscriptions: dict[str, Subscription] = {
+            sub.name: sub for sub in self.subscriptionConfig.get_subscription_list()
+        }
+        start = time.perf_counter()
+        validators = {
+            name: self.subscriptionCacheConfig.get_validators(name, sub.url) for name, sub in subscriptions.items()
+        }
+        results = fetch_all({name: sub.url for name, sub in subscriptions.items()}, validators=validators)
+        # 所有订阅的修改在同一事务中提交, subscription.yaml 只写入一次
+        try:
+            with ConfigTransaction():
+                for name, result in results.items():
+                    subscription = subscriptions[name]
+                    if not result.ok and not result.not_modified:
+                        logging.error(f"刷新{name}订阅失败:{result.error}")
+                        continue
+                    self._apply_fetch_result(subscription, subscription.url, subscription.updateInterval, result)
+        except ConfigCommitError:
+            logging.error("刷新订阅后保存配置失败")
+        logging.info(f"刷新{len(results)}个订阅完成, 总耗时:{time.perf_counter() - start:.3f}s")
+        return results
+
+
+def init_config(config_dir: Optional[str] = None) -> Optional[GlobalConfig]:
+    """初始化配置目录、GlobalConfig 和 SettingReader, 图形界面与无界面模式共用"""
+    set_config_dir(config_dir or config_dir_path)
+    globalConfig = GlobalConfig.InitConfig()
+    if not SettingReader.InitConfig(config_file_path):
+        logging.error("config文件读取失败")
+        return None
+    return globalConfig
+
 
 def test():
     import logging
@@ -394,21 +803,12 @@ def test_start():
     # 示例命令
     cmd = [bin_path, "-c", config_path]
     hysteria2 = Hysteria2(cmd=cmd)
+    subscription = hysteria2.subscribe()
+    subscription.on_batch(lambda batch: logging.info(f"Received logs: {batch}"))
     hysteria2.start()
-    start_time = time.time()
-    while True:
-        try:
-            log_message = next(hysteria2.get_logs())
-            logging.info(f"Received log: {log_message}")
-        except StopIteration:
-            pass
-
-        # 检查是否需要停止
-        if time.time() - start_time > 10:
-            hysteria2.stop()
-            break
-
-        time.sleep(1)
+    time.sleep(10)
+    hysteria2.stop()
+    subscription.close()
 
 
 if __name__ == "__main__":
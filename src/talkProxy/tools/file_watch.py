@@ -0,0 +1,183 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+import threading
+from typing import Optional
+
+# inotify 事件掩码, 见 <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class StatWatcher:
+    """通过 mtime/ctime/size/inode 判断文件是否变化, 每次检查一次 stat
+
+    generation 为文件的变化代数, 使用者记录读取时的代数, 代数变化即说明文件已被修改
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._signatures: dict[str, tuple[Optional[tuple], int]] = {}
+
+    @staticmethod
+    def _signature(path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino
+
+    def watch(self, path: str) -> None:
+        pass
+
+    def live(self, _path: str) -> bool:
+        """检查文件是否变化需要访问磁盘, 调用者应自行限制检查频率"""
+        return False
+
+    def generation(self, path: str) -> int:
+        path = os.path.abspath(path)
+        signature = self._signature(path)
+        with self._lock:
+            old_signature, generation = self._signatures.get(path, (None, 0))
+            if path in self._signatures and old_signature == signature:
+                return generation
+            generation += 1
+            self._signatures[path] = (signature, generation)
+            return generation
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """基于 inotify 监听文件所在目录, 未收到事件时判断变化不产生任何磁盘访问
+
+    监听目录而不是文件本身, 这样临时文件 + rename 的原子替换也能被捕获
+    """
+
+    def __init__(self) -> None:
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._lock = threading.Lock()
+        self._dirs: dict[int, str] = {}
+        self._wds: dict[str, int] = {}
+        self._files: set[str] = set()
+        self._generations: dict[str, int] = {}
+        # 队列溢出或目录失效时整体递增, 所有文件都视为已变化
+        self._epoch = 0
+        # 无法监听目录的文件退化为 stat 检查
+        self._fallback = StatWatcher()
+
+    def watch(self, path: str) -> None:
+        path = os.path.abspath(path)
+        dir_path = os.path.dirname(path)
+        with self._lock:
+            self._files.add(path)
+            if dir_path in self._wds:
+                return
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), _WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                logging.debug(f"inotify 监听{dir_path}失败:{os.strerror(err)}")
+                return
+            self._wds[dir_path] = wd
+            self._dirs[wd] = dir_path
+
+    def live(self, path: str) -> bool:
+        """path 所在目录正被 inotify 监听时为 True, 此时检查变化只读取事件队列"""
+        with self._lock:
+            return os.path.dirname(os.path.abspath(path)) in self._wds
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    self._epoch += 1
+                    continue
+                dir_path = self._dirs.get(wd, None)
+                if dir_path is None:
+                    continue
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    # 目录本身失效, 重新监听前退化为 stat 检查
+                    self._epoch += 1
+                    if mask & IN_IGNORED:
+                        del self._dirs[wd]
+                        self._wds.pop(dir_path, None)
+                    continue
+                if not name:
+                    continue
+                # 只记录被监听的文件, 忽略同目录下的临时文件等
+                path = os.path.join(dir_path, os.fsdecode(name))
+                if path in self._files:
+                    self._generations[path] = self._generations.get(path, 0) + 1
+
+    def generation(self, path: str) -> int:
+        path = os.path.abspath(path)
+        with self._lock:
+            if os.path.dirname(path) not in self._wds:
+                # 与 inotify 代数区分开, 避免切换监听方式时代数恰好相同
+                return -self._fallback.generation(path)
+            self._drain()
+            return (self._epoch << 32) + self._generations.get(path, 0)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def get_watcher() -> "InotifyWatcher | StatWatcher":
+    """进程内共享的文件监听器, Linux 上使用 inotify, 其他平台使用 stat"""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            if sys.platform.startswith("linux"):
+                try:
+                    _watcher = InotifyWatcher()
+                except (OSError, AttributeError) as e:
+                    logging.debug(f"inotify 不可用, 使用 stat 检查文件变化:{e}")
+            if _watcher is None:
+                _watcher = StatWatcher()
+    return _watcher
@@ -0,0 +1,412 @@
+"""Prometheus 文本格式的指标与本地 /metrics 导出
+
+Counter 与 Histogram 每个线程只写自己的单元格, 热路径上的更新不加锁; 抓取时再加锁求和
+需要在抓取时才计算的指标(实例运行时间、系统吞吐等)通过 register_collector 注册
+"""
+
+import inspect
+import logging
+import math
+import threading
+import weakref
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, NamedTuple, Optional
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9464
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Family(NamedTuple):
+    """一个指标及其全部样本, samples 为 (名称后缀, 标签, 数值)"""
+
+    name: str
+    kind: str
+    help: str
+    samples: list[tuple[str, Labels, float]]
+
+
+class _Holder:
+    """放在 threading.local 中, 线程退出时随线程局部数据释放"""
+
+    __slots__ = ("cell", "__weakref__")
+
+    def __init__(self, cell: list[float]) -> None:
+        self.cell = cell
+
+
+class _Cells:
+    """按线程分开的累加单元格: 写入只修改当前线程的 list
+
+    线程退出时其 threading.local 数据被释放, _Holder 的 finalize 把数值并入 _retired;
+    不依赖 threading.enumerate(), 原生线程与 Qt 线程同样适用
+    """
+
+    def __init__(self, width: int) -> None:
+        self.width = width
+        self._local = threading.local()
+        self._cells: dict[int, list[float]] = {}
+        self._retired = [0.0] * width
+        self._next_key = 0
+        # finalize 可能在持锁的线程中因对象释放而触发, 使用可重入锁
+        self._lock = threading.RLock()
+
+    def cell(self) -> list[float]:
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = [0.0] * self.width
+            holder = _Holder(cell)
+            with self._lock:
+                key = self._next_key
+                self._next_key += 1
+                self._cells[key] = cell
+            weakref.finalize(holder, _Cells._retire, weakref.ref(self), key)
+            self._local.holder = holder
+            self._local.cell = cell
+        return cell
+
+    @staticmethod
+    def _retire(ref: "weakref.ref[_Cells]", key: int) -> None:
+        cells = ref()
+        if cells is None:
+            return
+        with cells._lock:
+            cell = cells._cells.pop(key, None)
+            if cell is not None:
+                for index, value in enumerate(cell):
+                    cells._retired[index] += value
+
+    def totals(self) -> list[float]:
+        with self._lock:
+            cells = [self._retired, *self._cells.values()]
+            return [sum(cell[index] for cell in cells) for index in range(self.width)]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), registry: Optional["Registry"] = None) -> None:  # noqa: A002
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        self._default = None if self.labelnames else self._new_child()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def labels(self, *values: str, **kwargs: str) -> object:
+        """取得某组标签值对应的子指标; 按位置传入字符串且已存在时只查一次 dict, 不加锁"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        child = self._children.get(values, None)
+        if child is None:
+            values = tuple(str(value) for value in values)
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}的标签应为{self.labelnames}:{values}")
+            with self._lock:
+                child = self._children.get(values, None)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _items(self) -> list[tuple[Labels, object]]:
+        if self._default is not None:
+            return [((), self._default)]
+        with self._lock:
+            children = list(self._children.items())
+        return [(tuple(zip(self.labelnames, values)), child) for values, child in children]
+
+    def collect(self) -> Family:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("_cells",)
+
+    def __init__(self) -> None:
+        self._cells = _Cells(1)
+
+    def inc(self, amount: float = 1) -> None:
+        if amount < 0:
+            raise ValueError(f"计数只能增加:{amount}")
+        self._cells.cell()[0] += amount
+
+    def value(self) -> float:
+        return self._cells.totals()[0]
+
+
+class Counter(_Metric):
+    """只增不减的计数, 名称应以 _total 结尾"""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+    def value(self) -> float:
+        return self._default.value()
+
+    def collect(self) -> Family:
+        return Family(self.name, self.kind, self.help, [("", labels, child.value()) for labels, child in self._items()])
+
+
+class _GaugeChild:
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge(_Metric):
+    """可增可减的数值; set 直接赋值, inc/dec 不在热路径上, 使用锁"""
+
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default.dec(amount)
+
+    def value(self) -> float:
+        return self._default.value()
+
+    def collect(self) -> Family:
+        return Family(self.name, self.kind, self.help, [("", labels, child.value()) for labels, child in self._items()])
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "_cells")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        # 各桶(含 +Inf)的非累计计数, 最后一格为总和
+        self._cells = _Cells(len(bounds) + 2)
+
+    def observe(self, value: float) -> None:
+        cell = self._cells.cell()
+        cell[bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def totals(self) -> tuple[list[float], float, float]:
+        """(累计的桶计数, 总和, 样本数)"""
+        totals = self._cells.totals()
+        buckets, running = [], 0.0
+        for count in totals[:-1]:
+            running += count
+            buckets.append(running)
+        return buckets, totals[-1], running
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,  # noqa: A002
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        self.bounds = tuple(sorted(float(bound) for bound in buckets if not math.isinf(bound)))
+        if not self.bounds:
+            raise ValueError(f"{name}至少需要一个有限的桶边界")
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def totals(self) -> tuple[list[float], float, float]:
+        return self._default.totals()
+
+    def collect(self) -> Family:
+        samples = []
+        for labels, child in self._items():
+            buckets, total, count = child.totals()
+            for bound, value in zip((*self.bounds, math.inf), buckets):
+                samples.append(("_bucket", (*labels, ("le", _format_value(bound))), value))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return Family(self.name, self.kind, self.help, samples)
+
+
+Collector = Callable[[], Iterable[Family]]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], Optional[Collector]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标已存在:{metric.name}")
+            self._metrics[metric.name] = metric
+
+    def register_collector(self, collector: Collector) -> None:
+        """抓取时调用 collector 取得指标; 绑定方法只保存弱引用, 对象回收后自动移除"""
+        ref = weakref.WeakMethod(collector) if inspect.ismethod(collector) else (lambda: collector)
+        with self._lock:
+            self._collectors.append(ref)
+
+    def unregister_collector(self, collector: Collector) -> None:
+        with self._lock:
+            self._collectors = [ref for ref in self._collectors if ref() not in (None, collector)]
+
+    def collect(self) -> list[Family]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = [collector for collector in (ref() for ref in self._collectors) if collector is not None]
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logging.error(f"收集指标失败:{e}")
+        return families
+
+    def render(self) -> str:
+        return render(self.collect())
+
+
+REGISTRY = Registry()
+
+
+def register_collector(collector: Collector) -> None:
+    REGISTRY.register_collector(collector)
+
+
+def unregister_collector(collector: Collector) -> None:
+    REGISTRY.unregister_collector(collector)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+
+def render(families: Iterable[Family]) -> str:
+    """Prometheus 文本格式 0.0.4, 同名的指标合并输出"""
+    merged: dict[str, Family] = {}
+    for family in families:
+        if family.name in merged:
+            merged[family.name].samples.extend(family.samples)
+        else:
+            merged[family.name] = Family(family.name, family.kind, family.help, list(family.samples))
+    lines = []
+    for family in merged.values():
+        lines.append(f"# HELP {family.name} {_escape_help(family.help)}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for suffix, labels, value in family.samples:
+            label_text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels)
+            lines.append(f"{family.name}{suffix}{{{label_text}}} {_format_value(value)}" if labels else f"{family.name}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body = self.registry.render().encode("utf-8")
+        except Exception as e:
+            logging.error(f"生成指标失败:{e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        logging.debug(f"指标请求:{self.address_string()} {format % args}")
+
+
+class MetricsServer:
+    """在后台线程提供 /metrics, 默认只监听本机"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, registry: Optional[Registry] = None) -> None:
+        handler = type("MetricsHandler", (_Handler,), {"registry": REGISTRY if registry is None else registry})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        logging.info(f"指标导出已启动:http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+
+def start_exporter(port: int = DEFAULT_PORT, host: str = DEFAULT_HOST) -> Optional[MetricsServer]:
+    """启动导出服务, 端口被占用等错误时记录日志并返回 None"""
+    try:
+        server = MetricsServer(host, port)
+    except OSError as e:
+        logging.error(f"启动指标导出失败:{e}")
+        return None
+    server.start()
+    return server
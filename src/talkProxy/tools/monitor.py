@@ -1,10 +1,28 @@
-import datetime
+import logging
+import threading
 import time
+from array import array
+from bisect import bisect_left
+from typing import Any, Callable, Iterator, Optional
+
 import psutil
-from psutil._common import scpufreq
+
+try:
+    from psutil._common import scpufreq
+except ImportError:
+    # psutil 7 把具名元组移到了 _ntuples
+    from psutil._ntuples import scpufreq
+
+from talkProxy.tools.common import percentile
+from talkProxy.tools.metrics import Family, register_collector
+
+# 默认保留 1 小时的 1 秒采样
+SAMPLE_CAPACITY = 3600
+# 后台采样间隔(秒)
+SAMPLE_INTERVAL = 1.0
 
 class CPU_info:
-    def __init__(self: "CPU_info", cores_num: float, frequency: scpufreq, cpu_precent: float, cpu_avgload: tuple[float,float,float]) -> None:
+    def __init__(self: "CPU_info", cores_num: float, frequency: scpufreq, cpu_precent: Optional[float], cpu_avgload: tuple[float,float,float]) -> None:
         self.cores_num = cores_num
         self.frequency = frequency
         self.cpu_precent = cpu_precent
@@ -31,7 +49,7 @@ class Net_info:
         self.latest_timestamp = None
         self.bytes_sent = bytes_sent
         self.bytes_recv = bytes_recv
-        self.timestamp = datetime.datetime.now().timestamp()
+        self.timestamp = time.monotonic()
     
     def update(self: "Net_info"):
         self.latest_bytes_recv = self.bytes_recv
@@ -40,7 +58,7 @@ class Net_info:
         record = psutil.net_io_counters(pernic=False)
         self.bytes_sent = record.bytes_sent
         self.bytes_recv = record.bytes_recv
-        self.timestamp = datetime.datetime.now().timestamp()
+        self.timestamp = time.monotonic()
         
     def avg_speed(self: "Net_info") -> tuple[float, float]:
         time_diff = self.timestamp - self.latest_timestamp
@@ -57,7 +75,7 @@ class Net_info:
                 case value if value < 1024**4:
                     return f"{value/1024**3}GB/s"
                 case _:
-                    return f"{value/1024*4}GB/s"
+                    return f"{value/1024**4}TB/s"
 
         return {"sent":calculate_unit(speed_sent), "recv":calculate_unit(speed_recv)}
         
@@ -75,17 +93,402 @@ class Net_info:
     def __repr__(self: "Net_info") -> str:
         return f"Net_info({self.latest_bytes_sent}, {self.latest_bytes_recv}, {self.bytes_sent}, {self.bytes_recv})"
 
+def _rates(times: array, values: array) -> tuple[list[float], list[float]]:
+    pairs = [
+        (end, (high - low) / (end - begin))
+        for begin, end, low, high in zip(times, times[1:], values, values[1:])
+        if end > begin
+    ]
+    return [point for point, _ in pairs], [speed for _, speed in pairs]
+
+
+class RingBuffer:
+    """固定容量的时间序列, 时间与数值存放在预先分配的 array('d') 中
+
+    追加为 O(1), 时间单调递增, 按时间窗口定位用 bisect 在两段有序区间上查找, 为 O(log n)
+    """
+
+    def __init__(self: "RingBuffer", capacity: int = SAMPLE_CAPACITY) -> None:
+        if capacity <= 0:
+            raise ValueError(f"容量必须大于 0:{capacity}")
+        self.capacity = capacity
+        self._times = array("d", bytes(8 * capacity))
+        self._values = array("d", bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self: "RingBuffer") -> int:
+        return self._count
+
+    def append(self: "RingBuffer", timestamp: float, value: float) -> None:
+        self._times[self._next] = timestamp
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def latest(self: "RingBuffer") -> Optional[tuple[float, float]]:
+        if not self._count:
+            return None
+        index = self._next - 1
+        return self._times[index], self._values[index]
+
+    def _locate(self: "RingBuffer", timestamp: float) -> int:
+        """第一个时间不早于 timestamp 的样本在逻辑顺序中的位置"""
+        start = (self._next - self._count) % self.capacity
+        if start + self._count <= self.capacity:
+            return bisect_left(self._times, timestamp, start, start + self._count) - start
+        if timestamp > self._times[self.capacity - 1]:
+            return self.capacity - start + bisect_left(self._times, timestamp, 0, self._next)
+        return bisect_left(self._times, timestamp, start, self.capacity) - start
+
+    def _slice(self: "RingBuffer", data: array, first: int) -> array:
+        start = (self._next - self._count + first) % self.capacity
+        end = start + self._count - first
+        if end <= self.capacity:
+            return data[start:end]
+        return data[start:] + data[: end - self.capacity]
+
+    def window(self: "RingBuffer", seconds: Optional[float] = None, now: Optional[float] = None) -> tuple[array, array]:
+        """最近 seconds 秒内的 (时间, 数值), seconds 为 None 时返回全部"""
+        first = 0
+        if seconds is not None and self._count:
+            first = self._locate((time.monotonic() if now is None else now) - seconds)
+        return self._slice(self._times, first), self._slice(self._values, first)
+
+    def rate(self: "RingBuffer", seconds: Optional[float] = None, now: Optional[float] = None) -> Optional[float]:
+        """累计计数在窗口内的平均速率(每秒), 只读取首尾两个样本, 样本不足两个时返回 None"""
+        first = 0
+        if seconds is not None and self._count:
+            first = self._locate((time.monotonic() if now is None else now) - seconds)
+        if self._count - first < 2:
+            return None
+        head = (self._next - self._count + first) % self.capacity
+        tail = self._next - 1
+        elapsed = self._times[tail] - self._times[head]
+        if elapsed <= 0:
+            return None
+        return (self._values[tail] - self._values[head]) / elapsed
+
+    def rates(self: "RingBuffer", seconds: Optional[float] = None, now: Optional[float] = None) -> tuple[list[float], list[float]]:
+        """累计计数相邻样本间的速率, 返回 (区间结束时间, 速率), 用于绘图"""
+        return _rates(*self.window(seconds, now))
+
+    def percentile(self: "RingBuffer", p: float, seconds: Optional[float] = None, now: Optional[float] = None) -> Optional[float]:
+        return percentile(self.window(seconds, now)[1].tolist(), p)
+
+
+class MetricsSampler:
+    """把 CPU、内存、各网卡与各子进程的 I/O 记录到环形缓冲中, 时间使用单调时钟
+
+    序列名:
+    cpu.percent, memory.percent, memory.used
+    net.<网卡>.sent, net.<网卡>.recv, net.sent, net.recv
+    process.<实例名>.read, process.<实例名>.write
+
+    net.* 与 process.* 为累计字节数, 计数回绕或进程重启后会接续之前的值, 速率用 rate() 查询
+    """
+
+    def __init__(self: "MetricsSampler", capacity: int = SAMPLE_CAPACITY, pids: Optional[Callable[[], dict[str, int]]] = None) -> None:
+        if capacity <= 0:
+            raise ValueError(f"容量必须大于 0:{capacity}")
+        self.capacity = capacity
+        self.pids = pids
+        self._series: dict[str, RingBuffer] = {}
+        # 序列名 -> (上次的原始值, 累加的偏移)
+        self._counters: dict[str, tuple[float, float]] = {}
+        # 网卡名 -> 修正后的 (发送, 接收), 消失的网卡保留最后的值, 总量不会因此回退
+        self._nics: dict[str, tuple[float, float]] = {}
+        self._processes: dict[int, psutil.Process] = {}
+        self._lock = threading.Lock()
+        # 首次调用 cpu_percent(interval=None) 只建立基准, 第一次采样不记录 CPU
+        self._cpu_baseline = False
+
+    def _record(self: "MetricsSampler", name: str, timestamp: float, value: float) -> None:
+        series = self._series.get(name, None)
+        if series is None:
+            series = self._series[name] = RingBuffer(self.capacity)
+        series.append(timestamp, value)
+
+    def _record_counter(self: "MetricsSampler", name: str, timestamp: float, raw: float) -> float:
+        """记录累计计数, 返回修正回绕后的值"""
+        last, offset = self._counters.get(name, (0, 0))
+        if raw < last:
+            offset += last
+        self._counters[name] = (raw, offset)
+        self._record(name, timestamp, raw + offset)
+        return raw + offset
+
+    def _process_io(self: "MetricsSampler") -> dict[str, tuple[int, int]]:
+        """实例名 -> (读字节, 写字节); Linux 上使用包含套接字收发的 read_chars/write_chars"""
+        if self.pids is None:
+            return {}
+        result = {}
+        current = self.pids()
+        for pid in list(self._processes):
+            if pid not in current.values():
+                del self._processes[pid]
+        for owner, pid in current.items():
+            process = self._processes.get(pid, None)
+            try:
+                if process is None:
+                    process = self._processes[pid] = psutil.Process(pid)
+                counters = process.io_counters()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                self._processes.pop(pid, None)
+                continue
+            except AttributeError:
+                # macOS 上没有 io_counters
+                return {}
+            result[owner] = (
+                getattr(counters, "read_chars", counters.read_bytes),
+                getattr(counters, "write_chars", counters.write_bytes),
+            )
+        return result
+
+    def sample(self: "MetricsSampler", now: Optional[float] = None) -> tuple[Optional[float], Any]:
+        """采样一次, 不阻塞; 返回本次读取的 (CPU 占用, virtual_memory()), 第一次采样的 CPU 占用为 None"""
+        timestamp = time.monotonic() if now is None else now
+        cpu = psutil.cpu_percent(interval=None)
+        if not self._cpu_baseline:
+            self._cpu_baseline = True
+            cpu = None
+        memory = psutil.virtual_memory()
+        nics = psutil.net_io_counters(pernic=True)
+        processes = self._process_io()
+        with self._lock:
+            if cpu is not None:
+                self._record("cpu.percent", timestamp, cpu)
+            self._record("memory.percent", timestamp, memory.percent)
+            self._record("memory.used", timestamp, memory.used)
+            for nic, counters in nics.items():
+                self._nics[nic] = (
+                    self._record_counter(f"net.{nic}.sent", timestamp, counters.bytes_sent),
+                    self._record_counter(f"net.{nic}.recv", timestamp, counters.bytes_recv),
+                )
+            # 总量由各网卡修正后的值求和, 网卡消失或单个网卡计数回绕都不会产生虚假的峰值
+            self._record("net.sent", timestamp, sum(sent for sent, _ in self._nics.values()))
+            self._record("net.recv", timestamp, sum(recv for _, recv in self._nics.values()))
+            for owner, (read, write) in processes.items():
+                self._record_counter(f"process.{owner}.read", timestamp, read)
+                self._record_counter(f"process.{owner}.write", timestamp, write)
+        return cpu, memory
+
+    def names(self: "MetricsSampler") -> list[str]:
+        with self._lock:
+            return list(self._series)
+
+    def latest(self: "MetricsSampler", name: str) -> Optional[float]:
+        with self._lock:
+            series = self._series.get(name, None)
+            point = series.latest() if series is not None else None
+        return point[1] if point is not None else None
+
+    def window(self: "MetricsSampler", name: str, seconds: Optional[float] = None, now: Optional[float] = None) -> tuple[list[float], list[float]]:
+        """绘图用的 (时间, 数值), 没有该序列时返回空列表"""
+        with self._lock:
+            series = self._series.get(name, None)
+            if series is None:
+                return [], []
+            times, values = series.window(seconds, now)
+        return times.tolist(), values.tolist()
+
+    def rates(self: "MetricsSampler", name: str, seconds: Optional[float] = None, now: Optional[float] = None) -> tuple[list[float], list[float]]:
+        with self._lock:
+            series = self._series.get(name, None)
+            if series is None:
+                return [], []
+            times, values = series.window(seconds, now)
+        return _rates(times, values)
+
+    def rate(self: "MetricsSampler", name: str, seconds: Optional[float] = None, now: Optional[float] = None) -> Optional[float]:
+        with self._lock:
+            series = self._series.get(name, None)
+            return series.rate(seconds, now) if series is not None else None
+
+    def percentile(self: "MetricsSampler", name: str, p: float, seconds: Optional[float] = None, now: Optional[float] = None, rate: bool = False) -> Optional[float]:
+        """窗口内数值的百分位数, rate 为 True 时对相邻样本间的速率计算"""
+        if rate:
+            return percentile(self.rates(name, seconds, now)[1], p)
+        return percentile(self.window(name, seconds, now)[1], p)
+
+
+class MetricsSnapshot:
+    """某一时刻的系统指标, 由 MetricsService 在后台线程生成, 创建后不再修改"""
+
+    def __init__(self: "MetricsSnapshot", timestamp: float, cpu: CPU_info, memory: Any, net_sent: Optional[float], net_recv: Optional[float]) -> None:
+        # time.monotonic()
+        self.timestamp = timestamp
+        self.cpu = cpu
+        self.memory = memory
+        # 最近一个采样间隔的速率(字节/秒), 只有一次采样时为 None
+        self.net_sent = net_sent
+        self.net_recv = net_recv
+
+    def __dict__(self: "MetricsSnapshot") -> dict[str, any]:
+        return {
+            "timestamp": self.timestamp,
+            "cpu": self.cpu.__dict__(),
+            "memory": self.memory._asdict(),
+            "net_sent": self.net_sent,
+            "net_recv": self.net_recv
+        }
+
+    def __str__(self: "MetricsSnapshot") -> str:
+        return str(self.__dict__())
+
+    def __repr__(self: "MetricsSnapshot") -> str:
+        return f"MetricsSnapshot({self.timestamp}, {self.cpu!r}, {self.memory}, {self.net_sent}, {self.net_recv})"
+
+
+class MetricsService:
+    """在后台线程按 interval 采样, 发布最新的 MetricsSnapshot 并写入 sampler 的历史
+
+    读取方直接取已发布的快照, 不睡眠也不调用 psutil; 快照整体替换, 读取不需要加锁
+    """
+
+    def __init__(self: "MetricsService", interval: float = SAMPLE_INTERVAL, capacity: int = SAMPLE_CAPACITY, pids: Optional[Callable[[], dict[str, int]]] = None) -> None:
+        if interval <= 0:
+            raise ValueError(f"采样间隔必须大于 0:{interval}")
+        self.interval = interval
+        self.sampler = MetricsSampler(capacity, pids)
+        # 物理核心数不会变化, 只读取一次
+        self.cores_num = psutil.cpu_count(logical=False)
+        self._snapshot: Optional[MetricsSnapshot] = None
+        self._listeners: list[Callable[[MetricsSnapshot], None]] = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_listener(self: "MetricsService", listener: Callable[[MetricsSnapshot], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self: "MetricsService", listener: Callable[[MetricsSnapshot], None]) -> None:
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def set_interval(self: "MetricsService", interval: float) -> None:
+        """修改采样间隔, 从下一次采样开始生效"""
+        if interval <= 0:
+            raise ValueError(f"采样间隔必须大于 0:{interval}")
+        self.interval = interval
+
+    def refresh(self: "MetricsService") -> MetricsSnapshot:
+        """立即采样一次并发布, 通知监听者"""
+        now = time.monotonic()
+        cpu_precent, memory = self.sampler.sample(now)
+        try:
+            frequency = psutil.cpu_freq()
+        except (NotImplementedError, OSError):
+            frequency = None
+        try:
+            cpu_avgload = psutil.getloadavg()
+        except (AttributeError, OSError):
+            cpu_avgload = None
+        window = self.interval * 1.5
+        snapshot = MetricsSnapshot(
+            now,
+            CPU_info(self.cores_num, frequency, cpu_precent, cpu_avgload),
+            memory,
+            self.sampler.rate("net.sent", window, now),
+            self.sampler.rate("net.recv", window, now),
+        )
+        self._snapshot = snapshot
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logging.error(f"指标监听者出错:{e}")
+        return snapshot
+
+    def snapshot(self: "MetricsService") -> MetricsSnapshot:
+        """最新的快照; 未启动且尚未采样时立即采样一次(不阻塞)"""
+        snapshot = self._snapshot
+        return snapshot if snapshot is not None else self.refresh()
+
+    def _loop(self: "MetricsService") -> None:
+        delay = self.interval
+        while not self._stop_event.wait(delay):
+            start = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"采样系统指标失败:{e}")
+            delay = max(self.interval - (time.monotonic() - start), 0)
+
+    def start(self: "MetricsService") -> None:
+        """先在当前线程采样一次, 保证启动后总有快照可读, 之后由后台线程按间隔采样"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self._snapshot is None:
+            self.refresh()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="metrics-service", daemon=True)
+        self._thread.start()
+
+    def stop(self: "MetricsService") -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+_service: Optional[MetricsService] = None
+_service_lock = threading.Lock()
+
+
+def get_metrics_service() -> MetricsService:
+    """进程内共享的指标服务, 首次调用时启动后台采样"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = MetricsService()
+            _service.start()
+    return _service
+
+
+def _collect_metrics() -> Iterator[Family]:
+    """导出后台服务最近一次采样的吞吐计数, 服务未启动时不输出"""
+    service = _service
+    if service is None:
+        return
+    sampler = service.sampler
+    cpu, memory = sampler.latest("cpu.percent"), sampler.latest("memory.used")
+    if cpu is not None:
+        yield Family("talkproxy_system_cpu_percent", "gauge", "系统 CPU 占用百分比", [("", (), cpu)])
+    if memory is not None:
+        yield Family("talkproxy_system_memory_used_bytes", "gauge", "系统已用内存字节数", [("", (), memory)])
+    network, processes = [], []
+    for name in sampler.names():
+        kind, _, rest = name.partition(".")
+        owner, _, direction = rest.rpartition(".")
+        if kind not in ("net", "process") or not owner:
+            continue
+        value = sampler.latest(name)
+        if kind == "net":
+            network.append(("", (("nic", owner), ("direction", direction)), value))
+        else:
+            processes.append(("", (("instance", owner), ("direction", direction)), value))
+    yield Family("talkproxy_network_bytes_total", "counter", "各网卡累计收发的字节数, direction 为 sent/recv", network)
+    yield Family("talkproxy_instance_io_bytes_total", "counter", "各实例子进程累计读写的字节数, direction 为 read/write", processes)
+
+
+register_collector(_collect_metrics)
+
+
 def get_cpu_info(averge:bool=False):
-    cores_num = psutil.cpu_count(logical=False)
-    frequency = psutil.cpu_freq()
-    cpu_precent = psutil.cpu_percent(interval=1)
-    cpu_avgload = None
+    """不阻塞, 返回后台服务最近一次采样的结果; 服务启动后第一个采样间隔内 cpu_precent 为 None"""
+    cpu = get_metrics_service().snapshot().cpu
     if averge:
-        cpu_avgload = psutil.getloadavg()
-    return CPU_info(cores_num, frequency, cpu_precent, cpu_avgload)
+        return cpu
+    return CPU_info(cpu.cores_num, cpu.frequency, cpu.cpu_precent, None)
 
-def get_cpu_precent() -> float:
-    return psutil.cpu_percent(interval=1)
+def get_cpu_precent() -> Optional[float]:
+    """不阻塞, 返回后台服务最近一次采样的 CPU 占用; 第一次采样只建立基准, 此时为 None"""
+    return get_metrics_service().snapshot().cpu.cpu_precent
 
 def get_memory_info():
     return psutil.virtual_memory()
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+import yaml
+
+from . import yaml_backend
+from .config import File
+from .metrics import Counter, Histogram
+
+# 同时进行的探测数上限
+PROBE_CONCURRENCY = 128
+PROBE_TIMEOUT = 2.0
+# 探测结果缓存时间(秒), 失败结果缓存较短时间以便尽快重试
+PROBE_TTL = 300.0
+PROBE_ERROR_TTL = 30.0
+DEFAULT_PORT = 443
+# QUIC 要求客户端首包至少 1200 字节, 否则服务端直接丢弃
+QUIC_PACKET_SIZE = 1200
+# RFC 9000 保留的版本号 0x?a?a?a?a, 服务端收到后应回复版本协商包
+QUIC_GREASE_VERSION = b"\x1a\x2a\x3a\x4a"
+
+PROBE_SECONDS = Histogram(
+    "talkproxy_probe_latency_seconds",
+    "节点探测成功时的延迟",
+    ["method"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0),
+)
+PROBE_FAILURES = Counter("talkproxy_probe_failures_total", "节点探测失败次数", ["method", "reason"])
+
+Prober = Callable[[str, int, float], Awaitable[float]]
+
+
+class ProbeResult:
+    def __init__(
+        self,
+        name: str,
+        host: Optional[str],
+        port: Optional[int],
+        method: str,
+        latency: Optional[float] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        self.name = name
+        self.host = host
+        self.port = port
+        self.method = method
+        # 秒, 失败时为 None
+        self.latency = latency
+        self.error = error
+        self.checked_at = time.monotonic()
+
+    @property
+    def ok(self) -> bool:
+        return self.latency is not None
+
+    def __dict__(self) -> dict[str, any]:
+        return {
+            "name": self.name,
+            "host": self.host,
+            "port": self.port,
+            "method": self.method,
+            "latency": None if self.latency is None else round(self.latency * 1000, 1),
+            "error": self.error,
+        }
+
+    def to_dict(self) -> dict[str, any]:
+        return self.__dict__()
+
+    def __repr__(self) -> str:
+        if self.ok:
+            return f"ProbeResult({self.name}, {self.method}, {self.latency * 1000:.1f}ms)"
+        return f"ProbeResult({self.name}, {self.method}, error:{self.error})"
+
+
+def parse_server(server: str, default_port: int = DEFAULT_PORT) -> tuple[str, int]:
+    """解析节点 server 字段, 支持 [ipv6]:port 以及端口跳跃的 host:1000-2000,3000 写法(取第一个端口)"""
+    server = server.strip()
+    if server.startswith("["):
+        host, _, rest = server[1:].partition("]")
+        ports = rest.lstrip(":")
+    elif server.count(":") == 1:
+        host, ports = server.split(":")
+    else:
+        # 不带端口的主机名或 IPv6 地址
+        host, ports = server, ""
+    port = ports.split(",")[0].split("-")[0]
+    return host, int(port) if port.isdigit() else default_port
+
+
+def node_server(node: File) -> Optional[tuple[str, int]]:
+    # 节点配置不使用 marshal 缓存
+    try:
+        config = yaml_backend.load_file(node.path, use_cache=False)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        logging.error(f"读取节点配置失败:{e}")
+        return None
+    if not isinstance(config, dict):
+        return None
+    server = config.get("server", None)
+    if not isinstance(server, str) or not server:
+        return None
+    port = config.get("port", None)
+    return parse_server(server, port if isinstance(port, int) else DEFAULT_PORT)
+
+
+def quic_probe_packet() -> bytes:
+    """带保留版本号的 QUIC 长包头, hysteria2 服务端(quic-go)会立即回复版本协商包"""
+    header = bytes([0xC0]) + QUIC_GREASE_VERSION + b"\x08" + os.urandom(8) + b"\x08" + os.urandom(8)
+    return header + b"\x00" * (QUIC_PACKET_SIZE - len(header))
+
+
+async def tcp_probe(host: str, port: int, timeout: float) -> float:
+    """TCP 三次握手耗时"""
+    start = time.perf_counter()
+    _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    latency = time.perf_counter() - start
+    writer.close()
+    return latency
+
+
+class _DatagramReply(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        self.reply: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, _data: bytes, _addr: tuple) -> None:
+        if not self.reply.done():
+            self.reply.set_result(time.perf_counter())
+
+    def error_received(self, exc: Exception) -> None:
+        if not self.reply.done():
+            self.reply.set_exception(exc)
+
+
+async def udp_probe(host: str, port: int, timeout: float, payload: Optional[bytes] = None) -> float:
+    """发送一个 UDP 包到收到任意回复的耗时, 默认发送 QUIC 版本协商探测包"""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(_DatagramReply, remote_addr=(host, port))
+    try:
+        start = time.perf_counter()
+        transport.sendto(quic_probe_packet() if payload is None else payload)
+        end = await asyncio.wait_for(protocol.reply, timeout)
+        return end - start
+    finally:
+        transport.close()
+
+
+PROBES: dict[str, Prober] = {"tcp": tcp_probe, "udp": udp_probe}
+
+
+class LatencyProber:
+    """并发探测节点延迟, 结果按 节点名/地址/方式 缓存 ttl 秒"""
+
+    def __init__(
+        self,
+        method: str = "udp",
+        concurrency: int = PROBE_CONCURRENCY,
+        timeout: float = PROBE_TIMEOUT,
+        ttl: float = PROBE_TTL,
+        error_ttl: float = PROBE_ERROR_TTL,
+        probe: Optional[Prober] = None,
+    ) -> None:
+        if probe is None and method not in PROBES:
+            raise ValueError(f"不支持的探测方式:{method}")
+        self.method = method
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.probe = probe or PROBES[method]
+        self._lock = threading.Lock()
+        self._cache: dict[tuple[str, str, int, str], ProbeResult] = {}
+
+    def _cached(self, key: tuple) -> Optional[ProbeResult]:
+        with self._lock:
+            result = self._cache.get(key, None)
+        if result is None:
+            return None
+        ttl = self.ttl if result.ok else self.error_ttl
+        if time.monotonic() - result.checked_at >= ttl:
+            return None
+        return result
+
+    def get_cached(self, node: File) -> Optional[ProbeResult]:
+        server = node_server(node)
+        if server is None:
+            return None
+        return self._cached((node.name, *server, self.method))
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+                return
+            for key in [key for key in self._cache if key[0] == name]:
+                del self._cache[key]
+
+    async def _resolve(self, host: str, resolved: dict[str, asyncio.Future]) -> str:
+        """同一轮探测中相同主机只解析一次, 解析时间不计入延迟; 经共享的解析服务缓存"""
+        from .resolver import get_resolver
+
+        future = resolved.get(host)
+        if future is None:
+            future = asyncio.ensure_future(get_resolver().aresolve(host))
+            resolved[host] = future
+        addresses = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        return addresses[0]
+
+    async def _probe_one(
+        self, node: File, host: str, port: int, semaphore: asyncio.Semaphore, resolved: dict
+    ) -> ProbeResult:
+        async with semaphore:
+            try:
+                address = await self._resolve(host, resolved)
+                latency = await self.probe(address, port, self.timeout)
+                result = ProbeResult(node.name, host, port, self.method, latency)
+                PROBE_SECONDS.labels(self.method).observe(latency)
+            except asyncio.TimeoutError:
+                result = ProbeResult(node.name, host, port, self.method, error="timeout")
+                PROBE_FAILURES.labels(self.method, "timeout").inc()
+            except OSError as e:
+                result = ProbeResult(node.name, host, port, self.method, error=e.strerror or str(e))
+                PROBE_FAILURES.labels(self.method, "error").inc()
+        with self._lock:
+            self._cache[(node.name, host, port, self.method)] = result
+        return result
+
+    async def probe_nodes(self, nodes: Iterable[File], force: bool = False) -> dict[str, ProbeResult]:
+        """探测全部节点, force 为 False 时未过期的缓存结果直接返回"""
+        results: dict[str, ProbeResult] = {}
+        tasks = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        resolved: dict[str, asyncio.Future] = {}
+        for node in nodes:
+            server = node_server(node)
+            if server is None:
+                results[node.name] = ProbeResult(node.name, None, None, self.method, error="节点配置中没有 server")
+                continue
+            cached = None if force else self._cached((node.name, *server, self.method))
+            if cached is not None:
+                results[node.name] = cached
+                continue
+            tasks.append(asyncio.ensure_future(self._probe_one(node, *server, semaphore, resolved)))
+        for result in await asyncio.gather(*tasks):
+            results[result.name] = result
+        return results
+
+    def probe_all(self, nodes: Iterable[File], force: bool = False) -> dict[str, ProbeResult]:
+        """同步接口, 在新的事件循环中运行 probe_nodes"""
+        return asyncio.run(self.probe_nodes(nodes, force))
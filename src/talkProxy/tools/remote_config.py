@@ -1,14 +1,284 @@
+import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+
 import requests
 import yaml
+from requests.adapters import HTTPAdapter
+
+from . import yaml_backend
+from .metrics import Counter, Histogram
+from .yaml_stream import ChunkStream, NotSubscription, StreamTooLarge, iter_proxies
+
+REQUEST_TIMEOUT = 10
+# 线程池与连接池大小
+MAX_WORKERS = 8
+POOL_CONNECTIONS = 16
+# 同一主机的最大并发请求数
+PER_HOST_LIMIT = 4
+# 流式解析时单个订阅的最大字节数
+MAX_SUBSCRIPTION_SIZE = 64 * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+FETCH_SECONDS = Histogram(
+    "talkproxy_subscription_fetch_seconds",
+    "获取订阅的耗时, result 为 ok/not_modified/error",
+    ["result"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+FETCH_BYTES = Counter("talkproxy_subscription_fetch_bytes_total", "获取订阅下载的字节数")
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """获取共享的 keep-alive 会话, 所有订阅复用同一个连接池"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=max(MAX_WORKERS, PER_HOST_LIMIT))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+class FetchResult:
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        config: Optional[dict] = None,
+        status_code: Optional[int] = None,
+        elapsed: float = 0.0,
+        size: int = 0,
+        error: Optional[str] = None,
+    ) -> None:
+        self.name = name
+        self.url = url
+        self.config = config
+        self.status_code = status_code
+        self.elapsed = elapsed
+        self.size = size
+        self.error = error
+        # 条件请求相关: 服务端返回 304 或内容哈希未变化时 not_modified 为 True
+        self.not_modified = False
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.content_hash: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.config is not None
+
+    def __dict__(self) -> dict[str, any]:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "status_code": self.status_code,
+            "elapsed": self.elapsed,
+            "size": self.size,
+            "error": self.error,
+            "not_modified": self.not_modified,
+        }
+
+    def validators(self) -> dict[str, str]:
+        return {"etag": self.etag, "lastModified": self.last_modified, "hash": self.content_hash}
+
+    def to_dict(self) -> dict[str, any]:
+        return self.__dict__()
+
+    def __repr__(self) -> str:
+        return f"FetchResult({self.name}, {self.status_code}, {self.elapsed:.3f}s, {self.size}B)"
+
+
+class _HostLimiter:
+    """按主机限制并发数"""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+
+    def get(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.limit)
+                self._semaphores[host] = semaphore
+        return semaphore
+
 
-def get_remote_config(url:str)-> dict| None:
-    remote_config = requests.get(url, timeout=10)
-    if remote_config.status_code != 200:
-        return None
+def conditional_headers(validators: Optional[dict]) -> dict[str, str]:
+    headers = {}
+    if not validators:
+        return headers
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("lastModified"):
+        headers["If-Modified-Since"] = validators["lastModified"]
+    return headers
+
+
+def _observe(result: FetchResult) -> None:
+    outcome = "error" if result.error else "not_modified" if result.not_modified else "ok"
+    FETCH_SECONDS.labels(outcome).observe(result.elapsed)
+    FETCH_BYTES.inc(result.size)
+
+
+def fetch_remote_config(
+    name: str,
+    url: str,
+    session: Optional[requests.Session] = None,
+    validators: Optional[dict] = None,
+) -> FetchResult:
+    """validators 为上次获取时保存的 etag/lastModified/hash, 命中时不解析内容"""
+    result = _fetch(name, url, session or get_session(), validators)
+    _observe(result)
+    return result
+
+
+def _fetch(name: str, url: str, session: requests.Session, validators: Optional[dict]) -> FetchResult:
+    start = time.perf_counter()
+    try:
+        response = session.get(url, timeout=REQUEST_TIMEOUT, headers=conditional_headers(validators))
+    except requests.RequestException as e:
+        logging.error(f"获取{name}:{url}订阅失败:{e}")
+        return FetchResult(name, url, elapsed=time.perf_counter() - start, error=str(e))
+    result = FetchResult(name, url, status_code=response.status_code, size=len(response.content))
+    result.etag = response.headers.get("ETag")
+    result.last_modified = response.headers.get("Last-Modified")
+    if response.status_code == 304 and validators:
+        result.not_modified = True
+        result.etag = result.etag or validators.get("etag")
+        result.last_modified = result.last_modified or validators.get("lastModified")
+        result.content_hash = validators.get("hash")
+        result.elapsed = time.perf_counter() - start
+        return result
+    if response.status_code != 200:
+        result.elapsed = time.perf_counter() - start
+        result.error = f"HTTP {response.status_code}"
+        return result
+    result.content_hash = hashlib.sha256(response.content).hexdigest()
+    if validators and result.content_hash == validators.get("hash"):
+        result.not_modified = True
+        result.elapsed = time.perf_counter() - start
+        return result
     try:
-        remote_config_dict = yaml.safe_load(remote_config.text)
+        result.config = yaml_backend.safe_load(response.content)
     except Exception as e:
         logging.error(f"解析远程配置文件失败:{e}")
-        return None
-    return remote_config_dict
\ No newline at end of file
+        result.error = str(e)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+class ProxyStream:
+    """流式获取订阅, 迭代时边下载边解析 proxies 中的节点
+
+    迭代结束后通过 result 查看状态码、大小、校验信息和错误
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        session: Optional[requests.Session] = None,
+        validators: Optional[dict] = None,
+        max_bytes: int = MAX_SUBSCRIPTION_SIZE,
+    ) -> None:
+        self.session = session or get_session()
+        self.validators = validators
+        self.max_bytes = max_bytes
+        self.result = FetchResult(name, url)
+
+    def __iter__(self) -> Iterator[dict]:
+        result = self.result
+        start = time.perf_counter()
+        try:
+            with self.session.get(
+                result.url, timeout=REQUEST_TIMEOUT, headers=conditional_headers(self.validators), stream=True
+            ) as response:
+                result.status_code = response.status_code
+                result.etag = response.headers.get("ETag")
+                result.last_modified = response.headers.get("Last-Modified")
+                if response.status_code == 304 and self.validators:
+                    result.not_modified = True
+                    result.content_hash = self.validators.get("hash")
+                    return
+                if response.status_code != 200:
+                    result.error = f"HTTP {response.status_code}"
+                    return
+                length = response.headers.get("Content-Length")
+                if length and length.isdigit() and int(length) > self.max_bytes:
+                    raise StreamTooLarge(f"订阅内容超过{self.max_bytes}字节上限")
+                digest = hashlib.sha256()
+
+                def chunks() -> Iterator[bytes]:
+                    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                        digest.update(chunk)
+                        yield chunk
+
+                stream = ChunkStream(chunks(), self.max_bytes)
+                try:
+                    yield from iter_proxies(stream)
+                finally:
+                    result.size = stream.bytes_read
+                result.content_hash = digest.hexdigest()
+        except (StreamTooLarge, NotSubscription) as e:
+            logging.error(f"获取{result.name}:{result.url}订阅失败:{e}")
+            result.error = str(e)
+        except requests.RequestException as e:
+            logging.error(f"获取{result.name}:{result.url}订阅失败:{e}")
+            result.error = str(e)
+        except yaml.YAMLError as e:
+            logging.error(f"解析远程配置文件失败:{e}")
+            result.error = str(e)
+        finally:
+            result.elapsed = time.perf_counter() - start
+            _observe(result)
+
+
+def fetch_all(
+    subscriptions: dict[str, str],
+    max_workers: int = MAX_WORKERS,
+    per_host_limit: int = PER_HOST_LIMIT,
+    validators: Optional[dict[str, dict]] = None,
+) -> dict[str, FetchResult]:
+    """并发获取全部订阅, subscriptions 为 {name: url}, validators 为 {name: 校验信息}"""
+    if not subscriptions:
+        return {}
+    session = get_session()
+    limiter = _HostLimiter(per_host_limit)
+    validators = validators or {}
+
+    def fetch(name: str, url: str) -> FetchResult:
+        with limiter.get(url):
+            return fetch_remote_config(name, url, session, validators.get(name))
+
+    workers = max(1, min(max_workers, len(subscriptions)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="subscription-fetch") as executor:
+        futures = {name: executor.submit(fetch, name, url) for name, url in subscriptions.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    for result in results.values():
+        logging.info(f"订阅{result.name}获取完成, 状态:{result.status_code}, 耗时:{result.elapsed:.3f}s, 大小:{result.size}B")
+    return results
+
+
+def get_remote_config(url: str) -> dict | None:
+    return fetch_remote_config(url, url).config
@@ -0,0 +1,492 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import secrets
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from .config import File
+from .probe import node_server
+
+DNS_PORT = 53
+DNS_TIMEOUT = 2.0
+# 每个服务器的重试次数, 全部服务器均无响应时回退到系统解析
+DNS_ATTEMPTS = 2
+CACHE_SIZE = 4096
+# 记录的 TTL 限制在该范围内(秒)
+MIN_TTL = 5
+MAX_TTL = 86400
+# 域名不存在或没有记录时的缓存时间, 响应中带 SOA 时取其中较小者
+NEGATIVE_TTL = 30
+# 系统解析没有 TTL 信息, 使用固定缓存时间
+SYSTEM_TTL = 60
+# 命中时剩余 TTL 少于原 TTL 的该比例, 则在后台提前刷新
+PREFETCH_RATIO = 0.1
+RESOLVE_CONCURRENCY = 64
+RESOLV_CONF = "/etc/resolv.conf"
+if os.name == "nt":
+    # Windows 上的环境变量名就是 SystemRoot
+    HOSTS_PATH = os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "System32", "drivers", "etc", "hosts")  # noqa: SIM112
+else:
+    HOSTS_PATH = "/etc/hosts"
+EDNS_PAYLOAD = 1232
+
+TYPE_A = 1
+TYPE_CNAME = 5
+TYPE_SOA = 6
+TYPE_AAAA = 28
+TYPE_OPT = 41
+RCODE_NXDOMAIN = 3
+
+_HEADER = struct.Struct("!HHHHHH")
+_RR = struct.Struct("!HHIH")
+
+
+class ResolveError(OSError):
+    """域名解析失败, 继承 OSError 以便与连接错误一并处理"""
+
+
+class DnsAnswer:
+    def __init__(self, addresses: list[str], ttl: int, rcode: int = 0, truncated: bool = False) -> None:
+        self.addresses = addresses
+        self.ttl = ttl
+        self.rcode = rcode
+        self.truncated = truncated
+
+
+def system_nameservers(path: str = RESOLV_CONF) -> list[str]:
+    """读取 resolv.conf 中的 nameserver, Windows 等没有该文件时返回空列表"""
+    servers = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    servers.append(parts[1].split("%")[0])
+    except OSError:
+        pass
+    return servers
+
+
+class HostsFile:
+    """hosts 文件中的静态解析, 文件修改后重新读取"""
+
+    def __init__(self, path: str = HOSTS_PATH) -> None:
+        self.path = path
+        self._mtime: Optional[int] = None
+        self._entries: dict[str, list[str]] = {}
+
+    def _reload(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            self._mtime, self._entries = None, {}
+            return
+        if mtime == self._mtime:
+            return
+        entries: dict[str, list[str]] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    parts = line.split("#", 1)[0].split()
+                    if len(parts) < 2:
+                        continue
+                    try:
+                        address = str(ipaddress.ip_address(parts[0].split("%")[0]))
+                    except ValueError:
+                        continue
+                    for name in parts[1:]:
+                        addresses = entries.setdefault(name.lower().rstrip("."), [])
+                        if address not in addresses:
+                            addresses.append(address)
+        except OSError as e:
+            logging.error(f"读取 hosts 文件失败:{e}")
+            return
+        self._mtime, self._entries = mtime, entries
+
+    def lookup(self, host: str, qtype: int) -> list[str]:
+        self._reload()
+        ipv6 = qtype == TYPE_AAAA
+        return [address for address in self._entries.get(host, ()) if (":" in address) == ipv6]
+
+
+def build_query(query_id: int, host: str, qtype: int) -> bytes:
+    """递归查询请求, 带 EDNS0 OPT 以接收较大的 UDP 响应"""
+    qname = b"".join(bytes([len(label)]) + label for label in host.encode("idna").split(b".") if label) + b"\0"
+    opt = b"\0" + struct.pack("!HHIH", TYPE_OPT, EDNS_PAYLOAD, 0, 0)
+    return _HEADER.pack(query_id, 0x0100, 1, 0, 0, 1) + qname + struct.pack("!HH", qtype, 1) + opt
+
+
+def _skip_name(data: bytes, offset: int) -> int:
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+
+def parse_response(data: bytes, query_id: int, qtype: int, negative_ttl: int = NEGATIVE_TTL) -> DnsAnswer:
+    """解析响应中与 qtype 相同类型的记录, TTL 取整条 CNAME 链与记录中的最小值"""
+    if len(data) < _HEADER.size:
+        raise ValueError("响应过短")
+    rid, flags, qdcount, ancount, nscount, _ = _HEADER.unpack_from(data)
+    if rid != query_id or not flags & 0x8000:
+        raise ValueError("响应与请求不匹配")
+    rcode = flags & 0xF
+    truncated = bool(flags & 0x0200)
+    offset = _HEADER.size
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+    addresses, ttls = [], []
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, _, ttl, length = _RR.unpack_from(data, offset)
+        offset += _RR.size
+        rdata = data[offset : offset + length]
+        offset += length
+        if rtype == qtype == TYPE_A and length == 4:
+            addresses.append(socket.inet_ntop(socket.AF_INET, rdata))
+            ttls.append(ttl)
+        elif rtype == qtype == TYPE_AAAA and length == 16:
+            addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+            ttls.append(ttl)
+        elif rtype == TYPE_CNAME:
+            ttls.append(ttl)
+    if addresses:
+        return DnsAnswer(addresses, min(ttls), rcode, truncated)
+    # 否定应答: TTL 取 SOA 记录 TTL 与其 minimum 字段中较小者
+    ttl = negative_ttl
+    for _ in range(nscount):
+        offset = _skip_name(data, offset)
+        rtype, _, record_ttl, length = _RR.unpack_from(data, offset)
+        offset += _RR.size
+        if rtype == TYPE_SOA:
+            end = offset + length
+            minimum = struct.unpack_from("!I", data, end - 4)[0]
+            ttl = min(negative_ttl, record_ttl, minimum)
+        offset += length
+    return DnsAnswer([], ttl, rcode, truncated)
+
+
+class _DnsProtocol(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        self.reply: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        if not self.reply.done():
+            self.reply.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        if not self.reply.done():
+            self.reply.set_exception(exc)
+
+
+class CacheEntry:
+    __slots__ = ("addresses", "error", "expires_at", "ttl")
+
+    def __init__(self, addresses: list[str], ttl: float, error: Optional[str] = None) -> None:
+        self.addresses = addresses
+        self.error = error
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + ttl
+
+
+class DnsCache:
+    """按 (域名, 记录类型) 缓存, 超出容量时淘汰最久未使用的条目, 过期条目视为不存在"""
+
+    def __init__(self, max_entries: int = CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, int], CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, int]) -> Optional[CacheEntry]:
+        entry = self._entries.get(key, None)
+        if entry is None or entry.expires_at <= time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple[str, int], entry: CacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class AsyncResolver:
+    """异步 DNS 解析: 直接向 nameserver 发送 UDP 查询以获得 TTL, 截断时改用 TCP
+
+    先查 hosts 文件; 相同查询并发时合并为一次; 缓存命中且即将过期时返回旧结果并在后台刷新;
+    没有可用的 nameserver、全部无响应或没有解析结果时回退到系统解析,
+    由系统处理 search/ndots 与 nsswitch
+    """
+
+    def __init__(
+        self,
+        nameservers: Optional[list[str]] = None,
+        port: int = DNS_PORT,
+        timeout: float = DNS_TIMEOUT,
+        attempts: int = DNS_ATTEMPTS,
+        max_entries: int = CACHE_SIZE,
+        min_ttl: int = MIN_TTL,
+        max_ttl: int = MAX_TTL,
+        negative_ttl: int = NEGATIVE_TTL,
+        prefetch_ratio: float = PREFETCH_RATIO,
+        system_fallback: bool = True,
+        hosts_path: str = HOSTS_PATH,
+    ) -> None:
+        self.nameservers = system_nameservers() if nameservers is None else list(nameservers)
+        self.port = port
+        self.timeout = timeout
+        self.attempts = attempts
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.prefetch_ratio = prefetch_ratio
+        self.system_fallback = system_fallback
+        self.hosts = HostsFile(hosts_path)
+        self.cache = DnsCache(max_entries)
+        self._inflight: dict[tuple[str, int], asyncio.Future] = {}
+        self._prefetching: set[tuple[str, int]] = set()
+        self.queries = 0
+        self.prefetches = 0
+
+    async def _udp_query(self, server: str, payload: bytes) -> bytes:
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(_DnsProtocol, remote_addr=(server, self.port))
+        try:
+            transport.sendto(payload)
+            return await asyncio.wait_for(protocol.reply, self.timeout)
+        finally:
+            transport.close()
+
+    async def _tcp_query(self, server: str, payload: bytes) -> bytes:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(server, self.port), self.timeout)
+        try:
+            writer.write(struct.pack("!H", len(payload)) + payload)
+            length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), self.timeout))[0]
+            return await asyncio.wait_for(reader.readexactly(length), self.timeout)
+        finally:
+            writer.close()
+
+    async def _query_servers(self, host: str, qtype: int) -> Optional[CacheEntry]:
+        """依次询问各 nameserver, 全部无响应时返回 None"""
+        for _ in range(self.attempts):
+            for server in self.nameservers:
+                query_id = secrets.randbits(16)
+                payload = build_query(query_id, host, qtype)
+                self.queries += 1
+                try:
+                    answer = parse_response(await self._udp_query(server, payload), query_id, qtype, self.negative_ttl)
+                    if answer.truncated:
+                        answer = parse_response(await self._tcp_query(server, payload), query_id, qtype, self.negative_ttl)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError, struct.error) as e:
+                    logging.debug(f"DNS 服务器{server}查询{host}失败:{e or type(e).__name__}")
+                    continue
+                if answer.addresses:
+                    return CacheEntry(answer.addresses, min(max(answer.ttl, self.min_ttl), self.max_ttl))
+                if answer.rcode in (0, RCODE_NXDOMAIN):
+                    error = "域名不存在" if answer.rcode == RCODE_NXDOMAIN else "没有解析记录"
+                    return CacheEntry([], answer.ttl, error)
+                # SERVFAIL/REFUSED 等换下一个服务器
+        return None
+
+    async def _query_system(self, host: str, qtype: int) -> CacheEntry:
+        loop = asyncio.get_running_loop()
+        family = socket.AF_INET6 if qtype == TYPE_AAAA else socket.AF_INET
+        try:
+            infos = await loop.getaddrinfo(host, None, family=family, type=socket.SOCK_STREAM)
+        except OSError as e:
+            return CacheEntry([], self.negative_ttl, e.strerror or str(e))
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        return CacheEntry(addresses, SYSTEM_TTL)
+
+    async def _lookup(self, host: str, qtype: int) -> CacheEntry:
+        addresses = self.hosts.lookup(host, qtype)
+        if addresses:
+            entry = CacheEntry(addresses, SYSTEM_TTL)
+            self.cache.put((host, qtype), entry)
+            return entry
+        entry = await self._query_servers(host, qtype) if self.nameservers else None
+        if entry is None and not self.system_fallback:
+            return CacheEntry([], 0, "DNS 服务器无响应")
+        if self.system_fallback and (entry is None or not entry.addresses):
+            # 短名称需要 search 域, 或解析记录来自 nsswitch 的其他来源
+            system = await self._query_system(host, qtype)
+            if entry is None or system.addresses:
+                entry = system
+        self.cache.put((host, qtype), entry)
+        return entry
+
+    async def _fetch(self, key: tuple[str, int]) -> CacheEntry:
+        """同一查询并发时共享一个任务"""
+        future = self._inflight.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(self._lookup(*key))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def _maybe_prefetch(self, key: tuple[str, int], entry: CacheEntry) -> None:
+        if not entry.addresses or key in self._prefetching or key in self._inflight:
+            return
+        if entry.expires_at - time.monotonic() > entry.ttl * self.prefetch_ratio:
+            return
+        self.prefetches += 1
+        self._prefetching.add(key)
+        task = asyncio.ensure_future(self._fetch(key))
+        task.add_done_callback(lambda _: self._prefetching.discard(key))
+
+    async def query(self, host: str, qtype: int) -> CacheEntry:
+        key = (host, qtype)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self._maybe_prefetch(key, entry)
+            return entry
+        return await self._fetch(key)
+
+    async def resolve(self, host: str, family: int = socket.AF_UNSPEC) -> list[str]:
+        """返回地址列表(IPv4 在前), 解析失败时抛出 ResolveError"""
+        host = host.strip("[]").lower().rstrip(".")
+        try:
+            address = ipaddress.ip_address(host)
+            return [str(address)]
+        except ValueError:
+            pass
+        qtypes = {socket.AF_INET: (TYPE_A,), socket.AF_INET6: (TYPE_AAAA,)}.get(family, (TYPE_A, TYPE_AAAA))
+        entries = await asyncio.gather(*(self.query(host, qtype) for qtype in qtypes))
+        addresses = [address for entry in entries for address in entry.addresses]
+        if not addresses:
+            raise ResolveError(f"解析{host}失败:{entries[0].error}")
+        return addresses
+
+    async def resolve_many(
+        self, hosts: Iterable[str], concurrency: int = RESOLVE_CONCURRENCY, family: int = socket.AF_UNSPEC
+    ) -> dict[str, list[str] | ResolveError]:
+        """并发解析多个域名, 失败的域名对应 ResolveError"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(host: str) -> tuple[str, list[str] | ResolveError]:
+            async with semaphore:
+                try:
+                    return host, await self.resolve(host, family)
+                except ResolveError as e:
+                    return host, e
+
+        return dict(await asyncio.gather(*(one(host) for host in dict.fromkeys(hosts))))
+
+    async def resolve_nodes(
+        self, nodes: Iterable[File], concurrency: int = RESOLVE_CONCURRENCY
+    ) -> dict[str, list[str] | ResolveError]:
+        """解析整个订阅的节点 server, 以节点名为键; 相同主机只解析一次"""
+        servers = {}
+        for node in nodes:
+            server = node_server(node)
+            servers[node.name] = server[0] if server else None
+        resolved = await self.resolve_many((host for host in servers.values() if host), concurrency)
+        return {
+            name: resolved[host] if host else ResolveError(f"节点{name}配置中没有 server")
+            for name, host in servers.items()
+        }
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.cache),
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "queries": self.queries,
+            "prefetches": self.prefetches,
+        }
+
+
+class ResolverService:
+    """在独立事件循环线程中运行 AsyncResolver, 供同步代码与其他事件循环共用同一份缓存"""
+
+    def __init__(self, **kwargs: dict) -> None:
+        self._kwargs = kwargs
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._resolver: Optional[AsyncResolver] = None
+        self._lock = threading.Lock()
+
+    def _ensure(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run() -> None:
+                    asyncio.set_event_loop(loop)
+                    self._resolver = AsyncResolver(**self._kwargs)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                threading.Thread(target=run, name="dns-resolver", daemon=True).start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def _submit(self, coro_factory) -> "asyncio.Future":
+        loop = self._ensure()
+        return asyncio.run_coroutine_threadsafe(coro_factory(self._resolver), loop)
+
+    def resolve(self, host: str, family: int = socket.AF_UNSPEC, timeout: Optional[float] = None) -> list[str]:
+        """同步解析, 失败时抛出 ResolveError"""
+        return self._submit(lambda resolver: resolver.resolve(host, family)).result(timeout)
+
+    async def aresolve(self, host: str, family: int = socket.AF_UNSPEC) -> list[str]:
+        """在调用方的事件循环中等待解析结果"""
+        return await asyncio.wrap_future(self._submit(lambda resolver: resolver.resolve(host, family)))
+
+    def resolve_many(self, hosts: Iterable[str], concurrency: int = RESOLVE_CONCURRENCY) -> dict:
+        hosts = list(hosts)
+        return self._submit(lambda resolver: resolver.resolve_many(hosts, concurrency)).result()
+
+    def resolve_nodes(self, nodes: Iterable[File], concurrency: int = RESOLVE_CONCURRENCY) -> dict:
+        nodes = list(nodes)
+        return self._submit(lambda resolver: resolver.resolve_nodes(nodes, concurrency)).result()
+
+    def stats(self) -> dict[str, int]:
+        self._ensure()
+        return self._resolver.stats()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+                self._resolver = None
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_resolver() -> ResolverService:
+    """进程内共享的解析服务"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ResolverService()
+    return _service
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logging.info(get_resolver().resolve_many(["example.com", "localhost"]))
@@ -1,26 +1,136 @@
 import logging
-import yaml
-from typing import Optional
+import os
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+
+from . import yaml_backend
+from .file_watch import get_watcher
+
+# 没有 inotify 时两次检查配置文件是否被外部修改的最小间隔(秒)
+REFRESH_INTERVAL = 0.5
+
+
+class Settings(NamedTuple):
+    """某一版本配置的只读快照, 字段访问即属性访问"""
+
+    version: int
+    httpPort: int
+    socksPort: int
+    default: Optional[str]
+
+
+class _State(NamedTuple):
+    config: Optional[dict]
+    version: int
+    generation: Optional[int]
+    snapshot: Settings
+    # getXxx 的查询结果缓存, 随状态一起替换
+    cache: dict
+
+
+class Setting:
+    """预先拆分好路由的配置访问器, 结果按配置版本缓存"""
+
+    __slots__ = ("_cached", "default", "keys", "route", "value_type")
+
+    def __init__(self, route: str, value_type: type, default: Any = None) -> None:
+        self.route = route
+        self.keys = tuple(route.split("."))
+        self.value_type = value_type
+        self.default = default
+        # (配置版本, 值) 作为一个元组整体替换, 并发读者不会拿到新版本配旧值
+        self._cached: tuple[int, Any] = (-1, None)
+
+    def get(self) -> Any:
+        SettingReader._maybe_refresh()
+        state = SettingReader._state
+        version, value = self._cached
+        if version != state.version:
+            data = SettingReader._resolve(state.config, self.keys, self.value_type)
+            value = self.default if data is None else data
+            self._cached = (state.version, value)
+        return value
 
 
 class SettingReader:
-    __config = None
+    __path: Optional[str] = None
+    __lock = threading.Lock()
+    __last_check = 0.0
+    _state = _State(None, 0, None, Settings(0, 0, 0, None), {})
 
     @staticmethod
     def InitConfig(configPath: str) -> bool:
-        try:
-            with open(configPath, encoding="utf-8") as f:
-                SettingReader.__config = yaml.safe_load(f)
-        except Exception as e:
-            logging.error(f"配置文件读取失败:{e}")
+        SettingReader.__path = configPath
+        return SettingReader.reload()
+
+    @staticmethod
+    def reload() -> bool:
+        """重新读取配置文件, 新的配置与快照一次性替换, 读者不会看到半新半旧的状态"""
+        configPath = SettingReader.__path
+        if configPath is None:
             return False
+        with SettingReader.__lock:
+            watcher = get_watcher()
+            watcher.watch(configPath)
+            generation = watcher.generation(configPath)
+            try:
+                config = yaml_backend.load_file(configPath)
+            except Exception as e:
+                logging.error(f"配置文件读取失败:{e}")
+                return False
+            version = SettingReader._state.version + 1
+            snapshot = SettingReader.__build_snapshot(config, version)
+            SettingReader._state = _State(config, version, generation, snapshot, {})
         return True
 
-    def __getConfig(route: str, value_type: type) -> str:
-        data = SettingReader.__config
-        keys = route.split(".")
+    @staticmethod
+    def refresh(file_path: Optional[str] = None) -> bool:
+        """配置文件被修改过时重新读取; 指定 file_path 时仅在与当前配置文件相同时检查"""
+        configPath = SettingReader.__path
+        if configPath is None:
+            return False
+        if file_path is not None and os.path.abspath(file_path) != os.path.abspath(configPath):
+            return True
+        SettingReader.__last_check = time.monotonic()
+        if get_watcher().generation(configPath) == SettingReader._state.generation:
+            return True
+        return SettingReader.reload()
+
+    @staticmethod
+    def _maybe_refresh() -> None:
+        """inotify 监听中时检查变化不访问磁盘, 每次都检查; 否则至多每 REFRESH_INTERVAL 秒 stat 一次"""
+        configPath = SettingReader.__path
+        if configPath is None:
+            return
+        if get_watcher().live(configPath) or time.monotonic() - SettingReader.__last_check >= REFRESH_INTERVAL:
+            SettingReader.refresh()
+
+    @staticmethod
+    def snapshot() -> Settings:
+        SettingReader._maybe_refresh()
+        return SettingReader._state.snapshot
+
+    @staticmethod
+    def compile(route: str, value_type: type, default: Any = None) -> Setting:
+        return Setting(route, value_type, default)
+
+    @staticmethod
+    def __build_snapshot(config: Optional[dict], version: int) -> Settings:
+        keys = Settings._fields[1:]
+        types = (int, int, str)
+        defaults = (0, 0, None)
+        values = []
+        for key, value_type, default in zip(keys, types, defaults):
+            data = SettingReader._resolve(config, (key,), value_type)
+            values.append(default if data is None else data)
+        return Settings(version, *values)
+
+    @staticmethod
+    def _resolve(config: Optional[dict], keys: tuple[str, ...], value_type: type) -> Any:
+        data = config
         for key in keys:
-            if key in data:
+            if isinstance(data, dict) and key in data:
                 data = data[key]
             else:
                 return None
@@ -30,6 +140,17 @@ class SettingReader:
             return None
         return data
 
+    def __getConfig(route: str, value_type: type) -> str:
+        SettingReader._maybe_refresh()
+        state = SettingReader._state
+        try:
+            return state.cache[(route, value_type)]
+        except KeyError:
+            pass
+        data = SettingReader._resolve(state.config, tuple(route.split(".")), value_type)
+        state.cache[(route, value_type)] = data
+        return data
+
     @staticmethod
     def getStr(route: str, default: Optional[str] = None) -> str | None:
         data = SettingReader.__getConfig(route, str)
@@ -53,4 +174,4 @@ class SettingReader:
     @staticmethod
     def getBool(route: str, default: Optional[bool] = None) -> bool | None:
         data = SettingReader.__getConfig(route, bool)
-        return default if data is None else data
\ No newline at end of file
+        return default if data is None else data
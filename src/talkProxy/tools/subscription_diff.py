@@ -0,0 +1,67 @@
+import hashlib
+import json
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from .config import File
+
+
+def proxy_key(proxy: dict) -> str:
+    """节点内容键, 节点的任意字段变化都会改变该值"""
+    content = json.dumps(proxy, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class SubscriptionDiff:
+    def __init__(self) -> None:
+        # (节点信息, 内容键)
+        self.added: list[tuple[dict, str]] = []
+        # (旧文件, 节点信息, 内容键), 沿用旧文件路径重写
+        self.changed: list[tuple["File", dict, str]] = []
+        self.unchanged: list["File"] = []
+        self.removed: list["File"] = []
+        # 新订阅中节点的顺序, 元素为 ("added"|"changed"|"unchanged", 下标)
+        self.order: list[tuple[str, int]] = []
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    def __repr__(self) -> str:
+        return (
+            f"SubscriptionDiff(added={len(self.added)}, changed={len(self.changed)}, "
+            f"unchanged={len(self.unchanged)}, removed={len(self.removed)})"
+        )
+
+
+def diff_proxies(
+    old_files: list["File"],
+    new_proxies: list[dict],
+    exists: Optional[Callable[[str], bool]] = None,
+    key: Callable[[dict], str] = proxy_key,
+) -> SubscriptionDiff:
+    """按节点名匹配新旧节点, 按内容键判断节点是否变化
+
+    exists 用于检查旧配置文件是否仍在磁盘上, 文件丢失的节点视为已变化;
+    key 计算节点的内容键, 需与写入文件时记录的键一致
+    """
+    diff = SubscriptionDiff()
+    old_by_name: dict[str, "File"] = {}
+    for file in old_files:
+        if file.name in old_by_name:
+            diff.removed.append(file)
+            continue
+        old_by_name[file.name] = file
+    for proxy in new_proxies:
+        content_key = key(proxy)
+        old_file = old_by_name.pop(proxy["name"], None)
+        if old_file is None:
+            diff.order.append(("added", len(diff.added)))
+            diff.added.append((proxy, content_key))
+        elif old_file.key == content_key and (exists is None or exists(old_file.path)):
+            diff.order.append(("unchanged", len(diff.unchanged)))
+            diff.unchanged.append(old_file)
+        else:
+            diff.order.append(("changed", len(diff.changed)))
+            diff.changed.append((old_file, proxy, content_key))
+    diff.removed.extend(old_by_name.values())
+    return diff
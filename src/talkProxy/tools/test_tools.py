@@ -1,7 +1,881 @@
 import unittest
 import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def start_http_server(handler: type[BaseHTTPRequestHandler]) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
 class Test(unittest.TestCase):
     
     def test_config(self):
         from talkProxy.tools.config import test
-        res = test()
\ No newline at end of file
+        res = test()
+
+    def test_fetch_all(self):
+        from talkProxy.tools.remote_config import fetch_all
+        state = {"active": 0, "max_active": 0}
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with lock:
+                    state["active"] += 1
+                    state["max_active"] = max(state["max_active"], state["active"])
+                time.sleep(0.3)
+                with lock:
+                    state["active"] -= 1
+                body = f"proxies:\n  - name: {self.path[1:]}\n    type: hysteria2\n".encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = start_http_server(Handler)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        subscriptions = {f"sub{i}": f"{base}/node{i}" for i in range(6)}
+        try:
+            start = time.perf_counter()
+            results = fetch_all(subscriptions, max_workers=8, per_host_limit=8)
+            elapsed = time.perf_counter() - start
+            self.assertLess(elapsed, 0.3 * 6 / 2)
+            self.assertTrue(all(result.ok for result in results.values()))
+            self.assertEqual(results["sub3"].config["proxies"][0]["name"], "node3")
+            self.assertGreaterEqual(results["sub3"].elapsed, 0.3)
+
+            state["max_active"] = 0
+            fetch_all(subscriptions, max_workers=8, per_host_limit=2)
+            self.assertEqual(state["max_active"], 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_conditional_fetch(self):
+        import os
+        import tempfile
+        from talkProxy.tools.config import GlobalConfig, Subscription, SubscriptionCacheConfig
+        from talkProxy.tools.remote_config import FetchResult, fetch_remote_config
+        body = b"proxies:\n  - name: node\n    type: hysteria2\n"
+        state = {"etag": True, "requests": 0}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                state["requests"] += 1
+                if state["etag"] and self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                if state["etag"]:
+                    self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = start_http_server(Handler)
+        url = f"http://127.0.0.1:{server.server_address[1]}/sub"
+        try:
+            first = fetch_remote_config("sub", url)
+            self.assertTrue(first.ok)
+            self.assertEqual(first.etag, '"v1"')
+
+            second = fetch_remote_config("sub", url, validators=first.validators())
+            self.assertTrue(second.not_modified)
+            self.assertEqual(second.status_code, 304)
+            self.assertIsNone(second.config)
+
+            state["etag"] = False
+            third = fetch_remote_config("sub", url, validators={"hash": first.content_hash})
+            self.assertEqual(third.status_code, 200)
+            self.assertTrue(third.not_modified)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SubscriptionCacheConfig(os.path.join(tmp, "subscription_cache.yaml"))
+            self.assertIsNone(cache.get_validators("sub", url))
+            self.assertTrue(cache.set_validators("sub", url, first))
+            mtime = os.stat(cache.file_path).st_mtime_ns
+            self.assertTrue(cache.set_validators("sub", url, first))
+            self.assertEqual(os.stat(cache.file_path).st_mtime_ns, mtime)
+            self.assertEqual(SubscriptionCacheConfig(cache.file_path).get_validators("sub", url)["etag"], '"v1"')
+            self.assertIsNone(cache.get_validators("sub", url + "?changed"))
+
+            # 内容未变但 ETag 变化时保存新的校验信息, 下次条件请求才能命中
+            global_config = GlobalConfig.__new__(GlobalConfig)
+            global_config.subscriptionCacheConfig = cache
+            renamed = FetchResult("sub", url, status_code=200)
+            renamed.not_modified = True
+            renamed.etag, renamed.content_hash = '"v2"', first.content_hash
+            self.assertTrue(global_config._apply_fetch_result(Subscription("sub", url, "10", 0, []), url, "10", renamed))
+            self.assertEqual(SubscriptionCacheConfig(cache.file_path).get_validators("sub", url)["etag"], '"v2"')
+
+    def test_merge_subscription(self):
+        import os
+        import tempfile
+        from unittest import mock
+        import yaml
+        from talkProxy.tools import config
+        from talkProxy.tools.settingReader import SettingReader
+
+        def node(name: str, server: str) -> dict:
+            return {"name": name, "type": "hysteria2", "server": server, "password": "pw"}
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(config, "config_dir_path", tmp):
+            setting_path = os.path.join(tmp, "config.yaml")
+            with open(setting_path, "w") as f:
+                yaml.dump({"httpPort": 7899, "socksPort": 7900}, f)
+            SettingReader.InitConfig(setting_path)
+            global_config = config.GlobalConfig.__new__(config.GlobalConfig)
+            old = global_config.build_subscription(
+                "sub", "url", "10", {"proxies": [node("a", "a:1"), node("b", "b:1"), node("c", "c:1")]}
+            )
+            old_paths = {file.name: file.path for file in old.files}
+            mtime_a = os.stat(old_paths["a"]).st_mtime_ns
+
+            new = global_config.merge_subscription(
+                old, "url", "10", {"proxies": [node("d", "d:1"), node("a", "a:1"), node("b", "b:2")]}
+            )
+            self.assertEqual([file.name for file in new.files], ["d", "a", "b"])
+            new_paths = {file.name: file.path for file in new.files}
+            self.assertEqual(new_paths["a"], old_paths["a"])
+            self.assertEqual(os.stat(new_paths["a"]).st_mtime_ns, mtime_a)
+            self.assertEqual(new_paths["b"], old_paths["b"])
+            with open(new_paths["b"]) as f:
+                self.assertEqual(yaml.safe_load(f)["server"], "b:2")
+            self.assertFalse(os.path.exists(old_paths["c"]))
+            self.assertTrue(os.path.exists(new_paths["d"]))
+            self.assertEqual(config.Subscription(**new.to_dict()).files[1].key, new.files[1].key)
+
+            # 设置中的监听端口变化后, 订阅内容未变的节点也重新生成
+            with open(setting_path, "w") as f:
+                yaml.dump({"httpPort": 8899, "socksPort": 8900}, f)
+            self.assertTrue(SettingReader.reload())
+            newer = global_config.merge_subscription(
+                new, "url", "10", {"proxies": [node("d", "d:1"), node("a", "a:1"), node("b", "b:2")]}
+            )
+            self.assertEqual([file.path for file in newer.files], [file.path for file in new.files])
+            with open(new_paths["a"]) as f:
+                self.assertEqual(yaml.safe_load(f)["http"]["listen"], "127.0.0.1:8899")
+            mtime_a = os.stat(new_paths["a"]).st_mtime_ns
+            global_config.merge_subscription(
+                newer, "url", "10", {"proxies": [node("d", "d:1"), node("a", "a:1"), node("b", "b:2")]}
+            )
+            self.assertEqual(os.stat(new_paths["a"]).st_mtime_ns, mtime_a)
+
+    def test_new_subscription_stream(self):
+        import os
+        import tempfile
+        from unittest import mock
+        import yaml
+        from talkProxy.tools import config
+        from talkProxy.tools.settingReader import SettingReader
+        proxies = [{"name": f"node{i}", "type": "hysteria2", "server": f"{i}.example:443", "password": "pw"} for i in range(200)]
+        body = yaml.dump({"mixed-port": 7890, "rules": ["MATCH,DIRECT"] * 100, "proxies": proxies}).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                payload = {"/html": b"<html><body>login</body></html>", "/other": b"port: 1\n"}.get(self.path, body)
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                for i in range(0, len(payload), 4096):
+                    self.wfile.write(payload[i:i + 4096])
+
+            def log_message(self, *args):
+                pass
+
+        server = start_http_server(Handler)
+        url = f"http://127.0.0.1:{server.server_address[1]}/sub"
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(config, "config_dir_path", tmp):
+            setting_path = os.path.join(tmp, "config.yaml")
+            with open(setting_path, "w") as f:
+                yaml.dump({"httpPort": 7899, "socksPort": 7900}, f)
+            SettingReader.InitConfig(setting_path)
+            global_config = config.GlobalConfig.__new__(config.GlobalConfig)
+            global_config.subscriptionConfig = mock.Mock(**{"is_subscription_exist.return_value": False})
+            global_config.subscriptionCacheConfig = config.SubscriptionCacheConfig(os.path.join(tmp, "cache.yaml"))
+            try:
+                subscription = global_config.new_subscription("sub", url, "10", stream=True)
+                self.assertEqual([file.name for file in subscription.files], [proxy["name"] for proxy in proxies])
+                self.assertIsNotNone(global_config.subscriptionCacheConfig.get_validators("sub", url)["hash"])
+                with open(subscription.files[5].path) as f:
+                    self.assertEqual(yaml.safe_load(f)["server"], "5.example:443")
+
+                before = set(os.listdir(tmp))
+                self.assertIsNone(global_config.new_subscription("big", url, "10", stream=True, max_bytes=len(body) // 2))
+                self.assertEqual(set(os.listdir(tmp)), before)
+
+                # 不是订阅的内容按失败处理, 不保存校验信息, 下次刷新仍会重新获取
+                for path in ("/html", "/other"):
+                    other = url.replace("/sub", path)
+                    self.assertIsNone(global_config.new_subscription("bad", other, "10", stream=True))
+                    self.assertIsNone(global_config.subscriptionCacheConfig.get_validators("bad", other))
+
+                # 删除订阅时一并删除校验信息
+                self.assertTrue(global_config.remove_subscription("sub"))
+                global_config.subscriptionConfig.remove_subscription.assert_called_once_with("sub")
+                self.assertIsNone(config.SubscriptionCacheConfig(os.path.join(tmp, "cache.yaml")).get_validators("sub", url))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def test_config_transaction(self):
+        import os
+        import tempfile
+        from unittest import mock
+        import yaml
+        from talkProxy.tools import config
+        from talkProxy.tools.config import BaseConfig, ConfigTransaction
+
+        with tempfile.TemporaryDirectory() as tmp:
+            base = BaseConfig(os.path.join(tmp, "base.yaml"))
+            with mock.patch.object(config, "write_temp", wraps=config.write_temp) as write:
+                with ConfigTransaction():
+                    for i in range(10):
+                        base.config[f"key{i}"] = i
+                        self.assertTrue(base.save_config())
+                    with ConfigTransaction():
+                        base.config["nested"] = True
+                        base.save_config()
+                    self.assertEqual(write.call_count, 0)
+                self.assertEqual(write.call_count, 1)
+            with open(base.file_path) as f:
+                self.assertEqual(yaml.safe_load(f)["key9"], 9)
+
+            with self.assertRaises(RuntimeError), ConfigTransaction():
+                base.config["key0"] = "changed"
+                base.save_config()
+                raise RuntimeError
+            self.assertEqual(base.config["key0"], 0)
+            self.assertEqual([name for name in os.listdir(tmp) if name.startswith(".tmp-")], [])
+
+            # 多个文件统一落盘, 目录只 fsync 一次
+            others = [BaseConfig(os.path.join(tmp, f"other{i}.yaml")) for i in range(5)]
+            with mock.patch.object(config, "fsync_dir") as fsync_dir:
+                with ConfigTransaction():
+                    for other in others:
+                        other.config["value"] = 1
+                        other.save_config()
+            self.assertEqual(fsync_dir.call_count, 1)
+
+            # 提交失败时抛出异常, 未写入的配置从磁盘恢复
+            with mock.patch.object(config, "write_temp", side_effect=OSError("disk full")):
+                with self.assertRaises(config.ConfigCommitError), ConfigTransaction():
+                    base.config["key0"] = "lost"
+                    self.assertTrue(base.save_config())
+            self.assertEqual(base.config["key0"], 0)
+            global_config = config.GlobalConfig.__new__(config.GlobalConfig)
+            global_config.subscriptionConfig = mock.Mock(**{"remove_subscription.return_value": True})
+            global_config.subscriptionCacheConfig = config.SubscriptionCacheConfig(os.path.join(tmp, "cache.yaml"))
+            global_config.subscriptionCacheConfig.config["sub"] = {"url": "url"}
+            with mock.patch.object(config, "write_temp", side_effect=OSError("disk full")):
+                self.assertFalse(global_config.remove_subscription("sub"))
+
+    def test_subscription_index(self):
+        import os
+        import tempfile
+        from talkProxy.tools.config import File, Subscription, SubscriptionConfig
+
+        def subscription(name: str, nodes: list[str]) -> Subscription:
+            return Subscription(name, f"http://{name}", "10", 0, [File(node, "hysteria2", f"/{name}/{node}.yaml") for node in nodes])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "subscription.yaml")
+            sub_config = SubscriptionConfig(path)
+            sub_config.add_subscription(subscription("a", ["hk", "jp"]))
+            sub_config.add_subscription(subscription("b", ["hk", "us"]))
+            sub_config.add_subscription(subscription("c", ["sg"]))
+            self.assertIs(sub_config.get_subscription("b"), sub_config.get_subscription("b"))
+            self.assertEqual(sub_config.get_node("hk")[0].name, "a")
+            self.assertEqual(sub_config.get_node("hk", "b")[1].path, "/b/hk.yaml")
+
+            sub_config.remove_subscription("a")
+            self.assertEqual(sub_config.get_node("hk")[0].name, "b")
+            self.assertIsNone(sub_config.get_node("jp"))
+            # 改名为已存在的订阅时拒绝, 两个订阅都保持不变
+            self.assertFalse(sub_config.update_subscription("b", subscription("c", ["us"])))
+            self.assertEqual(sub_config.get_node("hk")[0].name, "b")
+            self.assertEqual(sub_config.get_node("sg")[0].name, "c")
+            sub_config.update_subscription("b", subscription("d", ["us"]))
+            self.assertIsNone(sub_config.get_node("hk"))
+            self.assertFalse(sub_config.is_subscription_exist("b"))
+
+            reloaded = SubscriptionConfig(path)
+            self.assertEqual([sub.name for sub in reloaded.get_subscription_all()], ["d", "c"])
+            self.assertEqual(reloaded.get_node("sg")[1].path, "/c/sg.yaml")
+
+    def test_file_watch(self):
+        import os
+        import sys
+        import tempfile
+        from unittest import mock
+        from talkProxy.tools.config import BaseConfig, Hysteria2Config
+        from talkProxy.tools.file_watch import InotifyWatcher, StatWatcher
+
+        watchers = [StatWatcher()]
+        if sys.platform.startswith("linux"):
+            watchers.append(InotifyWatcher())
+        for watcher in watchers:
+            with tempfile.TemporaryDirectory() as tmp, mock.patch("talkProxy.tools.config.get_watcher", return_value=watcher):
+                base = BaseConfig(os.path.join(tmp, "base.yaml"))
+                base.config["key"] = 1
+                base.save_config()
+                self.assertEqual(watcher.generation(base.file_path), base._generation)
+                with mock.patch.object(BaseConfig, "load_config", wraps=base.load_config) as load:
+                    for _ in range(5):
+                        self.assertTrue(base.refresh_config())
+                    self.assertEqual(load.call_count, 0)
+
+                with open(base.file_path, "w") as f:
+                    f.write("key: 2\nother: true\n")
+                self.assertTrue(base.refresh_config())
+                self.assertEqual(base.config["key"], 2)
+                self.assertEqual(watcher.generation(base.file_path), base._generation)
+
+                replacement = os.path.join(tmp, "replacement.yaml")
+                with open(replacement, "w") as f:
+                    f.write("key: 3\n")
+                os.replace(replacement, base.file_path)
+                self.assertTrue(base.refresh_config())
+                self.assertEqual(base.config, {"key": 3})
+
+                # 只写不读的节点配置不加入监听, 删除的节点不会一直留在监听器中
+                node = Hysteria2Config(os.path.join(tmp, "node.yaml"), server="s:1", password="pw")
+                tracked = watcher._files if isinstance(watcher, InotifyWatcher) else watcher._signatures
+                self.assertNotIn(os.path.abspath(node.file_path), tracked)
+                watcher.close()
+
+    def test_setting_reader_snapshot(self):
+        import os
+        import tempfile
+        import yaml
+        from talkProxy.tools.config import BaseConfig
+        from talkProxy.tools.file_watch import get_watcher
+        from talkProxy.tools.settingReader import SettingReader
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "config.yaml")
+            with open(path, "w") as f:
+                yaml.dump({"httpPort": 7899, "socksPort": 7900, "log": {"level": "info"}}, f)
+            self.assertTrue(SettingReader.InitConfig(path))
+            level = SettingReader.compile("log.level", str, "warn")
+            missing = SettingReader.compile("log.file", str, "none")
+            snapshot = SettingReader.snapshot()
+            self.assertEqual((snapshot.httpPort, snapshot.socksPort), (7899, 7900))
+            self.assertEqual(level.get(), "info")
+            self.assertEqual(missing.get(), "none")
+            self.assertEqual(SettingReader.getStr("log.level"), "info")
+
+            with open(path, "w") as f:
+                yaml.dump({"httpPort": 8000, "socksPort": 8001, "log": {"level": "debug"}}, f)
+            self.assertTrue(SettingReader.refresh())
+            self.assertEqual(SettingReader.snapshot().httpPort, 8000)
+            self.assertEqual(snapshot.httpPort, 7899)
+            self.assertEqual(level.get(), "debug")
+            self.assertEqual(SettingReader.getStr("log.level"), "debug")
+
+            # inotify 监听中时不受刷新间隔限制, 外部修改后立即可见
+            if get_watcher().live(path):
+                with open(path, "w") as f:
+                    yaml.dump({"httpPort": 8000, "socksPort": 8001, "log": {"level": "error"}}, f)
+                self.assertEqual(level.get(), "error")
+
+            config = BaseConfig(path)
+            config.config["socksPort"] = 9000
+            config.save_config()
+            self.assertEqual(SettingReader.snapshot().socksPort, 9000)
+            self.assertEqual(SettingReader.getInt("socksPort"), 9000)
+
+    def test_yaml_parsed_cache(self):
+        import os
+        import tempfile
+        from unittest import mock
+        from talkProxy.tools import yaml_backend
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "subscription.yaml")
+            with open(path, "w") as f:
+                f.write(yaml_backend.dump({"subscription": [{"name": "a", "files": [{"name": "hk"}]}]}))
+            with mock.patch.object(yaml_backend, "safe_load", wraps=yaml_backend.safe_load) as load:
+                first = yaml_backend.load_file(path)
+                self.assertTrue(os.path.exists(yaml_backend.cache_path(path)))
+                self.assertEqual(yaml_backend.load_file(path), first)
+                self.assertEqual(load.call_count, 1)
+
+                with open(path, "w") as f:
+                    f.write("subscription: []\n")
+                self.assertEqual(yaml_backend.load_file(path), {"subscription": []})
+                self.assertEqual(load.call_count, 2)
+
+                with open(yaml_backend.cache_path(path), "wb") as f:
+                    f.write(b"corrupted")
+                self.assertEqual(yaml_backend.load_file(path), {"subscription": []})
+                self.assertEqual(load.call_count, 3)
+
+            with open(path, "w") as f:
+                f.write("updated: 2024-01-01\n")
+            self.assertEqual(str(yaml_backend.load_file(path)["updated"]), "2024-01-01")
+
+    def test_latency_probe(self):
+        import os
+        import socket
+        import tempfile
+        import yaml
+        from talkProxy.tools.config import File
+        from talkProxy.tools.probe import LatencyProber, parse_server
+
+        self.assertEqual(parse_server('example.com:8443'), ('example.com', 8443))
+        self.assertEqual(parse_server('example.com:20000-30000,40000'), ('example.com', 20000))
+        self.assertEqual(parse_server('[::1]:443'), ('::1', 443))
+        self.assertEqual(parse_server('example.com', 8080), ('example.com', 8080))
+
+        # UDP 回显与 TCP 监听
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind(('127.0.0.1', 0))
+        udp_count = [0]
+
+        def echo():
+            while True:
+                try:
+                    data, addr = udp.recvfrom(2048)
+                except OSError:
+                    return
+                udp_count[0] += 1
+                udp.sendto(data[:16], addr)
+
+        threading.Thread(target=echo, daemon=True).start()
+        tcp = socket.socket()
+        tcp.bind(('127.0.0.1', 0))
+        tcp.listen(1024)
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            def node(name, port):
+                path = os.path.join(tmp, f'{name}.yaml')
+                with open(path, 'w') as f:
+                    yaml.safe_dump({'server': f'127.0.0.1:{port}', 'auth': 'pw'}, f)
+                return File(name, 'hysteria2', path)
+
+            nodes = [node(f'udp{i}', udp.getsockname()[1]) for i in range(300)]
+            nodes.append(node('dead', closed_port))
+            prober = LatencyProber('udp', concurrency=50, timeout=1.0)
+            start = time.monotonic()
+            results = prober.probe_all(nodes)
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual(sum(result.ok for result in results.values()), 300)
+            self.assertFalse(results['dead'].ok)
+            self.assertEqual(udp_count[0], 300)
+
+            # 缓存未过期时不重新探测
+            again = prober.probe_all(nodes)
+            self.assertIs(again['udp0'], results['udp0'])
+            self.assertEqual(udp_count[0], 300)
+            prober.invalidate('udp0')
+            prober.probe_all(nodes)
+            self.assertEqual(udp_count[0], 301)
+
+            tcp_nodes = [node(f'tcp{i}', tcp.getsockname()[1]) for i in range(100)]
+            tcp_results = LatencyProber('tcp', concurrency=20).probe_all(tcp_nodes)
+            self.assertTrue(all(result.ok for result in tcp_results.values()))
+
+            # 损坏或根节点不是字典的节点配置只影响自身, 且不生成解析缓存
+            for name, content in (('broken', 'server: [unclosed\n'), ('listed', '- a\n- b\n')):
+                with open(os.path.join(tmp, f'{name}.yaml'), 'w') as f:
+                    f.write(content)
+            bad = [File(name, 'hysteria2', os.path.join(tmp, f'{name}.yaml')) for name in ('broken', 'listed')]
+            mixed = LatencyProber('tcp').probe_all([*bad, tcp_nodes[0]])
+            self.assertFalse(mixed['broken'].ok)
+            self.assertFalse(mixed['listed'].ok)
+            self.assertTrue(mixed['tcp0'].ok)
+            self.assertFalse(os.path.exists(os.path.join(tmp, '.cache')))
+        udp.close()
+        tcp.close()
+
+    def test_resolver(self):
+        import asyncio
+        import os
+        import socket
+        import struct
+        import tempfile
+        import yaml
+        from talkProxy.tools.config import File
+        from talkProxy.tools.resolver import AsyncResolver, ResolveError
+
+        # 本地 DNS 桩服务: 名称 -> (IPv4 地址列表, TTL), big.test 的 UDP 响应带截断标志, 只能通过 TCP 取得
+        records = {'a.test': (['10.0.0.1'], 300), 'b.test': (['10.0.0.2', '10.0.0.3'], 300),
+                   'p.test': (['10.0.0.4'], 1), 'big.test': (['10.0.1.%d' % i for i in range(50)], 300)}
+        queries = []
+
+        def answer(query, tcp=False):
+            qid, = struct.unpack('!H', query[:2])
+            offset, labels = 12, []
+            while query[offset]:
+                labels.append(query[offset + 1:offset + 1 + query[offset]].decode())
+                offset += query[offset] + 1
+            qtype, = struct.unpack('!H', query[offset + 1:offset + 3])
+            question = query[12:offset + 5]
+            name = '.'.join(labels)
+            queries.append((name, qtype, tcp))
+            addresses, ttl = records.get(name, (None, 0))
+            if addresses is None:
+                return struct.pack('!HHHHHH', qid, 0x8183, 1, 0, 0, 0) + question
+            if qtype != 1:
+                return struct.pack('!HHHHHH', qid, 0x8180, 1, 0, 0, 0) + question
+            if name == 'big.test' and not tcp:
+                return struct.pack('!HHHHHH', qid, 0x8380, 1, 0, 0, 0) + question
+            body = b''.join(struct.pack('!HHHIH', 0xC00C, 1, 1, ttl, 4) + socket.inet_aton(a) for a in addresses)
+            return struct.pack('!HHHHHH', qid, 0x8180, 1, len(addresses), 0, 0) + question + body
+
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind(('127.0.0.1', 0))
+        port = udp.getsockname()[1]
+        tcp = socket.create_server(('127.0.0.1', port))
+
+        def serve_udp():
+            while True:
+                try:
+                    data, addr = udp.recvfrom(4096)
+                except OSError:
+                    return
+                udp.sendto(answer(data), addr)
+
+        def serve_tcp():
+            while True:
+                try:
+                    conn, _ = tcp.accept()
+                except OSError:
+                    return
+                with conn:
+                    length, = struct.unpack('!H', conn.recv(2))
+                    reply = answer(conn.recv(length), tcp=True)
+                    conn.sendall(struct.pack('!H', len(reply)) + reply)
+
+        threading.Thread(target=serve_udp, daemon=True).start()
+        threading.Thread(target=serve_tcp, daemon=True).start()
+
+        hosts_dir = tempfile.TemporaryDirectory()
+        hosts = os.path.join(hosts_dir.name, 'hosts')
+        with open(hosts, 'w') as f:
+            f.write('# comment\n10.9.9.9 static.test alias  # trailing\n::1 static.test\n')
+        empty_hosts = os.path.join(hosts_dir.name, 'empty')
+        open(empty_hosts, 'w').close()
+        # 与桩服务比较查询次数的用例不回退到系统解析
+        stub = {'port': port, 'system_fallback': False, 'hosts_path': empty_hosts}
+
+        async def main():
+            resolver = AsyncResolver(['127.0.0.1'], timeout=1, min_ttl=0, prefetch_ratio=0.5, **stub)
+            self.assertEqual(await resolver.resolve('A.test.'), ['10.0.0.1'])
+            self.assertEqual(len(queries), 2)
+            self.assertEqual(await resolver.resolve('a.test', socket.AF_INET), ['10.0.0.1'])
+            self.assertEqual(len(queries), 2)
+            self.assertEqual(await resolver.resolve('127.0.0.1'), ['127.0.0.1'])
+
+            # 不存在的域名也缓存
+            with self.assertRaises(ResolveError):
+                await resolver.resolve('nx.test', socket.AF_INET)
+            with self.assertRaises(ResolveError):
+                await resolver.resolve('nx.test', socket.AF_INET)
+            self.assertEqual(len(queries), 3)
+
+            # 并发的相同查询只发送一次
+            results = await asyncio.gather(*(resolver.resolve('b.test', socket.AF_INET) for _ in range(20)))
+            self.assertEqual(results[0], ['10.0.0.2', '10.0.0.3'])
+            self.assertEqual(len(queries), 4)
+
+            # 截断后改用 TCP
+            self.assertEqual(len(await resolver.resolve('big.test', socket.AF_INET)), 50)
+            self.assertEqual(queries[-1], ('big.test', 1, True))
+
+            # 剩余 TTL 不足一半时返回缓存并在后台刷新, 原 TTL 到期后仍然命中
+            await resolver.resolve('p.test', socket.AF_INET)
+            count = len(queries)
+            await asyncio.sleep(0.6)
+            self.assertEqual(await resolver.resolve('p.test', socket.AF_INET), ['10.0.0.4'])
+            await asyncio.sleep(0.1)
+            self.assertEqual(len(queries), count + 1)
+            await asyncio.sleep(0.5)
+            await resolver.resolve('p.test', socket.AF_INET)
+            self.assertEqual(len(queries), count + 1)
+
+            # 按 LRU 淘汰
+            small = AsyncResolver(['127.0.0.1'], max_entries=2, **stub)
+            for name in ('a.test', 'b.test', 'a.test', 'p.test'):
+                await small.resolve(name, socket.AF_INET)
+            self.assertEqual(list(small.cache._entries), [('a.test', 1), ('p.test', 1)])
+
+            # 批量解析订阅中的节点, 相同主机只查询一次
+            with tempfile.TemporaryDirectory() as tmp:
+                nodes = []
+                for i, server in enumerate(['a.test:443', 'b.test:20000-30000', 'nx.test', 'a.test:8443']):
+                    path = os.path.join(tmp, f'n{i}.yaml')
+                    with open(path, 'w') as f:
+                        yaml.safe_dump({'server': server}, f)
+                    nodes.append(File(f'n{i}', 'hysteria2', path))
+                fresh = AsyncResolver(['127.0.0.1'], **stub)
+                count = len(queries)
+                result = await fresh.resolve_nodes(nodes, concurrency=2)
+                self.assertEqual(result['n0'], ['10.0.0.1'])
+                self.assertEqual(result['n1'], ['10.0.0.2', '10.0.0.3'])
+                self.assertIsInstance(result['n2'], ResolveError)
+                self.assertEqual(result['n3'], ['10.0.0.1'])
+                self.assertEqual(len(queries), count + 6)
+
+            # 服务器无响应时回退到系统解析
+            closed = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            closed.bind(('127.0.0.1', 0))
+            dead_port = closed.getsockname()[1]
+            closed.close()
+            dead = AsyncResolver(['127.0.0.1'], port=dead_port, timeout=0.2, attempts=1)
+            self.assertIn('127.0.0.1', await dead.resolve('localhost', socket.AF_INET))
+            dead = AsyncResolver(['127.0.0.1'], port=dead_port, timeout=0.2, attempts=1, system_fallback=False, hosts_path=empty_hosts)
+            with self.assertRaises(ResolveError):
+                await dead.resolve('localhost', socket.AF_INET)
+
+            # hosts 文件优先, 不发送查询
+            count = len(queries)
+            local = AsyncResolver(['127.0.0.1'], port=port, system_fallback=False, hosts_path=hosts)
+            self.assertEqual(await local.resolve('ALIAS.', socket.AF_INET), ['10.9.9.9'])
+            self.assertEqual(await local.resolve('static.test', socket.AF_INET6), ['::1'])
+            self.assertEqual(len(queries), count)
+            # 服务器回答域名不存在时交给系统解析(系统 hosts、search 域等)
+            fallback = AsyncResolver(['127.0.0.1'], port=port, hosts_path=empty_hosts)
+            self.assertIn('127.0.0.1', await fallback.resolve('localhost', socket.AF_INET))
+            self.assertEqual(queries[-1], ('localhost', 1, False))
+
+        try:
+            asyncio.run(main())
+        finally:
+            udp.close()
+            tcp.close()
+            hosts_dir.cleanup()
+
+    def test_ring_buffer(self):
+        import os
+        import random
+        from types import SimpleNamespace
+        from unittest import mock
+        import psutil
+        from talkProxy.tools.monitor import MetricsSampler, RingBuffer
+
+        # 环形缓冲的窗口查询与逐条筛选一致
+        rng = random.Random(1)
+        buffer, samples, now = RingBuffer(50), [], 0.0
+        for _ in range(237):
+            now += rng.uniform(0.1, 2)
+            value = rng.uniform(0, 100)
+            buffer.append(now, value)
+            samples.append((now, value))
+            kept = samples[-50:]
+            seconds = rng.uniform(0, 60)
+            times, values = buffer.window(seconds, now)
+            self.assertEqual(list(zip(times, values)), [s for s in kept if s[0] >= now - seconds])
+        self.assertEqual(len(buffer), 50)
+        self.assertEqual(buffer.latest(), samples[-1])
+        with self.assertRaises(ValueError):
+            RingBuffer(0)
+
+        counter = RingBuffer(10)
+        for second in range(20):
+            counter.append(second, second * 100)
+        self.assertEqual(counter.rate(None), 100)
+        self.assertEqual(counter.rate(3, now=19), 100)
+        self.assertIsNone(counter.rate(0.5, now=19))
+        self.assertEqual(counter.rates(2, now=19), ([18.0, 19.0], [100.0, 100.0]))
+        self.assertEqual(counter.percentile(50), 1450)
+
+        # 计数回绕或进程重启后继续累加, 速率不出现负值
+        sampler = MetricsSampler(capacity=10, pids=lambda: {'self': os.getpid()})
+        for second, raw in enumerate((100, 200, 300, 50, 150)):
+            sampler._record_counter('net.test.recv', second, raw)
+        self.assertEqual(sampler.window('net.test.recv')[1], [100, 200, 300, 350, 450])
+        self.assertEqual(sampler.percentile('net.test.recv', 50, rate=True), 100)
+        self.assertIsNone(sampler.rate('missing'))
+
+        start = time.monotonic()
+        sampler.sample()
+        sampler.sample()
+        self.assertLess(time.monotonic() - start, 0.5)
+        names = sampler.names()
+        for name in ('cpu.percent', 'memory.used', 'net.sent', 'net.recv'):
+            self.assertIn(name, names)
+        self.assertEqual(len(sampler.window('memory.used', 60)[0]), 2)
+        if hasattr(psutil.Process, 'io_counters'):
+            self.assertIsNotNone(sampler.rate('process.self.read'))
+
+        # 网卡消失或重新出现时总量不回退, 也没有虚假的峰值
+        sampler = MetricsSampler(capacity=10)
+        rounds = ({'eth0': 1000, 'tun0': 5000}, {'eth0': 1100}, {'eth0': 1200, 'tun0': 10})
+        for second, nics in enumerate(rounds):
+            counters = {nic: SimpleNamespace(bytes_sent=value, bytes_recv=value) for nic, value in nics.items()}
+            with mock.patch.object(psutil, 'net_io_counters', return_value=counters):
+                sampler.sample(now=second)
+        self.assertEqual(sampler.window('net.recv')[1], [6000, 6100, 6210])
+        self.assertEqual(sampler.rates('net.sent')[1], [100, 110])
+
+    def test_metrics_service(self):
+        from talkProxy.tools.monitor import MetricsService, get_cpu_info, get_cpu_precent
+
+        with self.assertRaises(ValueError):
+            MetricsService(interval=0)
+        service = MetricsService(interval=0.05, capacity=100)
+        received = []
+        service.add_listener(received.append)
+        service.start()
+        try:
+            # 启动后立即有快照可读
+            first = service.snapshot()
+            self.assertIsNotNone(first.cpu.cores_num)
+            self.assertGreater(first.memory.total, 0)
+            # 第一次采样只建立 CPU 基准
+            self.assertIsNone(first.cpu.cpu_precent)
+            time.sleep(0.3)
+            latest = service.snapshot()
+            self.assertIsNotNone(latest.cpu.cpu_precent)
+            self.assertGreater(latest.timestamp, first.timestamp)
+            self.assertIsNotNone(service.sampler.rate('net.recv'))
+            self.assertGreaterEqual(len(received), 3)
+            self.assertIs(received[-1], latest)
+            self.assertGreaterEqual(len(service.sampler.window('cpu.percent')[0]), 3)
+            service.set_interval(10)
+            with self.assertRaises(ValueError):
+                service.set_interval(-1)
+        finally:
+            service.stop()
+        self.assertEqual(latest.__dict__()['net_recv'], latest.net_recv)
+
+        # 兼容的函数不再阻塞 1 秒
+        start = time.monotonic()
+        self.assertIsInstance(get_cpu_precent(), (float, type(None)))
+        self.assertIsNone(get_cpu_info().cpu_avgload)
+        get_cpu_info(averge=True)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_metrics_exporter(self):
+        import gc
+        import urllib.error
+        import urllib.request
+        from talkProxy.tools.metrics import Counter, Family, Gauge, Histogram, MetricsServer, Registry
+
+        registry = Registry()
+        counter = Counter('test_events_total', 'events', registry=registry)
+        labelled = Counter('test_results_total', 'results "quoted"', ['result'], registry=registry)
+        gauge = Gauge('test_level', 'level', registry=registry)
+        histogram = Histogram('test_seconds', 'seconds', ['kind'], buckets=(0.1, 1), registry=registry)
+        with self.assertRaises(ValueError):
+            Counter('test_events_total', 'duplicate', registry=registry)
+        with self.assertRaises(ValueError):
+            counter.inc(-1)
+        with self.assertRaises(ValueError):
+            labelled.labels('a', 'b')
+
+        # 多线程不加锁累加, 包括已退出线程的计数
+        def work():
+            for _ in range(10000):
+                counter.inc()
+                labelled.labels('ok').inc()
+            histogram.labels(kind='x').observe(0.05)
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.value(), 80000)
+        self.assertEqual(labelled.labels(result='ok').value(), 80000)
+
+        # threading 不跟踪的原生线程: 抓取不会丢弃其单元格, 线程退出后计数保留
+        import _thread
+        started, resume, finished = threading.Event(), threading.Event(), threading.Event()
+
+        def native():
+            counter.inc()
+            started.set()
+            resume.wait()
+            counter.inc(2)
+            finished.set()
+        _thread.start_new_thread(native, ())
+        started.wait(5)
+        self.assertEqual(counter.value(), 80001)
+        resume.set()
+        finished.wait(5)
+        self.assertEqual(counter.value(), 80003)
+        deadline = time.monotonic() + 5
+        while counter._default._cells._cells and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(counter.value(), 80003)
+        labelled.labels('bad\n"x"').inc(2)
+        gauge.set(5)
+        gauge.dec(1.5)
+        histogram.labels('x').observe(0.5)
+        histogram.labels('x').observe(7)
+
+        class Owner:
+            def collect(self):
+                yield Family('test_owned', 'gauge', 'owned', [('', (('name', 'a'),), 1)])
+        owner = Owner()
+        registry.register_collector(owner.collect)
+
+        def failing():
+            raise RuntimeError('collector failed')
+        # 出错的收集器只记录日志, 不影响其他指标
+        registry.register_collector(failing)
+
+        text = registry.render()
+        self.assertIn('# TYPE test_events_total counter\ntest_events_total 80003.0\n', text)
+        self.assertIn('# HELP test_results_total results "quoted"\n', text)
+        self.assertIn('test_results_total{result="bad\\n\\"x\\""} 2.0\n', text)
+        self.assertIn('test_level 3.5\n', text)
+        self.assertIn('test_seconds_bucket{kind="x",le="0.1"} 8.0\n', text)
+        self.assertIn('test_seconds_bucket{kind="x",le="1.0"} 9.0\n', text)
+        self.assertIn('test_seconds_bucket{kind="x",le="+Inf"} 10.0\n', text)
+        self.assertIn('test_seconds_count{kind="x"} 10.0\n', text)
+        self.assertIn('test_owned{name="a"} 1.0\n', text)
+        # 对象回收后绑定方法的收集器自动移除
+        del owner
+        gc.collect()
+        self.assertNotIn('test_owned', registry.render())
+
+        server = MetricsServer(port=0, registry=registry)
+        server.start()
+        try:
+            host, port = server.address
+            self.assertEqual(host, '127.0.0.1')
+            with urllib.request.urlopen(f'http://{host}:{port}/metrics', timeout=5) as response:
+                self.assertEqual(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+                self.assertIn('test_events_total 80003.0', response.read().decode())
+            with self.assertRaises(urllib.error.HTTPError) as raised:
+                urllib.request.urlopen(f'http://{host}:{port}/other', timeout=5)
+            self.assertEqual(raised.exception.code, 404)
+        finally:
+            server.stop()
+
+        # 模块中接入的指标出现在默认注册表中
+        from talkProxy.tools.metrics import REGISTRY
+        import talkProxy.core.proxyManager
+        import talkProxy.tools.probe  # noqa: F401
+        text = REGISTRY.render()
+        for name in ('talkproxy_subscription_fetch_seconds', 'talkproxy_config_writes_total', 'talkproxy_hysteria_starts_total',
+                     'talkproxy_log_dropped_total', 'talkproxy_probe_latency_seconds', 'talkproxy_hysteria_uptime_seconds'):
+            self.assertIn(f'# TYPE {name} ', text)
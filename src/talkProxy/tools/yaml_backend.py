@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import marshal
+import os
+import sys
+import tempfile
+from typing import IO, Any, Optional
+
+import yaml
+
+try:
+    from yaml import CDumper as Dumper
+    from yaml import CSafeLoader as SafeLoader
+
+    LIBYAML = True
+except ImportError:
+    from yaml import Dumper, SafeLoader
+
+    LIBYAML = False
+
+CACHE_DIR_NAME = ".cache"
+# marshal 格式随 Python 版本变化, 版本不同时缓存失效
+_CACHE_VERSION = (1, marshal.version, sys.version_info[:2])
+
+
+def safe_load(stream: str | bytes | IO) -> Any:
+    """有 libyaml 时使用 C 实现的解析器"""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump(data: Any, stream: Optional[IO] = None) -> Optional[str]:
+    return yaml.dump(data, stream, Dumper=Dumper)
+
+
+def cache_path(file_path: str) -> str:
+    file_path = os.path.abspath(file_path)
+    return os.path.join(os.path.dirname(file_path), CACHE_DIR_NAME, f"{os.path.basename(file_path)}.marshal")
+
+
+def _read_cache(file_path: str, key: tuple) -> tuple[bool, Any]:
+    try:
+        with open(cache_path(file_path), "rb") as f:
+            # 本进程自己写入的本地缓存, 键中包含源文件的签名, 不读取外部数据
+            cache_key, data = marshal.load(f)  # noqa: S302
+    except (OSError, EOFError, ValueError, TypeError):
+        return False, None
+    if cache_key != key:
+        return False, None
+    return True, data
+
+
+def _write_cache(file_path: str, key: tuple, data: Any) -> None:
+    path = cache_path(file_path)
+    try:
+        payload = marshal.dumps((key, data))
+    except ValueError:
+        # 含有 marshal 不支持的类型(如 yaml 解析出的日期), 不缓存
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.debug(f"写入解析缓存失败:{e}")
+
+
+def load_file(file_path: str, use_cache: bool = True) -> Any:
+    """读取 yaml 文件; use_cache 时优先使用以 路径/mtime/大小/内容哈希 为键的二进制缓存"""
+    with open(file_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        raw = f.read()
+    if not use_cache:
+        return safe_load(raw)
+    key = (
+        _CACHE_VERSION,
+        os.path.abspath(file_path),
+        st.st_mtime_ns,
+        st.st_size,
+        hashlib.blake2b(raw, digest_size=16).hexdigest(),
+    )
+    hit, data = _read_cache(file_path, key)
+    if hit:
+        return data
+    data = safe_load(raw)
+    _write_cache(file_path, key, data)
+    return data
@@ -0,0 +1,141 @@
+from typing import IO, Iterable, Iterator, Optional
+
+import yaml
+from yaml.composer import Composer
+from yaml.events import (
+    CollectionEndEvent,
+    CollectionStartEvent,
+    DocumentStartEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+    StreamStartEvent,
+)
+from yaml.nodes import MappingNode
+
+try:
+    from yaml.cyaml import CParser as _Parser
+
+    _LIBYAML = True
+except ImportError:
+    from yaml.parser import Parser as _Parser
+    from yaml.reader import Reader
+    from yaml.scanner import Scanner
+
+    _LIBYAML = False
+
+
+class StreamTooLarge(ValueError):
+    pass
+
+
+class NotSubscription(ValueError):
+    """文档根节点不是字典, 或没有 proxies 列表(例如返回了 HTML 页面)"""
+
+
+if _LIBYAML:
+
+    class _StreamLoader(_Parser, Composer, yaml.constructor.SafeConstructor, yaml.resolver.Resolver):
+        def __init__(self, stream: IO) -> None:
+            _Parser.__init__(self, stream)
+            Composer.__init__(self)
+            yaml.constructor.SafeConstructor.__init__(self)
+            yaml.resolver.Resolver.__init__(self)
+
+else:
+
+    class _StreamLoader(Reader, Scanner, _Parser, Composer, yaml.constructor.SafeConstructor, yaml.resolver.Resolver):
+        def __init__(self, stream: IO) -> None:
+            Reader.__init__(self, stream)
+            Scanner.__init__(self)
+            _Parser.__init__(self)
+            Composer.__init__(self)
+            yaml.constructor.SafeConstructor.__init__(self)
+            yaml.resolver.Resolver.__init__(self)
+
+
+class ChunkStream:
+    """把字节块迭代器包装为只读文件对象, 累计读取超过 max_bytes 时抛出 StreamTooLarge"""
+
+    def __init__(self, chunks: Iterable[bytes], max_bytes: Optional[int] = None) -> None:
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.name = "<stream>"
+
+    def _on_chunk(self, chunk: bytes) -> None:
+        self.bytes_read += len(chunk)
+        if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+            raise StreamTooLarge(f"订阅内容超过{self.max_bytes}字节上限")
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            self._on_chunk(chunk)
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _skip_node(loader: _StreamLoader) -> None:
+    """跳过当前节点而不构造对象"""
+    event = loader.get_event()
+    if not isinstance(event, CollectionStartEvent):
+        return
+    depth = 1
+    while depth:
+        event = loader.get_event()
+        if isinstance(event, CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, CollectionEndEvent):
+            depth -= 1
+
+
+def iter_proxies(stream: IO, key: str = "proxies") -> Iterator[dict]:
+    """从订阅文档流中逐个解析 proxies 列表的元素, 不在内存中保留整份文档
+
+    文档根节点不是字典或没有 proxies 列表时抛出 NotSubscription
+    """
+    loader = _StreamLoader(stream)
+    try:
+        if not loader.check_event(StreamStartEvent):
+            raise NotSubscription("订阅内容为空")
+        loader.get_event()
+        if not loader.check_event(DocumentStartEvent):
+            raise NotSubscription("订阅内容为空")
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            raise NotSubscription("订阅文档根节点不是字典")
+        loader.get_event()
+        found = False
+        while not loader.check_event(MappingEndEvent):
+            if not loader.check_event(ScalarEvent):
+                _skip_node(loader)
+                _skip_node(loader)
+                continue
+            name = loader.get_event().value
+            if name != key or not loader.check_event(SequenceStartEvent):
+                _skip_node(loader)
+                continue
+            found = True
+            loader.get_event()
+            while not loader.check_event(SequenceEndEvent):
+                node = loader.compose_node(None, None)
+                if not isinstance(node, MappingNode):
+                    continue
+                yield loader.construct_document(node)
+            loader.get_event()
+        if not found:
+            raise NotSubscription(f"订阅中没有{key}列表")
+    finally:
+        loader.dispose()